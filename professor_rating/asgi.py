@@ -5,6 +5,25 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
+
+Async deployment
+----------------
+The read-heavy endpoints have native async versions under ``/api/async/``
+(see ``ratings/async_views.py``). Served through this module by an ASGI
+server, a request that is waiting on a slow client costs a coroutine instead
+of a worker thread; ORM calls still run in a short-lived executor thread but
+only for the duration of the query. For example::
+
+    pip install uvicorn
+    python manage.py collectstatic --noinput
+    uvicorn professor_rating.asgi:application --host 0.0.0.0 --port 8000 \
+        --workers 4 --timeout-keep-alive 30
+
+Use roughly one worker per CPU core; each worker handles many concurrent
+connections. Keep persistent connections off in this mode
+(``DJANGO_CONN_MAX_AGE=0`` with the production database profile), since
+Django's async request handling does not reuse them. The synchronous DRF
+views keep working under the same server, each running in a thread.
 """
 
 import os
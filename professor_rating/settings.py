@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost, so its latency covers the whole middleware stack
+    'ratings.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,6 +88,105 @@ DATABASES = {
     }
 }
 
+# DJANGO_DATABASE_PROFILE=production tunes SQLite for concurrent use and sends
+# reads to a separate read-only connection (see ratings/db_routers.py).
+DATABASE_PROFILE = os.environ.get('DJANGO_DATABASE_PROFILE', 'development')
+
+if DATABASE_PROFILE == 'production':
+    SQLITE_PRAGMAS = 'PRAGMA synchronous=NORMAL; PRAGMA mmap_size=268435456; PRAGMA temp_store=MEMORY;'
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # WAL lets readers proceed while a write is in progress
+            'init_command': 'PRAGMA journal_mode=WAL; ' + SQLITE_PRAGMAS,
+            # Take the write lock at BEGIN so writers queue on the busy timeout
+            # instead of failing with "database is locked" mid-transaction
+            'transaction_mode': 'IMMEDIATE',
+            # sqlite3's timeout is the busy_timeout, in seconds
+            'timeout': 20,
+        },
+        # A file rather than the in-memory default, so the test suite runs on
+        # WAL with the replica as a real second connection
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    })
+    # Either a separate replica file or, by default, a second connection to the
+    # same WAL database that SQLite refuses to write through.
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DJANGO_REPLICA_DATABASE', DATABASES['default']['NAME']),
+        'CONN_MAX_AGE': DATABASES['default']['CONN_MAX_AGE'],
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'init_command': 'PRAGMA query_only=ON; ' + SQLITE_PRAGMAS,
+            'timeout': 20,
+        },
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    }
+    DATABASE_ROUTERS = ['ratings.db_routers.PrimaryReplicaRouter']
+
+
+# Response cache for the read endpoints (ratings/response_cache.py). The
+# local-memory backend evicts least recently used entries past MAX_ENTRIES and
+# is private to each process, so it only suits a single-process server:
+# invalidations from other workers and from management commands
+# (import_catalogue, reconcile_averages, archive_ratings, run_aggregator, ...)
+# never reach it, and its entries stay stale for up to TIMEOUT seconds. Those
+# commands warn when run with it. Set DJANGO_RESPONSE_CACHE_DIR to share one
+# file-based cache between workers and management commands instead.
+RESPONSE_CACHE_DIR = os.environ.get('DJANGO_RESPONSE_CACHE_DIR')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': (
+            'django.core.cache.backends.filebased.FileBasedCache' if RESPONSE_CACHE_DIR
+            else 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': RESPONSE_CACHE_DIR or 'ratings-responses',
+        'TIMEOUT': int(os.environ.get('DJANGO_RESPONSE_CACHE_TIMEOUT', 300)),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('DJANGO_RESPONSE_CACHE_MAX_ENTRIES', 2000)),
+        },
+    },
+}
+
+
+# Prior for the Bayesian-adjusted score the leaderboard ranks by: every
+# professor starts with RATING_PRIOR_WEIGHT (> 0) virtual ratings of
+# RATING_PRIOR_MEAN. Run reconcile_averages and backfill_module_ratings after
+# changing either.
+RATING_PRIOR_MEAN = float(os.environ.get('DJANGO_RATING_PRIOR_MEAN', 3.0))
+RATING_PRIOR_WEIGHT = float(os.environ.get('DJANGO_RATING_PRIOR_WEIGHT', 5))
+
+
+# 'sync' updates rating aggregates inside every rating write. 'deferred' only
+# queues the professor and leaves the recompute to manage.py run_aggregator,
+# which drains the queue every RATING_AGGREGATE_MAX_DELAY seconds; aggregates
+# then lag writes by at most about that long.
+RATING_AGGREGATES = os.environ.get('DJANGO_RATING_AGGREGATES', 'sync')
+RATING_AGGREGATE_MAX_DELAY = float(os.environ.get('DJANGO_RATING_AGGREGATE_MAX_DELAY', 5))
+RATING_AGGREGATE_BATCH_SIZE = 500
+
+
+# Academic years before this one can be moved out of Rating by
+# manage.py archive_ratings; their totals stay in every aggregate and reads
+# spanning those years merge the archive back in. None disables archiving.
+# Keep the setting once ratings have been archived.
+RATING_ARCHIVE_BEFORE_YEAR = os.environ.get('DJANGO_RATING_ARCHIVE_BEFORE_YEAR')
+RATING_ARCHIVE_BEFORE_YEAR = int(RATING_ARCHIVE_BEFORE_YEAR) if RATING_ARCHIVE_BEFORE_YEAR else None
+
+
+# How often, in seconds, each worker compares its catalogue snapshot
+# (ratings/snapshot.py) with the database; 0 checks on every rating write
+RATING_SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('DJANGO_RATING_SNAPSHOT_CHECK_INTERVAL', 1.0))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -132,7 +233,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'ratings.authentication.CachedBasicAuthentication',
+        'ratings.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'ratings.pagination.KeysetPagination',
+    'DEFAULT_RENDERER_CLASSES': [
+        'ratings.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
 }
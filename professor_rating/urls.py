@@ -18,7 +18,9 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken import views as authtoken_views
-from ratings.views import ProfessorViewSet, ModuleViewSet, ModuleInstanceViewSet, RatingViewSet, RegisterView, RateProfessorView, AverageRatingView, RatingsListView, ListModulesView, LogoutView
+from ratings import async_views
+from ratings.metrics import metrics_view
+from ratings.views import ProfessorViewSet, ModuleViewSet, ModuleInstanceViewSet, RatingViewSet, RegisterView, RateProfessorView, BulkRateProfessorView, AverageRatingView, RatingsListView, ListModulesView, LogoutView, RatingExportView, LeaderboardView, AnalyticsView, SearchView
 
 router = DefaultRouter()
 router.register(r'professors', ProfessorViewSet)
@@ -33,8 +35,27 @@ urlpatterns = [
     path('api/token/', authtoken_views.obtain_auth_token, name='token_obtain_pair'),
     path('api/logout/', LogoutView.as_view(), name='logout'),
     path('api/rate/', RateProfessorView.as_view(), name='rate_professor'),
+    path('api/rate/bulk/', BulkRateProfessorView.as_view(), name='rate_professor_bulk'),
     path('api/average-rating/', AverageRatingView.as_view(), name='average_rating'),
     path('api/ratings-list/', RatingsListView.as_view(), name='ratings_list'),
     path('api/list-modules/', ListModulesView.as_view(), name='list_modules'),
+    path('api/leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('api/analytics/', AnalyticsView.as_view(), name='analytics'),
+    path('api/search/', SearchView.as_view(), name='search'),
+    path('api/export/ratings/', RatingExportView.as_view(), name='export_ratings'),
+    path('api/metrics/', metrics_view, name='metrics'),
+
+    # Async read endpoints, for deployments behind professor_rating/asgi.py
+    path('api/async/list-modules/', async_views.list_modules, name='async_list_modules'),
+    path('api/async/ratings-list/', async_views.ratings_list, name='async_ratings_list'),
+    path('api/async/average-rating/', async_views.average_rating, name='async_average_rating'),
+    path('api/async/professors/', async_views.professor_list, name='async_professor_list'),
+    path('api/async/professors/<str:pk>/', async_views.professor_detail, name='async_professor_detail'),
+    path('api/async/modules/', async_views.module_list, name='async_module_list'),
+    path('api/async/modules/<str:pk>/', async_views.module_detail, name='async_module_detail'),
+    path('api/async/module-instances/', async_views.module_instance_list, name='async_module_instance_list'),
+    path('api/async/module-instances/<int:pk>/', async_views.module_instance_detail, name='async_module_instance_detail'),
+    path('api/async/ratings/', async_views.rating_list, name='async_rating_list'),
+    path('api/async/ratings/<int:pk>/', async_views.rating_detail, name='async_rating_detail'),
 
 ]
\ No newline at end of file
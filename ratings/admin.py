@@ -1,8 +1,142 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections, transaction
+from django.utils.functional import cached_property
+
+from .ingest import chunked, refresh_professor_aggregates, schedule_aggregate_refresh
 from .models import Professor, Module, ModuleInstance, Rating
+from .response_cache import invalidate_responses
+
+# Unfiltered changelists of tables at least this big show the planner's row
+# estimate instead of running COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def estimated_count(model, using):
+    # Row estimate from the database's statistics, or None when there is none.
+    # On SQLite the statistics come from ANALYZE.
+    connection = connections[using]
+    table = model._meta.db_table
+    queries = {
+        'postgresql': ('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [connection.ops.quote_name(table)]),
+        'mysql': ('SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s', [table]),
+        'sqlite': ('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table]),
+    }
+    if connection.vendor not in queries:
+        return None
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute(*queries[connection.vendor])
+            row = cursor.fetchone()
+    except DatabaseError:
+        # sqlite_stat1 only exists once ANALYZE has run
+        return None
+    if row is None or row[0] is None:
+        return None
+    # SQLite's stat column starts with the row count
+    estimate = int(str(row[0]).split()[0])
+    return estimate if estimate >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    # Exact counts for filtered changelists, which the indexes below keep
+    # cheap; an estimate for the whole of a large table
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) behind "N total" on filtered pages
+    show_full_result_count = False
+
+
+def recompute_professors(modeladmin, request, professor_ids):
+    # Same batched GROUP BY recompute as reconcile_averages, for the selection only
+    professor_ids = set(professor_ids)
+    with transaction.atomic():
+        refresh_professor_aggregates(professor_ids)
+        invalidate_responses('aggregates')
+    modeladmin.message_user(request, f'Recomputed aggregates for {len(professor_ids)} professor(s).', messages.SUCCESS)
+
+
+class RatingCascadeMixin:
+    # Deleting these rows also deletes ratings without Rating.delete(), so the
+    # affected professors are recomputed once afterwards. rating_lookup is the
+    # path from Rating to this model.
+    rating_lookup = None
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            professor_ids = set()
+            for chunk in chunked(queryset.values_list('pk', flat=True)):
+                professor_ids.update(
+                    Rating.objects.filter(**{f'{self.rating_lookup}__in': chunk}).values_list('professor_id', flat=True).distinct()
+                )
+            super().delete_queryset(request, queryset)
+            schedule_aggregate_refresh(professor_ids)
+
+    def delete_model(self, request, obj):
+        self.delete_queryset(request, type(obj).objects.filter(pk=obj.pk))
+
+
+@admin.register(Professor)
+class ProfessorAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'average_rating', 'rating_count', 'last_updated')
+    search_fields = ('id', 'name')
+    readonly_fields = ('average_rating', 'rating_sum', 'rating_count', 'bayesian_score')
+    actions = ['recompute_aggregates']
+
+    @admin.action(description='Recompute rating aggregates')
+    def recompute_aggregates(self, request, queryset):
+        recompute_professors(self, request, queryset.values_list('pk', flat=True))
+
+
+@admin.register(Module)
+class ModuleAdmin(RatingCascadeMixin, admin.ModelAdmin):
+    rating_lookup = 'module_instance__module'
+    list_display = ('code', 'name', 'last_updated')
+    search_fields = ('code', 'name')
+
+
+@admin.register(ModuleInstance)
+class ModuleInstanceAdmin(RatingCascadeMixin, LargeTableAdmin):
+    rating_lookup = 'module_instance'
+    list_display = ('id', 'module', 'year', 'semester', 'last_updated')
+    list_select_related = ('module',)
+    list_filter = ('year', 'semester')
+    # Matches the autocomplete widgets on RatingAdmin
+    search_fields = ('module__code', 'module__name')
+    autocomplete_fields = ('module', 'professors')
+
+    def get_queryset(self, request):
+        # __str__ reads the module, including in autocomplete results
+        return super().get_queryset(request).select_related('module')
+
+
+@admin.register(Rating)
+class RatingAdmin(RatingCascadeMixin, LargeTableAdmin):
+    rating_lookup = 'pk'
+    list_display = ('id', 'professor', 'module_instance', 'user', 'rating', 'last_updated')
+    list_select_related = ('professor', 'module_instance__module', 'user')
+    # Served by the ModuleInstance indexes. Professor and module filters would
+    # list every row of those tables in the sidebar on each page load; the
+    # changelist still takes ?professor=<id> and ?module_instance=<id>.
+    list_filter = ('module_instance__year', 'module_instance__semester')
+    autocomplete_fields = ('professor', 'module_instance')
+    raw_id_fields = ('user',)
+    actions = ['recompute_aggregates']
 
+    def delete_model(self, request, obj):
+        # Rating.delete() keeps the aggregates itself
+        obj.delete()
 
-admin.site.register(Professor)
-admin.site.register(Module)
-admin.site.register(ModuleInstance)
-admin.site.register(Rating)
+    @admin.action(description="Recompute the selected ratings' professor aggregates")
+    def recompute_aggregates(self, request, queryset):
+        recompute_professors(self, request, queryset.values_list('professor_id', flat=True).distinct())
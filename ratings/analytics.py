@@ -0,0 +1,71 @@
+import math
+from itertools import chain
+
+from django.db.models import Count
+
+# Rating distributions per professor and per module, built from one GROUP BY
+# over (professor, module, year, semester, star value). Every statistic below
+# is derived from those histogram counts, so the work in Python grows with the
+# number of distinct groups rather than with the number of ratings.
+STARS = range(1, 6)
+
+
+def summarise(histogram):
+    count = sum(histogram.values())
+    if not count:
+        return {'count': 0, 'mean': None, 'median': None, 'stddev': None}
+    mean = sum(star * n for star, n in histogram.items()) / count
+    variance = sum(n * (star - mean) ** 2 for star, n in histogram.items()) / count
+    return {
+        'count': count,
+        'mean': round(mean, 3),
+        'median': histogram_median(histogram, count),
+        'stddev': round(math.sqrt(variance), 3),
+    }
+
+
+def histogram_median(histogram, count):
+    # Middle value(s) of the sorted ratings, found by walking the cumulative counts
+    middle = {(count - 1) // 2, count // 2}
+    values = []
+    seen = 0
+    for star in sorted(histogram):
+        n = histogram[star]
+        values += [star for position in middle if seen <= position < seen + n]
+        seen += n
+    return sum(values) / len(values)
+
+
+def describe(histogram, terms):
+    summary = summarise(histogram)
+    summary['histogram'] = {str(star): histogram.get(star, 0) for star in sorted(set(STARS) | set(histogram))}
+    summary['trend'] = [
+        dict(year=year, semester=semester, **summarise(term))
+        for (year, semester), term in sorted(terms.items())
+    ]
+    return summary
+
+
+def rating_analytics(*sources):
+    # One GROUP BY per source (the live and archived ratings), merged here
+    rows = chain.from_iterable(
+        ratings.order_by().values_list(
+            'professor_id', 'module_instance__module_id', 'module_instance__year', 'module_instance__semester', 'rating'
+        ).annotate(n=Count('id'))
+        for ratings in sources
+    )
+
+    # subject -> (histogram, {(year, semester): histogram})
+    professors = {}
+    modules = {}
+    for professor_id, module_code, year, semester, star, n in rows:
+        for groups, subject in ((professors, professor_id), (modules, module_code)):
+            histogram, terms = groups.setdefault(subject, ({}, {}))
+            histogram[star] = histogram.get(star, 0) + n
+            term = terms.setdefault((year, semester), {})
+            term[star] = term.get(star, 0) + n
+
+    return {
+        'professors': {subject: describe(*groups) for subject, groups in sorted(professors.items())},
+        'modules': {subject: describe(*groups) for subject, groups in sorted(modules.items())},
+    }
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import transaction
+
+from .ingest import LOOKUP_CHUNK_SIZE
+from .models import ArchivedAggregate, ArchivedRating, Rating
+from .response_cache import invalidate_responses
+
+# Ratings for academic years before RATING_ARCHIVE_BEFORE_YEAR can be moved out
+# of Rating by manage.py archive_ratings. Their totals are folded into
+# ArchivedAggregate, which every aggregate recompute adds back in, so the
+# professor and per-module figures stay all-time while Rating, and everything
+# that lists or groups it, only holds the open years. Reads that can span an
+# archived year merge both tables through rating_sources(); the /api/ratings/
+# resource does not, since it serves rows that can still be edited.
+ARCHIVE_FIELDS = ['id', 'module_instance_id', 'professor_id', 'user_id', 'rating', 'last_updated']
+
+
+def includes_archive(year=None):
+    # Whether a read limited to this academic year (None: every year) can
+    # reach archived ratings
+    cutoff = settings.RATING_ARCHIVE_BEFORE_YEAR
+    return cutoff is not None and (year is None or year < cutoff)
+
+
+def rating_sources(year=None):
+    # Querysets to merge for a read over this year. Both models share field
+    # names, so the same filters apply to each.
+    sources = [Rating.objects.all()]
+    if includes_archive(year):
+        sources.append(ArchivedRating.objects.all())
+    return sources
+
+
+def archivable_ratings(before_year):
+    return Rating.objects.filter(module_instance__year__lt=before_year)
+
+
+def archive_ratings(before_year, batch_size=LOOKUP_CHUNK_SIZE):
+    # Moves ratings in primary key order, one transaction per batch, and
+    # returns how many were moved. Professor and ProfessorModuleRating already
+    # count these ratings, so they are left alone. The delete skips the
+    # per-row signals, so the cached responses are invalidated once per batch.
+    ratings = archivable_ratings(before_year).order_by('pk').values_list(*ARCHIVE_FIELDS, 'module_instance__module_id')
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(ratings[:batch_size])
+            if not rows:
+                return moved
+            ArchivedRating.objects.bulk_create([ArchivedRating(**dict(zip(ARCHIVE_FIELDS, row))) for row in rows])
+            ArchivedAggregate.add_ratings([(row[2], row[6], row[4]) for row in rows])
+            archived = Rating.objects.filter(pk__in=[row[0] for row in rows])
+            archived._raw_delete(archived.db)
+            invalidate_responses('rating', *sorted({f'rating:{row[2]}' for row in rows}))
+        moved += len(rows)
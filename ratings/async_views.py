@@ -0,0 +1,142 @@
+import json
+
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
+from rest_framework.request import Request
+
+from .catalogue import aget_module_listing
+from .conditional import aconditional_response, aqueryset_state
+from .models import Professor, Module, ModuleInstance, ProfessorModuleRating, Rating
+from .pagination import KeysetPagination
+from .serializers import ProfessorSerializer, ModuleSerializer, ModuleInstanceSerializer, RatingSerializer
+from .views import RatingsListView
+
+# Native async counterparts of the read-heavy endpoints, meant to be served by
+# an ASGI server (see professor_rating/asgi.py). They only use the async ORM
+# interface, so a request waiting on a slow client holds no worker thread.
+
+
+def error(message, status):
+    return JsonResponse({'status': 'error', 'message': message}, status=status)
+
+
+@require_safe
+async def list_modules(request):
+    result, last_modified, digest = await aget_module_listing()
+
+    async def build():
+        return JsonResponse(result, safe=False)
+
+    return await aconditional_response(request, last_modified, digest, build)
+
+
+@require_safe
+async def ratings_list(request):
+    professors = Professor.objects.all()
+
+    async def build():
+        result = [RatingsListView.describe(professor) async for professor in professors]
+        return JsonResponse({'status': 'success', 'ratings': result})
+
+    last_modified, count = await aqueryset_state(professors)
+    return await aconditional_response(request, last_modified, (last_modified, count), build)
+
+
+@csrf_exempt
+@require_POST
+async def average_rating(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError:
+            return error('Malformed JSON body', 400)
+        if not isinstance(data, dict):
+            return error('Malformed JSON body', 400)
+    else:
+        data = request.POST
+    professor_id = data.get('professor_id')
+    module_code = data.get('module_code')
+
+    if not professor_id or not module_code:
+        return error('Professor ID and Module ID are required', 400)
+
+    try:
+        aggregate = await ProfessorModuleRating.objects.select_related('professor', 'module').aget(
+            pk=ProfessorModuleRating.make_key(professor_id, module_code)
+        )
+        professor, module, average = aggregate.professor, aggregate.module, aggregate.average_rating
+    except ProfessorModuleRating.DoesNotExist:
+        try:
+            professor = await Professor.objects.aget(id=professor_id)
+            module = await Module.objects.aget(code=module_code)
+        except Professor.DoesNotExist:
+            return error('Professor not found', 404)
+        except Module.DoesNotExist:
+            return error('Module not found', 404)
+        average = None
+
+    return JsonResponse({
+        'status': 'success',
+        'average_rating': average,
+        'module_name': module.name,
+        'professor_name': professor.name
+    })
+
+
+def resource_views(queryset, serializer_class):
+    # Async list (keyset-paginated with ?after=<pk>) and retrieve for one model
+
+    @require_safe
+    async def list_view(request):
+        try:
+            # Clamped both ways: page[:0] and rows[-1] cannot take an empty page
+            page_size = max(1, min(
+                int(request.GET.get('page_size', KeysetPagination.page_size)), KeysetPagination.max_page_size
+            ))
+            page = queryset.order_by('pk')
+            if request.GET.get('after'):
+                page = page.filter(pk__gt=request.GET['after'])
+        except ValueError:
+            return error('Invalid page_size or after parameter', 400)
+
+        async def build():
+            rows = [obj async for obj in page[:page_size + 1]]
+            more = len(rows) > page_size
+            rows = rows[:page_size]
+            serializer = serializer_class(rows, many=True, context={'request': Request(request)})
+            next_url = None
+            if more:
+                params = request.GET.copy()
+                params['after'] = rows[-1].pk
+                next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+            return JsonResponse({'next': next_url, 'results': serializer.data})
+
+        last_modified, count = await aqueryset_state(queryset.all())
+        return await aconditional_response(request, last_modified, (last_modified, count), build)
+
+    @require_safe
+    async def detail_view(request, pk):
+        try:
+            matching = queryset.filter(pk=pk)
+        except ValueError:
+            return error('Not found', 404)
+
+        async def build():
+            obj = await matching.afirst()
+            if obj is None:
+                return error('Not found', 404)
+            return JsonResponse(serializer_class(obj, context={'request': Request(request)}).data)
+
+        last_modified, count = await aqueryset_state(matching)
+        return await aconditional_response(request, last_modified, (last_modified, count), build)
+
+    return list_view, detail_view
+
+
+professor_list, professor_detail = resource_views(Professor.objects.all(), ProfessorSerializer)
+module_list, module_detail = resource_views(Module.objects.all(), ModuleSerializer)
+module_instance_list, module_instance_detail = resource_views(
+    ModuleInstance.objects.prefetch_related('professors'), ModuleInstanceSerializer
+)
+rating_list, rating_detail = resource_views(Rating.objects.all(), RatingSerializer)
@@ -0,0 +1,111 @@
+import copy
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+
+from .metrics import REGISTRY
+
+# Successful credential checks are remembered per process for a short while, so
+# an authenticated request costs a dictionary lookup instead of a token query
+# or a PBKDF2 run. Token deletes and user saves evict entries through the
+# receivers in signals.py; other processes keep an entry for at most the TTL.
+CREDENTIAL_CACHE_SIZE = 10000
+CREDENTIAL_CACHE_TTL = 60
+
+
+class CredentialCache:
+    # Bounded LRU with a per-entry expiry
+
+    def __init__(self, max_size=CREDENTIAL_CACHE_SIZE, ttl=CREDENTIAL_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, _, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, user_id, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, user_id, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def discard_user(self, user_id):
+        with self.lock:
+            for key in [key for key, (_, owner, _) in self.entries.items() if owner == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+TOKENS = CredentialCache()
+BASIC_CREDENTIALS = CredentialCache()
+
+
+def forget_token(key):
+    TOKENS.discard(key)
+
+
+def forget_user(user_id):
+    TOKENS.discard_user(user_id)
+    BASIC_CREDENTIALS.discard_user(user_id)
+
+
+def clear_credential_caches():
+    TOKENS.clear()
+    BASIC_CREDENTIALS.clear()
+
+
+def record(scheme, hit):
+    REGISTRY.increment(
+        'ratings_auth_cache_requests_total', 'Credential cache lookups by scheme and result.',
+        scheme=scheme, result='hit' if hit else 'miss'
+    )
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        cached = TOKENS.get(key)
+        record('token', cached is not None)
+        if cached is None:
+            cached = super().authenticate_credentials(key)
+            TOKENS.set(key, cached[0].pk, cached)
+        # Copies, so a request that mutates or deletes them leaves the cache alone
+        user, token = cached
+        return copy.copy(user), copy.copy(token)
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    # Entries are keyed by an HMAC of the credentials, so the plain password is
+    # never kept; only verified pairs are cached, failures are always hashed.
+
+    def authenticate_credentials(self, userid, password, request=None):
+        key = hmac.new(settings.SECRET_KEY.encode(), f'{userid}\0{password}'.encode(), hashlib.sha256).digest()
+        user = BASIC_CREDENTIALS.get(key)
+        record('basic', user is not None)
+        if user is None:
+            user, _ = super().authenticate_credentials(userid, password, request)
+            BASIC_CREDENTIALS.set(key, user.pk, user)
+        return copy.copy(user), None
@@ -0,0 +1,347 @@
+import base64
+import json
+import random
+import statistics
+import time
+import tracemalloc
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from .catalogue import invalidate_module_listing
+from .models import Professor, Module, ModuleInstance, ProfessorModuleRating, Rating
+from .response_cache import response_cache
+
+SEED_BATCH_SIZE = 5000
+
+
+def batched(iterable, size=SEED_BATCH_SIZE):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def seed_dataset(professors=1000, modules=200, ratings=100000, instances_per_module=3,
+                 professors_per_instance=2, seed=0):
+    # Fills an empty database with a deterministic synthetic catalogue and
+    # rating history using bulk inserts only, then rebuilds the aggregates.
+    rng = random.Random(seed)
+    through = ModuleInstance.professors.through
+    with transaction.atomic():
+        professor_ids = [f'P{index:06d}' for index in range(professors)]
+        for batch in batched(Professor(id=pk, name=f'Professor {pk}') for pk in professor_ids):
+            Professor.objects.bulk_create(batch)
+
+        module_codes = [f'M{index:05d}' for index in range(modules)]
+        for batch in batched(Module(code=code, name=f'Module {code}') for code in module_codes):
+            Module.objects.bulk_create(batch)
+
+        slots = [(2015 + offset // 2, offset % 2 + 1) for offset in range(instances_per_module)]
+        for batch in batched(
+            ModuleInstance(module_id=code, year=year, semester=semester) for code in module_codes for year, semester in slots
+        ):
+            ModuleInstance.objects.bulk_create(batch)
+
+        assignments = []
+        for instance_id in ModuleInstance.objects.order_by('pk').values_list('pk', flat=True):
+            for professor_id in rng.sample(professor_ids, min(professors_per_instance, len(professor_ids))):
+                assignments.append((instance_id, professor_id))
+        for batch in batched(through(moduleinstance_id=i, professor_id=p) for i, p in assignments):
+            through.objects.bulk_create(batch)
+
+        # Walking users x assignments keeps every (instance, professor, user) unique
+        user_count = -(-ratings // len(assignments)) if assignments else 0
+        for batch in batched(User(username=f'bench-user-{index}', password='!') for index in range(user_count)):
+            User.objects.bulk_create(batch)
+        user_ids = list(User.objects.filter(username__startswith='bench-user-').order_by('pk').values_list('pk', flat=True))
+
+        def rating_rows():
+            for index in range(ratings):
+                instance_id, professor_id = assignments[index % len(assignments)]
+                yield Rating(
+                    module_instance_id=instance_id,
+                    professor_id=professor_id,
+                    user_id=user_ids[index // len(assignments)],
+                    rating=rng.randint(1, 5),
+                )
+
+        for batch in batched(rating_rows()):
+            Rating.objects.bulk_create(batch)
+
+        Professor.recompute_aggregates()
+        ProfessorModuleRating.recompute()
+
+    return {
+        'professors': professors,
+        'modules': modules,
+        'module_instances': modules * instances_per_module,
+        'assignments': len(assignments),
+        'users': user_count,
+        'ratings': ratings,
+    }
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Endpoint:
+    # One benchmarked request. ``path``, ``data`` and ``headers`` may be callables
+    # taking the iteration number so each request can target fresh rows.
+
+    def __init__(self, name, method, path, data=None, headers=None, content_type='application/json', cached=False):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.headers = headers
+        self.content_type = content_type
+        # Served from the response cache or the module listing cache once warm
+        self.cached = cached
+
+    def resolve(self, value, iteration):
+        return value(iteration) if callable(value) else value
+
+    def request(self, client, iteration):
+        path = self.resolve(self.path, iteration)
+        headers = self.resolve(self.headers, iteration) or {}
+        if self.method == 'get':
+            return client.get(path, headers=headers)
+        data = self.resolve(self.data, iteration)
+        if self.content_type == 'application/json' and not isinstance(data, (str, bytes)):
+            data = json.dumps(data)
+        return getattr(client, self.method)(path, data=data, content_type=self.content_type, headers=headers)
+
+
+def reset_caches():
+    # Every request after this one misses the response and module listing
+    # caches, as the first request after a write does
+    response_cache().clear()
+    invalidate_module_listing()
+
+
+def measure(endpoint, iterations, client=None, prepare=None):
+    client = client or Client()
+
+    def call(iteration):
+        response = endpoint.request(client, iteration)
+        if response.streaming:
+            # Streamed bodies are produced while being read
+            for _ in response.streaming_content:
+                pass
+        return response.status_code
+
+    return profile(call, iterations, prepare)
+
+
+def profile(call, iterations, prepare=None):
+    # ``call`` takes the iteration number and returns a status code. ``prepare``
+    # runs before each call, outside the timing and the query count.
+    prepare = prepare or (lambda: None)
+    timings = []
+    queries = []
+    statuses = {}
+    for iteration in range(iterations):
+        prepare()
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            status_code = call(iteration)
+            elapsed = time.perf_counter() - started
+        timings.append(elapsed * 1000)
+        queries.append(len(context.captured_queries))
+        statuses[status_code] = statuses.get(status_code, 0) + 1
+
+    # Memory is sampled on one extra call so tracing does not skew the timings
+    prepare()
+    tracemalloc.start()
+    try:
+        call(iterations)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'max_ms': round(max(timings), 3),
+        'queries_median': statistics.median(queries),
+        'queries_max': max(queries),
+        'peak_memory_bytes': peak_memory,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def default_endpoints(iterations):
+    # Covers every route in professor_rating/urls.py except the admin site.
+    # Write endpoints get a fresh user and fresh (instance, professor) pairs so
+    # no request collides with a rating made by an earlier one.
+    from rest_framework.authtoken.models import Token
+
+    password = 'bench-password'
+    rater = User.objects.create_user(username='bench-rater', password=password)
+    bulk_rater = User.objects.create_user(username='bench-bulk-rater', password=password)
+    auth = {'Authorization': f'Token {Token.objects.create(user=rater).key}'}
+    bulk_auth = {'Authorization': f'Token {Token.objects.create(user=bulk_rater).key}'}
+
+    through = ModuleInstance.professors.through
+    assignments = list(
+        through.objects.order_by('pk').values_list(
+            'professor_id', 'moduleinstance__module_id', 'moduleinstance__year', 'moduleinstance__semester'
+        )[:(iterations + 1) * 101]
+    )
+    if not assignments:
+        raise ValueError('The benchmark dataset has no module assignments')
+
+    def rating_payload(index):
+        professor_id, module_code, year, semester = assignments[index % len(assignments)]
+        return {'professor_id': professor_id, 'module_code': module_code, 'year': year, 'semester': semester, 'rating': 4}
+
+    def bulk_payload(index):
+        return [rating_payload(index * 100 + offset) for offset in range(100)]
+
+    def logout_headers(index):
+        user = User.objects.create(username=f'bench-logout-{index}', password='!')
+        return {'Authorization': f'Token {Token.objects.create(user=user).key}'}
+
+    professor_id, module_code = assignments[0][0], assignments[0][1]
+    instance_id = ModuleInstance.objects.values_list('pk', flat=True).first()
+    rating_id = Rating.objects.values_list('pk', flat=True).first()
+    average = {'professor_id': professor_id, 'module_code': module_code}
+
+    endpoints = [
+        Endpoint('register', 'post', '/api/register/',
+                 data=lambda index: {'username': f'bench-register-{index}', 'email': '', 'password': password}),
+        Endpoint('token', 'post', '/api/token/', data={'username': 'bench-rater', 'password': password}),
+        Endpoint('logout', 'post', '/api/logout/', data={}, headers=logout_headers),
+        Endpoint('rate_professor', 'post', '/api/rate/', data=rating_payload, headers=auth),
+        Endpoint('rate_professor_bulk', 'post', '/api/rate/bulk/', data=bulk_payload, headers=bulk_auth),
+        Endpoint('average_rating', 'post', '/api/average-rating/', data=average, cached=True),
+        Endpoint('ratings_list', 'get', '/api/ratings-list/', cached=True),
+        Endpoint('list_modules', 'get', '/api/list-modules/', cached=True),
+        Endpoint('leaderboard', 'get', '/api/leaderboard/', cached=True),
+        Endpoint('analytics', 'get', '/api/analytics/', cached=True),
+        Endpoint('search', 'get', f'/api/search/?q={module_code[:3]}'),
+        Endpoint('export_ratings', 'get', '/api/export/ratings/'),
+        Endpoint('export_ratings_csv', 'get', '/api/export/ratings/?format=csv'),
+    ]
+    # Named after the DRF router routes and the async URL names
+    for basename, prefix, pk in [('professor', 'professors', professor_id), ('module', 'modules', module_code),
+                                 ('moduleinstance', 'module-instances', instance_id), ('rating', 'ratings', rating_id)]:
+        cached = basename in ('professor', 'module')
+        endpoints.append(Endpoint(f'{basename}-list', 'get', f'/api/{prefix}/', cached=cached))
+        endpoints.append(Endpoint(f'{basename}-detail', 'get', f'/api/{prefix}/{pk}/', cached=cached))
+        endpoints.append(Endpoint(f'async_{prefix.replace("-", "_")[:-1]}_list', 'get', f'/api/async/{prefix}/'))
+    endpoints += [
+        Endpoint('async_list_modules', 'get', '/api/async/list-modules/', cached=True),
+        Endpoint('async_ratings_list', 'get', '/api/async/ratings-list/'),
+        Endpoint('async_average_rating', 'post', '/api/async/average-rating/', data=average),
+    ]
+    return endpoints
+
+
+def run_endpoint_suite(iterations, only=None):
+    # Every endpoint is timed with cold caches, so its row tracks the work a
+    # cache miss does from commit to commit. Cached endpoints get a second
+    # '<name>:warm' row for back-to-back requests served from the caches.
+    results = {}
+    for endpoint in default_endpoints(iterations):
+        if only and endpoint.name not in only:
+            continue
+        results[endpoint.name] = measure(endpoint, iterations, prepare=reset_caches)
+        if endpoint.cached:
+            results[f'{endpoint.name}:warm'] = measure(endpoint, iterations)
+    return results
+
+
+def run_auth_suite(iterations, only=None):
+    # Per-request cost of each authentication class on its own, stock DRF
+    # against the cached variants in ratings/authentication.py
+    from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+    from rest_framework.authtoken.models import Token
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework.test import APIRequestFactory
+
+    from .authentication import CachedBasicAuthentication, CachedTokenAuthentication, clear_credential_caches
+
+    password = 'bench-password'
+    user = User.objects.create_user(username='bench-auth', password=password)
+    token = Token.objects.create(user=user)
+    factory = APIRequestFactory()
+    basic = 'Basic ' + base64.b64encode(f'{user.username}:{password}'.encode()).decode()
+    requests = {
+        'token': factory.post('/api/rate/', HTTP_AUTHORIZATION=f'Token {token.key}'),
+        'basic': factory.post('/api/rate/', HTTP_AUTHORIZATION=basic),
+    }
+
+    def check(authenticator, request):
+        def call(iteration):
+            try:
+                return 200 if authenticator.authenticate(request) else 401
+            except AuthenticationFailed:
+                return 401
+        return call
+
+    results = {}
+    for name, authenticator, scheme in [
+        ('auth_token', TokenAuthentication(), 'token'),
+        ('auth_token_cached', CachedTokenAuthentication(), 'token'),
+        ('auth_basic', BasicAuthentication(), 'basic'),
+        ('auth_basic_cached', CachedBasicAuthentication(), 'basic'),
+    ]:
+        if only and name not in only:
+            continue
+        # Cached variants start cold, so the first call pays the full check
+        clear_credential_caches()
+        results[name] = profile(check(authenticator, requests[scheme]), iterations)
+    return results
+
+
+def run_serializer_suite(iterations, only=None, page_size=1000):
+    # Serializes and renders one page of each large table through the stock
+    # ModelSerializer + JSONRenderer and through ValuesSerializer +
+    # FastJSONRenderer, as the router list endpoints do
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from .renderers import FastJSONRenderer
+    from .serializers import ModuleInstanceSerializer, RatingSerializer, ValuesSerializer
+
+    context = {'request': Request(APIRequestFactory().get('/'))}
+
+    def stock(queryset, serializer_class):
+        def call(iteration):
+            data = serializer_class(list(queryset[:page_size]), many=True, context=context).data
+            JSONRenderer().render(data)
+            return 200
+        return call
+
+    def fast(queryset, serializer_class):
+        def call(iteration):
+            values = ValuesSerializer(serializer_class(context=context))
+            FastJSONRenderer().render(values.serialize(values.values(queryset)[:page_size]))
+            return 200
+        return call
+
+    results = {}
+    for name, queryset, serializer_class in [
+        ('ratings', Rating.objects.order_by('pk'), RatingSerializer),
+        ('module_instances', ModuleInstance.objects.prefetch_related('professors').order_by('pk'), ModuleInstanceSerializer),
+    ]:
+        rows = min(page_size, queryset.count())
+        for variant, build in [('model_serializer', stock), ('values_serializer', fast)]:
+            case = f'{name}_{variant}'
+            if only and case not in only:
+                continue
+            results[case] = profile(build(queryset, serializer_class), iterations)
+            results[case]['rows_per_second'] = round(rows / (results[case]['p50_ms'] / 1000))
+    return results
@@ -0,0 +1,137 @@
+import hashlib
+import threading
+import time
+
+from django.db.models import Count, Max
+
+from .models import Module, ModuleInstance, Professor
+
+# In-process cache of the ListModulesView payload. Signal handlers drop it
+# whenever the catalogue changes in this process; a build that raced with such
+# a change is returned to its caller but not kept. Changes made by other
+# processes are caught by comparing listing_version() with the database at
+# most once per LISTING_CHECK_INTERVAL seconds, and professor renames, which
+# the version cannot see, by rebuilding after LISTING_MAX_AGE seconds.
+LISTING_CHECK_INTERVAL = 1.0
+LISTING_MAX_AGE = 300
+
+_lock = threading.Lock()
+_version = 0
+_listing = None
+
+
+class CachedListing:
+    __slots__ = ('listing', 'database_version', 'built_at', 'checked_at')
+
+    def __init__(self, listing, database_version, now):
+        self.listing = listing
+        self.database_version = database_version
+        self.built_at = self.checked_at = now
+
+    def unchecked(self, now):
+        # Served without asking the database
+        return now - self.checked_at < LISTING_CHECK_INTERVAL and now - self.built_at < LISTING_MAX_AGE
+
+    def matches(self, database_version, now):
+        if database_version != self.database_version or now - self.built_at >= LISTING_MAX_AGE:
+            return False
+        self.checked_at = now
+        return True
+
+
+def invalidate_module_listing():
+    global _version, _listing
+    with _lock:
+        _version += 1
+        _listing = None
+
+
+def listing_version():
+    # Moves when an instance or module is saved, added or removed, when an
+    # assignment changes or a professor is added or removed.
+    # Professor.last_updated is left out: it changes with every rating.
+    instances = ModuleInstance.objects.aggregate(latest=Max('last_updated'), count=Count('*'))
+    modules = Module.objects.aggregate(latest=Max('last_updated'), count=Count('*'))
+    return (
+        instances['latest'], instances['count'], modules['latest'], modules['count'],
+        Professor.objects.count(), ModuleInstance.professors.through.objects.count(),
+    )
+
+
+async def alisting_version():
+    instances = await ModuleInstance.objects.aaggregate(latest=Max('last_updated'), count=Count('*'))
+    modules = await Module.objects.aaggregate(latest=Max('last_updated'), count=Count('*'))
+    return (
+        instances['latest'], instances['count'], modules['latest'], modules['count'],
+        await Professor.objects.acount(), await ModuleInstance.professors.through.objects.acount(),
+    )
+
+
+def listing_queryset():
+    return ModuleInstance.objects.select_related('module').prefetch_related('professors').order_by('pk')
+
+
+def summarise_instances(instances):
+    result = []
+    last_modified = None
+    for instance in instances:
+        professor_names = ', '.join([f"Professor {prof.name} ({prof.id})" for prof in instance.professors.all()])
+        result.append({
+            'code': instance.module.code,
+            'name': instance.module.name,
+            'year': instance.year,
+            'semester': instance.semester,
+            'taught_by': professor_names
+        })
+        # Professor renames count too, or If-Modified-Since would miss them
+        changed = max(
+            [instance.last_updated, instance.module.last_updated] + [prof.last_updated for prof in instance.professors.all()]
+        )
+        if last_modified is None or changed > last_modified:
+            last_modified = changed
+    digest = hashlib.md5(repr(result).encode()).hexdigest()
+    return result, last_modified, digest
+
+
+def build_module_listing():
+    return summarise_instances(listing_queryset())
+
+
+async def abuild_module_listing():
+    return summarise_instances([instance async for instance in listing_queryset()])
+
+
+def _cached_listing():
+    with _lock:
+        return _version, _listing
+
+
+def _store_listing(version, listing):
+    global _listing
+    with _lock:
+        if _version == version:
+            _listing = listing
+    return listing
+
+
+def get_module_listing():
+    # (payload, last_modified, digest), rebuilt only when the catalogue changed
+    version, cached = _cached_listing()
+    now = time.monotonic()
+    if cached is not None and cached.unchecked(now):
+        return cached.listing
+    database_version = listing_version()
+    if cached is not None and cached.matches(database_version, now):
+        return cached.listing
+    return _store_listing(version, CachedListing(build_module_listing(), database_version, now)).listing
+
+
+async def aget_module_listing():
+    version, cached = _cached_listing()
+    now = time.monotonic()
+    if cached is not None and cached.unchecked(now):
+        return cached.listing
+    database_version = await alisting_version()
+    if cached is not None and cached.matches(database_version, now):
+        return cached.listing
+    return _store_listing(version, CachedListing(await abuild_module_listing(), database_version, now)).listing
@@ -0,0 +1,96 @@
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def queryset_state(queryset):
+    # Newest last_updated plus the row count; the count catches deletes, which
+    # never move the max forward. Two statements on purpose: SQLite answers the
+    # max from the last_updated index, but not when it shares a SELECT with COUNT.
+    latest = queryset.order_by('-last_updated').values_list('last_updated', flat=True).first()
+    return latest, queryset.count()
+
+
+async def aqueryset_state(queryset):
+    latest = await queryset.order_by('-last_updated').values_list('last_updated', flat=True).afirst()
+    return latest, await queryset.acount()
+
+
+def make_etag(request, version):
+    # The path and Accept header are part of the tag so filtered pages and
+    # other renderers never share a validator.
+    key = '|'.join([
+        request.get_full_path(),
+        request.META.get('HTTP_ACCEPT', ''),
+        repr(version),
+    ])
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def check_preconditions(request, last_modified, version):
+    # Returns (304 response or None, etag, timestamp)
+    etag = make_etag(request, version)
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp), etag, timestamp
+
+
+def set_validators(response, etag, timestamp):
+    response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+def conditional_response(request, last_modified, version, build):
+    # Answers GET/HEAD with 304 when the client's validators still match,
+    # before anything is serialized. ``version`` is any cheap value that
+    # changes whenever the response body would.
+    if request.method not in ('GET', 'HEAD'):
+        return build()
+    response, etag, timestamp = check_preconditions(request, last_modified, version)
+    if response is None:
+        response = build()
+        if response.status_code != 200:
+            return response
+    return set_validators(response, etag, timestamp)
+
+
+async def aconditional_response(request, last_modified, version, build):
+    if request.method not in ('GET', 'HEAD'):
+        return await build()
+    response, etag, timestamp = check_preconditions(request, last_modified, version)
+    if response is None:
+        response = await build()
+        if response.status_code != 200:
+            return response
+    return set_validators(response, etag, timestamp)
+
+
+class ConditionalGetMixin:
+    def conditional_response(self, request, last_modified, version, build):
+        return conditional_response(request, last_modified, version, build)
+
+    def conditional_queryset_response(self, request, queryset, build):
+        last_modified, count = queryset_state(queryset)
+        return self.conditional_response(request, last_modified, (last_modified, count), build)
+
+
+class ConditionalModelViewSetMixin(ConditionalGetMixin):
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.conditional_queryset_response(
+            request, queryset, lambda: super(ConditionalModelViewSetMixin, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            # Malformed lookups are left to get_object() to report
+            return super().retrieve(request, *args, **kwargs)
+        return self.conditional_queryset_response(
+            request, queryset, lambda: super(ConditionalModelViewSetMixin, self).retrieve(request, *args, **kwargs)
+        )
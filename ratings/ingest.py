@@ -0,0 +1,380 @@
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .catalogue import invalidate_module_listing
+from .models import (
+    Module, ModuleInstance, PendingAggregate, Professor, ProfessorModuleRating, Rating, aggregates_deferred, archived_year,
+)
+from .response_cache import invalidate_responses
+from .search import invalidate_search_index
+
+# Keeps every IN (...) list below SQLite's bound-parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def chunked(values, size=LOOKUP_CHUNK_SIZE):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def refresh_professor_aggregates(professor_ids):
+    for chunk in chunked(professor_ids):
+        Professor.recompute_aggregates(chunk)
+        ProfessorModuleRating.recompute(chunk)
+
+
+def schedule_aggregate_refresh(professor_ids):
+    # For rating writes that bypass Rating.save() and delete(), such as
+    # queryset and cascade deletes: one batched recompute, or a queue entry per
+    # professor for run_aggregator in deferred mode
+    professor_ids = set(professor_ids)
+    if not professor_ids:
+        return
+    if aggregates_deferred():
+        PendingAggregate.enqueue(professor_ids)
+        return
+    refresh_professor_aggregates(professor_ids)
+    invalidate_responses('rating', *[f'rating:{professor_id}' for professor_id in professor_ids])
+
+
+def drain_pending_aggregates(batch_size=LOOKUP_CHUNK_SIZE):
+    # Recomputes queued professors, oldest first, one transaction per batch.
+    # Claimed rows are deleted before the recompute reads Rating, so a rating
+    # written meanwhile queues its professor again instead of being lost.
+    processed = 0
+    while True:
+        with transaction.atomic():
+            professor_ids = list(
+                PendingAggregate.objects.order_by('enqueued_at').values_list('professor_id', flat=True)[:batch_size]
+            )
+            if not professor_ids:
+                return processed
+            PendingAggregate.objects.filter(professor_id__in=professor_ids).delete()
+            refresh_professor_aggregates(professor_ids)
+            # Entries cached between the write and now hold the old aggregates
+            invalidate_responses('rating', *[f'rating:{professor_id}' for professor_id in professor_ids])
+        processed += len(professor_ids)
+
+
+class RatingImport:
+    # Validates and inserts a batch of ratings with a fixed number of lookups per
+    # LOOKUP_CHUNK_SIZE distinct keys instead of several queries per row.
+
+    def __init__(self, rows, default_user, batch_size=1000):
+        self.rows = rows
+        self.default_user = default_user
+        self.batch_size = batch_size
+        self.report = [None] * len(rows)
+
+    def fail(self, index, message):
+        self.report[index] = {'row': index, 'status': 'error', 'message': message}
+
+    def parse_rows(self):
+        parsed = []
+        for index, row in enumerate(self.rows):
+            if not isinstance(row, dict):
+                self.fail(index, 'Row must be an object')
+                continue
+            # Only staff may file ratings for someone else
+            username = row.get('user_name') or self.default_user.username
+            if username != self.default_user.username and not self.default_user.is_staff:
+                self.fail(index, 'Only staff can rate on behalf of another user')
+                continue
+            try:
+                year = row.get('year')
+                parsed.append((
+                    index,
+                    str(row['professor_id']),
+                    str(row['module_code']),
+                    int(year) if year not in (None, '') else None,
+                    int(row['semester']),
+                    int(row['rating']),
+                    username,
+                ))
+            except KeyError as exc:
+                self.fail(index, f'Missing field {exc.args[0]}')
+            except (TypeError, ValueError):
+                self.fail(index, 'year, semester and rating must be integers')
+        return parsed
+
+    def load_lookups(self, parsed):
+        professor_ids = {row[1] for row in parsed}
+        module_codes = {row[2] for row in parsed}
+        usernames = {row[6] for row in parsed}
+
+        self.professors = set()
+        for chunk in chunked(professor_ids):
+            self.professors.update(Professor.objects.filter(pk__in=chunk).values_list('pk', flat=True))
+
+        self.users = {self.default_user.username: self.default_user.pk}
+        for chunk in chunked(usernames - {self.default_user.username}):
+            self.users.update(User.objects.filter(username__in=chunk).values_list('username', 'pk'))
+
+        self.instances = {}
+        self.instance_years = {}
+        self.instances_by_semester = {}
+        for chunk in chunked(module_codes):
+            for pk, code, year, semester in ModuleInstance.objects.filter(module_id__in=chunk).values_list(
+                'pk', 'module_id', 'year', 'semester'
+            ):
+                self.instances[(code, year, semester)] = pk
+                self.instance_years[pk] = year
+                self.instances_by_semester.setdefault((code, semester), []).append(pk)
+
+        instance_ids = set(self.instances.values())
+        self.members = set()
+        through = ModuleInstance.professors.through
+        for chunk in chunked(instance_ids):
+            self.members.update(
+                through.objects.filter(moduleinstance_id__in=chunk).values_list('moduleinstance_id', 'professor_id')
+            )
+
+        user_ids = set(self.users.values())
+        self.existing = set()
+        for instance_chunk in chunked(instance_ids):
+            for user_chunk in chunked(user_ids):
+                self.existing.update(
+                    Rating.objects.filter(module_instance_id__in=instance_chunk, user_id__in=user_chunk).values_list(
+                        'module_instance_id', 'professor_id', 'user_id'
+                    )
+                )
+
+    def resolve_instance(self, module_code, year, semester):
+        if year is not None:
+            return self.instances.get((module_code, year, semester)), 'Module instance not found'
+        candidates = self.instances_by_semester.get((module_code, semester), [])
+        if len(candidates) > 1:
+            return None, 'Module instance is ambiguous, year is required'
+        return (candidates[0] if candidates else None), 'Module instance not found'
+
+    def insert(self, pending):
+        # Inserts (row index, Rating) pairs a batch at a time and returns the
+        # ratings that landed. A batch that collides with a rating written since
+        # load_lookups() is retried row by row to tell which rows lost the race.
+        created = []
+        for start in range(0, len(pending), self.batch_size):
+            batch = pending[start:start + self.batch_size]
+            try:
+                with transaction.atomic():
+                    Rating.objects.bulk_create([rating for _, rating in batch])
+                landed = batch
+            except IntegrityError:
+                landed = []
+                for index, rating in batch:
+                    try:
+                        with transaction.atomic():
+                            Rating.objects.bulk_create([rating])
+                        landed.append((index, rating))
+                    except IntegrityError:
+                        self.report[index] = {'row': index, 'status': 'duplicate', 'message': 'Rating already exists'}
+            for index, rating in landed:
+                self.report[index] = {'row': index, 'status': 'created'}
+                created.append(rating)
+        return created
+
+    def run(self):
+        parsed = self.parse_rows()
+        self.load_lookups(parsed)
+
+        pending = []
+        for index, professor_id, module_code, year, semester, value, username in parsed:
+            if professor_id not in self.professors:
+                self.fail(index, 'Professor not found')
+                continue
+            user_id = self.users.get(username)
+            if user_id is None:
+                self.fail(index, 'User not found')
+                continue
+            instance_id, message = self.resolve_instance(module_code, year, semester)
+            if instance_id is None:
+                self.fail(index, message)
+                continue
+            if archived_year(self.instance_years[instance_id]):
+                self.fail(index, 'Ratings for archived years are closed')
+                continue
+            if (instance_id, professor_id) not in self.members:
+                self.fail(index, 'Professor is not teaching this module instance')
+                continue
+            key = (instance_id, professor_id, user_id)
+            if key in self.existing:
+                self.report[index] = {'row': index, 'status': 'duplicate', 'message': 'Rating already exists'}
+                continue
+            self.existing.add(key)
+            pending.append((index, Rating(module_instance_id=instance_id, professor_id=professor_id, user_id=user_id, rating=value)))
+
+        with transaction.atomic():
+            professor_ids = {rating.professor_id for rating in self.insert(pending)}
+            refresh_professor_aggregates(professor_ids)
+            # bulk_create sends no signals
+            if professor_ids:
+                invalidate_responses('rating', *[f'rating:{professor_id}' for professor_id in professor_ids])
+        return self.report
+
+
+# A professors cell holding just this unassigns every professor
+CLEAR_ASSIGNMENTS = '-'
+
+
+class CatalogueImport:
+    # Upserts professors, modules and module instances with their professor
+    # assignments using a fixed number of statements per LOOKUP_CHUNK_SIZE rows.
+    # An instance row that lists professors replaces that instance's
+    # assignments; one without a professors entry, or with a blank cell,
+    # leaves them alone. Bulk statements send no signals, so apply()
+    # invalidates the caches itself.
+
+    def __init__(self, professors=(), modules=(), instances=(), batch_size=1000):
+        self.batch_size = batch_size
+        self.professors = self.parse('professor', professors, lambda row: (str(row['id']), str(row['name'])))
+        self.modules = self.parse('module', modules, lambda row: (str(row['code']), str(row['name'])))
+        self.instances = self.parse('instance', instances, self.parse_instance)
+
+    @staticmethod
+    def parse(kind, rows, parse_row):
+        parsed = {}
+        for number, row in enumerate(rows, 1):
+            if not isinstance(row, dict):
+                raise ValueError(f'{kind} row {number}: must be an object')
+            try:
+                key, value = parse_row(row)
+            except KeyError as exc:
+                raise ValueError(f'{kind} row {number}: missing field {exc.args[0]}')
+            except (TypeError, ValueError):
+                raise ValueError(f'{kind} row {number}: year and semester must be integers')
+            parsed[key] = value
+        return parsed
+
+    @staticmethod
+    def parse_instance(row):
+        professors = row.get('professors')
+        if isinstance(professors, str):
+            # CSV cells hold the ids separated by spaces or semicolons. Every
+            # row has the column, so a blank cell leaves the assignments alone
+            # and only CLEAR_ASSIGNMENTS removes them.
+            professors = professors.strip()
+            if professors == CLEAR_ASSIGNMENTS:
+                professors = []
+            else:
+                professors = professors.replace(';', ' ').split() or None
+        key = (str(row['module_code']), int(row['year']), int(row['semester']))
+        return key, None if professors is None else {str(professor_id) for professor_id in professors}
+
+    def plan(self):
+        # Works out the changes against the database without writing anything
+        current_professors = {}
+        for chunk in chunked(self.professors.keys() | self.assigned_professors()):
+            current_professors.update(Professor.objects.filter(pk__in=chunk).values_list('pk', 'name'))
+        current_modules = {}
+        for chunk in chunked(self.modules.keys() | {code for code, _, _ in self.instances}):
+            current_modules.update(Module.objects.filter(pk__in=chunk).values_list('pk', 'name'))
+
+        missing = sorted(self.assigned_professors() - current_professors.keys() - self.professors.keys())
+        if missing:
+            raise ValueError(f'Unknown professor(s): {", ".join(missing)}')
+        missing = sorted({code for code, _, _ in self.instances} - current_modules.keys() - self.modules.keys())
+        if missing:
+            raise ValueError(f'Unknown module(s): {", ".join(missing)}')
+
+        self.changed_professors = {pk: name for pk, name in self.professors.items() if current_professors.get(pk) != name}
+        self.changed_modules = {code: name for code, name in self.modules.items() if current_modules.get(code) != name}
+        self.professors_before = current_professors
+        self.modules_before = current_modules
+
+        self.instance_ids = self.load_instance_ids()
+        self.new_instances = [key for key in self.instances if key not in self.instance_ids]
+        through = ModuleInstance.professors.through
+        # instance id -> {professor id: through row id}
+        current_links = {}
+        for chunk in chunked(self.instance_ids.values()):
+            for pk, instance_id, professor_id in through.objects.filter(moduleinstance_id__in=chunk).values_list(
+                'pk', 'moduleinstance_id', 'professor_id'
+            ):
+                current_links.setdefault(instance_id, {})[professor_id] = pk
+
+        self.added_links = []
+        self.removed_links = []
+        for key, professor_ids in self.instances.items():
+            if professor_ids is None:
+                continue
+            current = current_links.get(self.instance_ids.get(key), {})
+            self.added_links += [(key, professor_id) for professor_id in sorted(professor_ids - current.keys())]
+            self.removed_links += [
+                (key, professor_id, current[professor_id]) for professor_id in sorted(current.keys() - professor_ids)
+            ]
+        return self
+
+    def assigned_professors(self):
+        return set().union(*[ids for ids in self.instances.values() if ids])
+
+    def load_instance_ids(self):
+        instance_ids = {}
+        for chunk in chunked({code for code, _, _ in self.instances}):
+            for pk, code, year, semester in ModuleInstance.objects.filter(module_id__in=chunk).values_list(
+                'pk', 'module_id', 'year', 'semester'
+            ):
+                instance_ids[(code, year, semester)] = pk
+        return instance_ids
+
+    def diff(self):
+        lines = []
+        for pk, name in sorted(self.changed_professors.items()):
+            before = self.professors_before.get(pk)
+            lines.append(f'+ professor {pk} {name!r}' if before is None else f'~ professor {pk} {before!r} -> {name!r}')
+        for code, name in sorted(self.changed_modules.items()):
+            before = self.modules_before.get(code)
+            lines.append(f'+ module {code} {name!r}' if before is None else f'~ module {code} {before!r} -> {name!r}')
+        for code, year, semester in sorted(self.new_instances):
+            lines.append(f'+ instance {code} {year}/{semester}')
+        for (code, year, semester), professor_id in self.added_links:
+            lines.append(f'+ assignment {professor_id} -> {code} {year}/{semester}')
+        for (code, year, semester), professor_id, _ in self.removed_links:
+            lines.append(f'- assignment {professor_id} -> {code} {year}/{semester}')
+        return lines
+
+    def summary(self):
+        return {
+            'professors': len(self.changed_professors),
+            'modules': len(self.changed_modules),
+            'instances': len(self.new_instances),
+            'assignments_added': len(self.added_links),
+            'assignments_removed': len(self.removed_links),
+        }
+
+    def apply(self):
+        through = ModuleInstance.professors.through
+        with transaction.atomic():
+            Professor.objects.bulk_create(
+                [Professor(id=pk, name=name) for pk, name in self.changed_professors.items()],
+                batch_size=self.batch_size, update_conflicts=True, unique_fields=['id'], update_fields=['name', 'last_updated'],
+            )
+            Module.objects.bulk_create(
+                [Module(code=code, name=name) for code, name in self.changed_modules.items()],
+                batch_size=self.batch_size, update_conflicts=True, unique_fields=['code'], update_fields=['name', 'last_updated'],
+            )
+            ModuleInstance.objects.bulk_create(
+                [ModuleInstance(module_id=code, year=year, semester=semester) for code, year, semester in self.new_instances],
+                batch_size=self.batch_size, ignore_conflicts=True,
+            )
+            if self.new_instances:
+                self.instance_ids = self.load_instance_ids()
+
+            for chunk in chunked([pk for _, _, pk in self.removed_links]):
+                through.objects.filter(pk__in=chunk).delete()
+            through.objects.bulk_create(
+                [through(moduleinstance_id=self.instance_ids[key], professor_id=professor_id)
+                 for key, professor_id in self.added_links],
+                batch_size=self.batch_size, ignore_conflicts=True,
+            )
+            # Assignment changes do not touch the instance rows themselves
+            touched = {self.instance_ids[key] for key, *_ in self.added_links + self.removed_links}
+            for chunk in chunked(touched):
+                ModuleInstance.objects.filter(pk__in=chunk).update(last_updated=timezone.now())
+
+            invalidate_responses(
+                'professor', 'module', 'moduleinstance', *[f'professor:{pk}' for pk in self.changed_professors]
+            )
+        invalidate_module_listing()
+        invalidate_search_index()
+        return self.summary()
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import random
+import statistics
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from .benchmarks import percentile
+
+# Closed- or open-loop HTTP load against a running server, driven by
+# manage.py loadtest. Requests go over plain asyncio streams with keep-alive,
+# so the generator needs no extra packages and one process can hold hundreds
+# of connections. Each worker owns one connection and replays whole
+# scenarios, picked at random by weight.
+LOCK_MARKER = b'database is locked'
+SAMPLE_PAGE_SIZE = 500
+# Seconds a request may take before it counts as an error
+REQUEST_TIMEOUT = 30.0
+
+
+class ConnectionClosed(Exception):
+    pass
+
+
+class HTTPConnection:
+    # Minimal HTTP/1.1 client: Content-Length and chunked bodies, reconnecting
+    # once when a kept-alive connection turns out to be closed. Connecting,
+    # sending and reading the response have to finish within ``timeout``
+    # seconds, or the request fails with TimeoutError.
+
+    def __init__(self, host, port, timeout=REQUEST_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except OSError:
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=None, headers=None):
+        reused = self.writer is not None
+        try:
+            return await self.timed_exchange(method, path, body, headers)
+        except (ConnectionClosed, ConnectionError, asyncio.IncompleteReadError):
+            await self.close()
+            if not reused:
+                raise
+        return await self.timed_exchange(method, path, body, headers)
+
+    async def timed_exchange(self, method, path, body, headers):
+        try:
+            return await asyncio.wait_for(self.exchange(method, path, body, headers), self.timeout)
+        except asyncio.TimeoutError:
+            # A late response would be read as the answer to the next request
+            await self.close()
+            raise
+
+    async def exchange(self, method, path, body, headers):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b''
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(payload)}']
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines += [f'{name}: {value}' for name, value in (headers or {}).items()]
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionClosed
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while (line := await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while size := int((await self.reader.readline()).split(b';')[0], 16):
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            await self.reader.readline()
+            content = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            content = await self.reader.readexactly(int(response_headers['content-length']))
+        elif status in (204, 304) or method == 'HEAD':
+            content = b''
+        else:
+            content = await self.reader.read()
+            response_headers['connection'] = 'close'
+        if response_headers.get('connection', '').lower() == 'close':
+            await self.close()
+        return status, response_headers, content
+
+
+class Recorder:
+    # Latencies and outcomes per request name
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.errors = {}
+        self.lock_timeouts = {}
+        self.timeouts = {}
+        self.scenarios = {}
+
+    async def call(self, connection, name, method, path, body=None, headers=None):
+        started = time.perf_counter()
+        try:
+            status, response_headers, content = await connection.request(method, path, body, headers)
+        except asyncio.TimeoutError:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+            status, response_headers, content = 0, {}, b''
+        except (OSError, ConnectionClosed, asyncio.IncompleteReadError, ValueError):
+            status, response_headers, content = 0, {}, b''
+        self.latencies.setdefault(name, []).append((time.perf_counter() - started) * 1000)
+        statuses = self.statuses.setdefault(name, {})
+        statuses[status] = statuses.get(status, 0) + 1
+        if status == 0 or status >= 500:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        if LOCK_MARKER in content:
+            self.lock_timeouts[name] = self.lock_timeouts.get(name, 0) + 1
+        return status, response_headers, content
+
+    def report(self, seconds):
+        requests = {}
+        for name, samples in sorted(self.latencies.items()):
+            requests[name] = {
+                'requests': len(samples),
+                'rps': round(len(samples) / seconds, 1),
+                'p50_ms': round(percentile(samples, 0.50), 3),
+                'p95_ms': round(percentile(samples, 0.95), 3),
+                'p99_ms': round(percentile(samples, 0.99), 3),
+                'mean_ms': round(statistics.fmean(samples), 3),
+                'max_ms': round(max(samples), 3),
+                'errors': self.errors.get(name, 0),
+                'lock_timeouts': self.lock_timeouts.get(name, 0),
+                'timeouts': self.timeouts.get(name, 0),
+                'statuses': {str(code): count for code, count in sorted(self.statuses[name].items())},
+            }
+        total = sum(len(samples) for samples in self.latencies.values())
+        return {
+            'seconds': round(seconds, 3),
+            'requests': total,
+            'rps': round(total / seconds, 1) if seconds else 0.0,
+            'error_rate': round(sum(self.errors.values()) / total, 4) if total else 0.0,
+            'lock_timeout_rate': round(sum(self.lock_timeouts.values()) / total, 4) if total else 0.0,
+            'scenarios': dict(sorted(self.scenarios.items())),
+            'endpoints': requests,
+        }
+
+
+class Catalogue:
+    # Professor assignments the scenarios draw from, read through the API
+
+    def __init__(self, assignments):
+        self.assignments = assignments
+
+    @classmethod
+    async def load(cls, connection, limit):
+        assignments = []
+        path = f'/api/module-instances/?page_size={min(limit, SAMPLE_PAGE_SIZE)}'
+        while path and len(assignments) < limit:
+            status, _, content = await connection.request('GET', path)
+            if status != 200:
+                raise ValueError(f'GET {path} answered {status}')
+            page = json.loads(content)
+            for instance in page['results']:
+                for professor_id in instance['professors']:
+                    assignments.append((professor_id, instance['module'], instance['year'], instance['semester']))
+            path = page.get('next') and urlsplit(page['next'])._replace(scheme='', netloc='').geturl()
+        if not assignments:
+            raise ValueError('The server has no module instances with professors to rate')
+        return cls(assignments[:limit])
+
+
+# Scenarios take (recorder, connection, catalogue, rng, state). ``state`` is
+# per worker, so polling scenarios can remember validators between runs.
+
+async def rate_scenario(recorder, connection, catalogue, rng, state):
+    # A new user registers, obtains a token and rates a few professors
+    username = f'load-{uuid.uuid4().hex[:12]}'
+    password = 'load-password'
+    await recorder.call(connection, 'register', 'POST', '/api/register/',
+                        {'username': username, 'email': '', 'password': password})
+    status, _, content = await recorder.call(connection, 'token', 'POST', '/api/token/',
+                                             {'username': username, 'password': password})
+    if status != 200:
+        return
+    headers = {'Authorization': f"Token {json.loads(content)['token']}"}
+    for professor_id, module_code, year, semester in rng.sample(catalogue.assignments, min(3, len(catalogue.assignments))):
+        await recorder.call(connection, 'rate', 'POST', '/api/rate/', {
+            'professor_id': professor_id, 'module_code': module_code, 'year': year, 'semester': semester,
+            'rating': rng.randint(1, 5),
+        }, headers)
+
+
+async def list_modules_scenario(recorder, connection, catalogue, rng, state):
+    # Polls the module listing the way a client with a cache does
+    etag = state.get('list_modules_etag')
+    headers = {'If-None-Match': etag} if etag else None
+    _, response_headers, _ = await recorder.call(connection, 'list_modules', 'GET', '/api/list-modules/', headers=headers)
+    if 'etag' in response_headers:
+        state['list_modules_etag'] = response_headers['etag']
+
+
+async def average_rating_scenario(recorder, connection, catalogue, rng, state):
+    professor_id, module_code, _, _ = rng.choice(catalogue.assignments)
+    await recorder.call(connection, 'average_rating', 'POST', '/api/average-rating/',
+                        {'professor_id': professor_id, 'module_code': module_code})
+
+
+SCENARIOS = {
+    'rate': rate_scenario,
+    'list_modules': list_modules_scenario,
+    'average_rating': average_rating_scenario,
+}
+
+
+def parse_mix(value):
+    # "rate=1,list_modules=5" -> {'rate': 1.0, 'list_modules': 5.0}
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}', expected one of {', '.join(SCENARIOS)}")
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError:
+            raise ValueError(f"Weight for '{name}' must be a number")
+        if mix[name] < 0:
+            raise ValueError(f"Weight for '{name}' must not be negative")
+    if not sum(mix.values()):
+        raise ValueError('At least one scenario needs a positive weight')
+    return mix
+
+
+async def run_load(url, mix, concurrency=10, rps=None, duration=10.0, scenarios=None, sample=1000, seed=0,
+                   timeout=REQUEST_TIMEOUT):
+    # Closed loop by default: ``concurrency`` workers replay scenarios back to
+    # back. With ``rps`` the loop is open: scenarios start on a fixed schedule
+    # and at most ``concurrency`` run at once; starts that find every
+    # connection busy are counted as dropped rather than queued, so the
+    # schedule does not drift. Stops after ``duration`` seconds or once
+    # ``scenarios`` have started.
+    parts = urlsplit(url)
+    host, port = parts.hostname or '127.0.0.1', parts.port or 80
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+
+    setup = HTTPConnection(host, port, timeout)
+    try:
+        catalogue = await Catalogue.load(setup, sample)
+    finally:
+        await setup.close()
+
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    started_count = 0
+    dropped = 0
+
+    def next_scenario():
+        nonlocal started_count
+        if time.monotonic() >= deadline or (scenarios is not None and started_count >= scenarios):
+            return None
+        started_count += 1
+        return rng.choices(names, weights)[0]
+
+    async def play(name, connection, state):
+        recorder.scenarios[name] = recorder.scenarios.get(name, 0) + 1
+        await SCENARIOS[name](recorder, connection, catalogue, rng, state)
+
+    connections = [HTTPConnection(host, port, timeout) for _ in range(concurrency)]
+    started = time.perf_counter()
+    try:
+        if rps is None:
+            async def worker(connection):
+                state = {}
+                while (name := next_scenario()) is not None:
+                    await play(name, connection, state)
+
+            await asyncio.gather(*(worker(connection) for connection in connections))
+        else:
+            idle = asyncio.Queue()
+            for connection in connections:
+                idle.put_nowait((connection, {}))
+
+            async def run(name, connection, state):
+                try:
+                    await play(name, connection, state)
+                finally:
+                    idle.put_nowait((connection, state))
+
+            tasks = []
+            interval = 1.0 / rps
+            schedule = time.monotonic()
+            while (name := next_scenario()) is not None:
+                if idle.empty():
+                    dropped += 1
+                else:
+                    tasks.append(asyncio.ensure_future(run(name, *idle.get_nowait())))
+                schedule += interval
+                await asyncio.sleep(max(0.0, schedule - time.monotonic()))
+            await asyncio.gather(*tasks)
+    finally:
+        for connection in connections:
+            await connection.close()
+
+    report = recorder.report(time.perf_counter() - started)
+    report.update(mode='open' if rps else 'closed', concurrency=concurrency, target_rps=rps, dropped=dropped)
+    return report
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ratings.archive import archivable_ratings, archive_ratings
+from ratings.ingest import LOOKUP_CHUNK_SIZE
+from ratings.response_cache import LOCAL_CACHE_WARNING, response_cache_is_local
+
+
+class Command(BaseCommand):
+    help = (
+        "Move ratings for academic years before RATING_ARCHIVE_BEFORE_YEAR into the archive table, "
+        "keeping their totals in the professor and module aggregates"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=LOOKUP_CHUNK_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Count the ratings that would move')
+
+    def handle(self, *args, **options):
+        # Reads only merge the archive back in while the setting is in place,
+        # so it is the single source of the cut-off
+        before_year = settings.RATING_ARCHIVE_BEFORE_YEAR
+        if before_year is None:
+            raise CommandError('Set RATING_ARCHIVE_BEFORE_YEAR to the first academic year that stays open')
+        if options['dry_run']:
+            count = archivable_ratings(before_year).count()
+            self.stdout.write(self.style.WARNING(f'Dry run, {count} rating(s) before {before_year} would be archived'))
+            return
+        moved = archive_ratings(before_year, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} rating(s) before {before_year}'))
+        if moved and response_cache_is_local():
+            self.stderr.write(self.style.WARNING(LOCAL_CACHE_WARNING))
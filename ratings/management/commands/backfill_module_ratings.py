@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ratings.models import ProfessorModuleRating
+from ratings.response_cache import LOCAL_CACHE_WARNING, invalidate_responses, response_cache_is_local
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-(professor, module) rating aggregates from the Rating table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('professor_ids', nargs='*', help='Only rebuild aggregates for these professors')
+
+    def handle(self, *args, **options):
+        professor_ids = options['professor_ids'] or None
+        with transaction.atomic():
+            rows = ProfessorModuleRating.recompute(professor_ids)
+            invalidate_responses('aggregates')
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {rows} professor/module aggregate(s)'))
+        if response_cache_is_local():
+            self.stderr.write(self.style.WARNING(LOCAL_CACHE_WARNING))
@@ -0,0 +1,84 @@
+import json
+import subprocess
+import time
+
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, teardown_test_environment
+
+from ratings.benchmarks import run_auth_suite, run_endpoint_suite, run_serializer_suite, seed_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with a synthetic dataset and report per-endpoint "
+        "latency percentiles, query counts and peak memory"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--professors', type=int, default=1000)
+        parser.add_argument('--modules', type=int, default=200)
+        parser.add_argument('--ratings', type=int, default=100000)
+        parser.add_argument('--instances-per-module', type=int, default=3)
+        parser.add_argument('--professors-per-instance', type=int, default=2)
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--suite', choices=['endpoints', 'auth', 'serializers'], default='endpoints',
+            help=(
+                'endpoints: every URL on a seeded dataset; auth: each authentication class on its own; '
+                'serializers: list serialization and rendering of 1000-row pages'
+            )
+        )
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Only run these endpoints (repeatable)')
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            if options['suite'] == 'auth':
+                # Needs one user and token, not a dataset
+                dataset = None
+                endpoints = run_auth_suite(options['iterations'], only=options['endpoints'])
+            else:
+                started = time.perf_counter()
+                dataset = seed_dataset(
+                    professors=options['professors'],
+                    modules=options['modules'],
+                    ratings=options['ratings'],
+                    instances_per_module=options['instances_per_module'],
+                    professors_per_instance=options['professors_per_instance'],
+                    seed=options['seed'],
+                )
+                dataset['seed_seconds'] = round(time.perf_counter() - started, 2)
+                self.stderr.write(f"Seeded {dataset['ratings']} ratings in {dataset['seed_seconds']}s")
+                suite = run_serializer_suite if options['suite'] == 'serializers' else run_endpoint_suite
+                endpoints = suite(options['iterations'], only=options['endpoints'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        report = {'commit': self.current_commit(), 'suite': options['suite'], 'dataset': dataset, 'endpoints': endpoints}
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(report, output, indent=2)
+        self.write_table(endpoints)
+
+    def current_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def write_table(self, endpoints):
+        throughput = any('rows_per_second' in stats for stats in endpoints.values())
+        header = f"{'endpoint':<36}{'p50 ms':>10}{'p95 ms':>10}{'queries':>9}{'peak KiB':>11}"
+        self.stdout.write(header + (f"{'rows/s':>10}" if throughput else '  statuses'))
+        for name, stats in endpoints.items():
+            line = (
+                f"{name:<36}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['queries_median']:>9}"
+                f"{stats['peak_memory_bytes'] / 1024:>11.1f}"
+            )
+            self.stdout.write(line + (f"{stats['rows_per_second']:>10}" if throughput else f"  {stats['statuses']}"))
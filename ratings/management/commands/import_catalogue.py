@@ -0,0 +1,72 @@
+import csv
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ratings.ingest import CatalogueImport
+from ratings.response_cache import LOCAL_CACHE_WARNING, response_cache_is_local
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert professors, modules and module instances (with their professor assignments) "
+        "from CSV or JSON files in one transaction"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--professors', help='File with id and name columns')
+        parser.add_argument('--modules', help='File with code and name columns')
+        parser.add_argument(
+            '--instances',
+            help=(
+                'File with module_code, year, semester and optionally professors (ids separated by spaces or '
+                'semicolons; a blank cell keeps the current ones, "-" removes them)'
+            )
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Print the changes without writing them')
+
+    def handle(self, *args, **options):
+        if not any(options[kind] for kind in ('professors', 'modules', 'instances')):
+            raise CommandError('Pass at least one of --professors, --modules or --instances')
+        try:
+            catalogue = CatalogueImport(
+                professors=self.read_rows(options['professors']),
+                modules=self.read_rows(options['modules']),
+                instances=self.read_rows(options['instances']),
+                batch_size=options['batch_size'],
+            ).plan()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options['dry_run']:
+            for line in catalogue.diff():
+                self.stdout.write(line)
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing written: {self.describe(catalogue.summary())}'))
+            return
+        summary = catalogue.apply()
+        self.stdout.write(self.style.SUCCESS(f'Imported catalogue: {self.describe(summary)}'))
+        if response_cache_is_local():
+            self.stderr.write(self.style.WARNING(LOCAL_CACHE_WARNING))
+
+    def read_rows(self, path):
+        if not path:
+            return []
+        path = Path(path)
+        try:
+            with path.open(newline='', encoding='utf-8') as source:
+                if path.suffix.lower() == '.csv':
+                    return list(csv.DictReader(source))
+                if path.suffix.lower() == '.json':
+                    rows = json.load(source)
+                    if not isinstance(rows, list):
+                        raise CommandError(f'{path} must hold a JSON array of objects')
+                    return rows
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Could not read {path}: {exc}')
+        raise CommandError(f'{path} must be a .csv or .json file')
+
+    @staticmethod
+    def describe(summary):
+        return ', '.join(f'{count} {name.replace("_", " ")}' for name, count in summary.items())
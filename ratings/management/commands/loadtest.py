@@ -0,0 +1,133 @@
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ratings.loadtest import REQUEST_TIMEOUT, parse_mix, run_load
+
+SERVER_START_TIMEOUT = 30
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a weighted mix of client scenarios against a running server over HTTP and report "
+        "throughput, latency percentiles, error and SQLite lock-timeout rates"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Server to load')
+        parser.add_argument(
+            '--serve', choices=['wsgi', 'asgi'],
+            help=(
+                'Start a server at --url for the run: wsgi runs manage.py runserver, '
+                'asgi runs uvicorn on professor_rating.asgi (needs uvicorn installed)'
+            )
+        )
+        parser.add_argument('--workers', type=int, default=1, help='uvicorn workers for --serve asgi')
+        parser.add_argument(
+            '--mix', default='rate=1,list_modules=5,average_rating=4',
+            help='Scenario weights: rate (register, token, three ratings), list_modules (conditional polling), average_rating'
+        )
+        parser.add_argument('--concurrency', type=int, default=10, help='Connections, and scenarios in flight')
+        parser.add_argument('--rps', type=float, help='Start scenarios at this rate instead of back to back')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run')
+        parser.add_argument('--scenarios', type=int, help='Stop after starting this many scenarios')
+        parser.add_argument('--sample', type=int, default=1000, help='Professor assignments to draw ratings from')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--timeout', type=float, default=REQUEST_TIMEOUT, help='Seconds before a request counts as an error'
+        )
+        parser.add_argument('--json', dest='json_path', help='Also write the results to this file')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        if options['concurrency'] < 1 or options['timeout'] <= 0 or (options['rps'] is not None and options['rps'] <= 0):
+            raise CommandError('--concurrency, --rps and --timeout must be positive')
+
+        server = self.start_server(options) if options['serve'] else None
+        try:
+            report = asyncio.run(run_load(
+                options['url'], mix,
+                concurrency=options['concurrency'],
+                rps=options['rps'],
+                duration=options['duration'],
+                scenarios=options['scenarios'],
+                sample=options['sample'],
+                seed=options['seed'],
+                timeout=options['timeout'],
+            ))
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Load test against {options['url']} failed: {exc}")
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+        report['server'] = options['serve']
+        if options['json_path']:
+            with open(options['json_path'], 'w') as output:
+                json.dump(report, output, indent=2)
+        self.write_table(report)
+
+    def start_server(self, options):
+        parts = urlsplit(options['url'])
+        host, port = parts.hostname or '127.0.0.1', parts.port or 80
+        if options['serve'] == 'wsgi':
+            command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runserver', '--noreload', f'{host}:{port}']
+        else:
+            command = [
+                sys.executable, '-m', 'uvicorn', 'professor_rating.asgi:application',
+                '--host', host, '--port', str(port), '--workers', str(options['workers']), '--no-access-log',
+            ]
+        # runserver logs every request to stderr; a pipe nobody reads would fill
+        # up and stall the server, so the log goes to a file instead
+        with tempfile.TemporaryFile() as log:
+            server = subprocess.Popen(command, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=log)
+            try:
+                return self.wait_for_server(server, host, port)
+            except CommandError as exc:
+                log.seek(0)
+                raise CommandError(f"{exc}: {log.read().decode(errors='replace')}")
+
+    def wait_for_server(self, server, host, port):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError('Server exited during start-up')
+            try:
+                socket.create_connection((host, port), timeout=1).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError(f'Server did not accept connections on {host}:{port} within {SERVER_START_TIMEOUT}s')
+
+    def write_table(self, report):
+        mode = f"{report['target_rps']} scenarios/s" if report['target_rps'] else 'back to back'
+        self.stdout.write(
+            f"{report['requests']} requests in {report['seconds']}s ({report['rps']} req/s), "
+            f"{report['concurrency']} connections, {mode}"
+        )
+        self.stdout.write(
+            f"error rate {report['error_rate']:.2%}, lock timeouts {report['lock_timeout_rate']:.2%}, "
+            f"dropped starts {report['dropped']}, scenarios {report['scenarios']}"
+        )
+        self.stdout.write(
+            f"{'request':<20}{'count':>8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+            f"{'errors':>8}{'locked':>8}{'timeout':>9}  statuses"
+        )
+        for name, stats in report['endpoints'].items():
+            self.stdout.write(
+                f"{name:<20}{stats['requests']:>8}{stats['rps']:>9}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                f"{stats['p99_ms']:>10.2f}{stats['errors']:>8}{stats['lock_timeouts']:>8}{stats['timeouts']:>9}  {stats['statuses']}"
+            )
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ratings.models import Professor
+from ratings.response_cache import LOCAL_CACHE_WARNING, invalidate_responses, response_cache_is_local
+
+
+class Command(BaseCommand):
+    help = "Recompute every professor's rating sum, count and average from the Rating table"
+
+    def add_arguments(self, parser):
+        parser.add_argument('professor_ids', nargs='*', help='Only reconcile these professors')
+
+    def handle(self, *args, **options):
+        professor_ids = options['professor_ids'] or None
+        with transaction.atomic():
+            changed = Professor.recompute_aggregates(professor_ids)
+            invalidate_responses('aggregates')
+        self.stdout.write(self.style.SUCCESS(f'Reconciled averages, {changed} professor(s) corrected'))
+        if response_cache_is_local():
+            self.stderr.write(self.style.WARNING(LOCAL_CACHE_WARNING))
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ratings.ingest import drain_pending_aggregates
+from ratings.response_cache import LOCAL_CACHE_WARNING, response_cache_is_local
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute rating aggregates queued by ratings written with RATING_AGGREGATES = 'deferred', "
+        "draining the queue every --interval seconds"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=settings.RATING_AGGREGATE_MAX_DELAY,
+            help='Seconds between drains; bounds how stale aggregates get (default RATING_AGGREGATE_MAX_DELAY)'
+        )
+        parser.add_argument('--batch-size', type=int, default=settings.RATING_AGGREGATE_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Drain the queue once and exit')
+
+    def handle(self, *args, **options):
+        if response_cache_is_local():
+            self.stderr.write(self.style.WARNING(LOCAL_CACHE_WARNING))
+        try:
+            while True:
+                started = time.monotonic()
+                processed = drain_pending_aggregates(options['batch_size'])
+                if processed or options['once']:
+                    self.stdout.write(f'{timezone.now():%Y-%m-%d %H:%M:%S} recomputed {processed} professor(s)')
+                if options['once']:
+                    return
+                time.sleep(max(0.0, options['interval'] - (time.monotonic() - started)))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped')
@@ -0,0 +1,205 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse
+
+# Request latency buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class ViewStats:
+    __slots__ = ('buckets', 'latency_sum', 'requests', 'statuses', 'queries', 'query_seconds', 'response_bytes')
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.requests = 0
+        self.statuses = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.response_bytes = 0
+
+
+class MetricsRegistry:
+    # Aggregates in-process. Memory is bounded because every key is a resolved
+    # URL name (or 'unmatched'), a known HTTP method and a status class, and
+    # each histogram has a fixed number of buckets.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.counters = {}
+
+    def observe(self, view, method, status, seconds, queries, query_seconds, response_bytes):
+        status_class = f'{status // 100}xx'
+        with self.lock:
+            stats = self.views.get((view, method))
+            if stats is None:
+                stats = self.views[(view, method)] = ViewStats()
+            stats.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            stats.latency_sum += seconds
+            stats.requests += 1
+            stats.statuses[status_class] = stats.statuses.get(status_class, 0) + 1
+            stats.queries += queries
+            stats.query_seconds += query_seconds
+            stats.response_bytes += response_bytes
+
+    def increment(self, name, help_text, amount=1, **labels):
+        # Free-form counters for other subsystems (caches and the like)
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            value, _ = self.counters.get(key, (0, help_text))
+            self.counters[key] = (value + amount, help_text)
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+            self.counters.clear()
+
+    def render(self):
+        with self.lock:
+            views = {key: self.copy_stats(stats) for key, stats in self.views.items()}
+            counters = dict(self.counters)
+
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+
+        family('ratings_http_request_duration_seconds', 'histogram', 'Request latency by view.')
+        for (view, method), stats in sorted(views.items()):
+            labels = f'view="{escape(view)}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.buckets):
+                cumulative += count
+                lines.append(f'ratings_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'ratings_http_request_duration_seconds_sum{{{labels}}} {stats.latency_sum}')
+            lines.append(f'ratings_http_request_duration_seconds_count{{{labels}}} {stats.requests}')
+
+        family('ratings_http_requests_total', 'counter', 'Requests by view and status class.')
+        for (view, method), stats in sorted(views.items()):
+            for status_class, count in sorted(stats.statuses.items()):
+                lines.append(
+                    f'ratings_http_requests_total{{view="{escape(view)}",method="{method}",status="{status_class}"}} {count}'
+                )
+
+        for name, attribute, help_text in [
+            ('ratings_db_queries_total', 'queries', 'Database queries issued by view.'),
+            ('ratings_db_query_duration_seconds_total', 'query_seconds', 'Time spent in SQL by view.'),
+            ('ratings_http_response_bytes_total', 'response_bytes', 'Response body bytes by view.'),
+        ]:
+            family(name, 'counter', help_text)
+            for (view, method), stats in sorted(views.items()):
+                lines.append(f'{name}{{view="{escape(view)}",method="{method}"}} {getattr(stats, attribute)}')
+
+        seen = set()
+        for (name, labels), (value, help_text) in sorted(counters.items()):
+            if name not in seen:
+                family(name, 'counter', help_text)
+                seen.add(name)
+            label_text = ','.join(f'{key}="{escape(str(label))}"' for key, label in labels)
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def copy_stats(stats):
+        copy = ViewStats()
+        for attribute in ViewStats.__slots__:
+            value = getattr(stats, attribute)
+            setattr(copy, attribute, value.copy() if isinstance(value, (list, dict)) else value)
+        return copy
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = MetricsRegistry()
+
+
+class QueryTimer:
+    # Counts statements and the time spent in them for one request
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# The timer lives in a context variable so queries run by sync_to_async on
+# behalf of an async view, in another thread and on another connection, are
+# still charged to the request that made them.
+current_timer = ContextVar('request_query_timer', default=None)
+
+
+def time_query(execute, sql, params, many, context):
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.seconds += time.perf_counter() - started
+        timer.queries += 1
+
+
+def install_query_timer(sender, connection, **kwargs):
+    # connection_created receiver, connected in RatingsConfig.ready(). Inserted
+    # first so an enclosing ``with connection.execute_wrapper(...)`` block still
+    # pops its own wrapper off the end.
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, time_query)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        token = current_timer.set(timer)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timer.reset(token)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    def record(self, request, response, seconds, timer):
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        method = request.method if request.method in METHODS else 'OTHER'
+        if response.streaming:
+            size = int(response.get('Content-Length') or 0)
+        else:
+            size = len(response.content)
+        REGISTRY.observe(view, method, response.status_code, seconds, timer.queries, timer.seconds, size)
+
+
+def metrics_view(request):
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
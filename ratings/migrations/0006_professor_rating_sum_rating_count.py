@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:53
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def backfill_rating_totals(apps, schema_editor):
+    Professor = apps.get_model('ratings', 'Professor')
+    Rating = apps.get_model('ratings', 'Rating')
+    totals = Rating.objects.values('professor_id').annotate(total=Sum('rating'), count=Count('id'))
+    for row in totals:
+        Professor.objects.filter(pk=row['professor_id']).update(
+            rating_sum=row['total'],
+            rating_count=row['count'],
+            average_rating=row['total'] / row['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0005_module_last_updated_moduleinstance_last_updated_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='professor',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='professor',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_totals, migrations.RunPython.noop),
+    ]
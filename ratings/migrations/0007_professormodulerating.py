@@ -0,0 +1,49 @@
+# Generated by Django 5.1.6 on 2026-10-18 18:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def backfill_module_ratings(apps, schema_editor):
+    ProfessorModuleRating = apps.get_model('ratings', 'ProfessorModuleRating')
+    Rating = apps.get_model('ratings', 'Rating')
+    rows = Rating.objects.values('professor_id', 'module_instance__module_id').annotate(
+        total=Sum('rating'), count=Count('id'), low=Min('rating'), high=Max('rating'),
+    )
+    ProfessorModuleRating.objects.bulk_create([
+        ProfessorModuleRating(
+            key=f"{row['professor_id']}:{row['module_instance__module_id']}",
+            professor_id=row['professor_id'],
+            module_id=row['module_instance__module_id'],
+            rating_sum=row['total'],
+            rating_count=row['count'],
+            rating_min=row['low'],
+            rating_max=row['high'],
+        )
+        for row in rows
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0006_professor_rating_sum_rating_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfessorModuleRating',
+            fields=[
+                ('key', models.CharField(max_length=21, primary_key=True, serialize=False)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_min', models.IntegerField(null=True)),
+                ('rating_max', models.IntegerField(null=True)),
+                ('last_updated', models.DateTimeField(auto_now=True)),
+                ('module', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.module')),
+                ('professor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.professor')),
+            ],
+        ),
+        migrations.RunPython(backfill_module_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0007_professormodulerating'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='module',
+            index=models.Index(fields=['last_updated'], name='module_last_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moduleinstance',
+            index=models.Index(fields=['module', 'semester'], name='instance_module_semester_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='moduleinstance',
+            index=models.Index(fields=['last_updated'], name='instance_last_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='professor',
+            index=models.Index(fields=['last_updated'], name='professor_last_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['professor', 'module_instance'], name='rating_professor_instance_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['last_updated'], name='rating_last_updated_idx'),
+        ),
+    ]
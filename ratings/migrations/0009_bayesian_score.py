@@ -0,0 +1,42 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:18
+
+import ratings.models
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_scores(apps, schema_editor):
+    # One UPDATE per table, with the same expression the write path uses
+    for model_name in ('Professor', 'ProfessorModuleRating'):
+        apps.get_model('ratings', model_name).objects.update(
+            bayesian_score=ratings.models.bayesian_score_expression(F('rating_sum'), F('rating_count'))
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='professor',
+            name='bayesian_score',
+            field=models.FloatField(default=ratings.models.default_score),
+        ),
+        migrations.AddField(
+            model_name='professormodulerating',
+            name='bayesian_score',
+            field=models.FloatField(default=ratings.models.default_score),
+        ),
+        migrations.AddIndex(
+            model_name='professor',
+            index=models.Index(fields=['-bayesian_score', 'id'], name='professor_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='professormodulerating',
+            index=models.Index(fields=['module', '-bayesian_score', 'professor'], name='pmr_module_score_idx'),
+        ),
+        migrations.RunPython(backfill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:23
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0009_bayesian_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingAggregate',
+            fields=[
+                ('professor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='ratings.professor')),
+                ('enqueued_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:34
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0010_pendingaggregate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAggregate',
+            fields=[
+                ('key', models.CharField(max_length=21, primary_key=True, serialize=False)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_count', models.IntegerField(default=0)),
+                ('rating_min', models.IntegerField(null=True)),
+                ('rating_max', models.IntegerField(null=True)),
+                ('module', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.module')),
+                ('professor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.professor')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedRating',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('rating', models.IntegerField()),
+                ('last_updated', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('module_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.moduleinstance')),
+                ('professor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='ratings.professor')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['professor', 'module_instance'], name='archive_professor_instance_idx')],
+                'unique_together': {('module_instance', 'professor', 'user')},
+            },
+        ),
+    ]
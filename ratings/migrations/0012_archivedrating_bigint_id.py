@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0011_archivedrating'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedrating',
+            name='id',
+            field=models.BigIntegerField(primary_key=True, serialize=False),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+
+
+def make_key(professor_id, module_code):
+    return f'{len(professor_id)}:{professor_id}:{module_code}'
+
+
+def group_totals(queryset):
+    return {
+        (professor_id, module_code): (total, count, low, high)
+        for professor_id, module_code, total, count, low, high in queryset.values_list(
+            'professor_id', 'module_instance__module_id'
+        ).annotate(total=Sum('rating'), count=Count('id'), low=Min('rating'), high=Max('rating'))
+    }
+
+
+def rebuild_aggregates(apps, schema_editor):
+    # Rows under the old 'professor:module' keys may have merged two pairs
+    # whose ids contain ':', so both tables are rebuilt from the ratings
+    ArchivedAggregate = apps.get_model('ratings', 'ArchivedAggregate')
+    ArchivedRating = apps.get_model('ratings', 'ArchivedRating')
+    ProfessorModuleRating = apps.get_model('ratings', 'ProfessorModuleRating')
+    Rating = apps.get_model('ratings', 'Rating')
+    weight, mean = settings.RATING_PRIOR_WEIGHT, settings.RATING_PRIOR_MEAN
+
+    archived = group_totals(ArchivedRating.objects.all())
+    ArchivedAggregate.objects.all().delete()
+    ArchivedAggregate.objects.bulk_create([
+        ArchivedAggregate(
+            key=make_key(*pair), professor_id=pair[0], module_id=pair[1],
+            rating_sum=total, rating_count=count, rating_min=low, rating_max=high,
+        )
+        for pair, (total, count, low, high) in archived.items()
+    ], batch_size=500)
+
+    totals = group_totals(Rating.objects.all())
+    for pair, (total, count, low, high) in archived.items():
+        hot_total, hot_count, hot_low, hot_high = totals.get(pair, (0, 0, low, high))
+        totals[pair] = (hot_total + total, hot_count + count, min(hot_low, low), max(hot_high, high))
+    ProfessorModuleRating.objects.all().delete()
+    ProfessorModuleRating.objects.bulk_create([
+        ProfessorModuleRating(
+            key=make_key(*pair), professor_id=pair[0], module_id=pair[1],
+            rating_sum=total, rating_count=count, rating_min=low, rating_max=high,
+            bayesian_score=(total + weight * mean) / (count + weight),
+        )
+        for pair, (total, count, low, high) in totals.items()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0012_archivedrating_bigint_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedaggregate',
+            name='key',
+            field=models.CharField(max_length=24, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='professormodulerating',
+            name='key',
+            field=models.CharField(max_length=24, primary_key=True, serialize=False),
+        ),
+        migrations.RunPython(rebuild_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ratings', '0013_length_prefixed_aggregate_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedrating',
+            name='professor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='ratings.professor'),
+        ),
+        migrations.AlterField(
+            model_name='rating',
+            name='professor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='ratings.professor'),
+        ),
+    ]
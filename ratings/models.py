@@ -1,22 +1,134 @@
-from django.db import models
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
-from django.db.models import Avg
+from django.db.models import Case, Count, F, FloatField, Max, Min, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Greatest, Least
 from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+def bayesian_score(total, count):
+    # The mean shrunk towards RATING_PRIOR_MEAN by RATING_PRIOR_WEIGHT virtual
+    # ratings, so one 5-star rating does not outrank a hundred 4s
+    weight = settings.RATING_PRIOR_WEIGHT
+    return (total + weight * settings.RATING_PRIOR_MEAN) / (count + weight)
+
+
+def bayesian_score_expression(total, count):
+    # SQL form of bayesian_score(), with the same operation order
+    weight = settings.RATING_PRIOR_WEIGHT
+    return Cast(total + weight * settings.RATING_PRIOR_MEAN, FloatField()) / (count + weight)
+
+
+def default_score():
+    return bayesian_score(0, 0)
+
+
+def archived_year(year):
+    # Years before RATING_ARCHIVE_BEFORE_YEAR are moved to ArchivedRating by
+    # archive_ratings and no longer take new ratings
+    cutoff = settings.RATING_ARCHIVE_BEFORE_YEAR
+    return cutoff is not None and year < cutoff
+
+
+def combine_totals(*totals):
+    # Adds (sum, count, min, max) tuples; an empty side has no min or max
+    lows = [low for _, _, low, _ in totals if low is not None]
+    highs = [high for _, _, _, high in totals if high is not None]
+    return (
+        sum(total for total, _, _, _ in totals),
+        sum(count for _, count, _, _ in totals),
+        min(lows, default=None),
+        max(highs, default=None),
+    )
+
+
+def aggregates_deferred():
+    # RATING_AGGREGATES = 'deferred' leaves aggregate upkeep to run_aggregator
+    return settings.RATING_AGGREGATES == 'deferred'
+
 
 class Professor(models.Model):
     id = models.CharField(max_length=10, primary_key=True)
     name = models.CharField(max_length=100)
     average_rating = models.FloatField(default=0.0) 
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    bayesian_score = models.FloatField(default=default_score)
     last_updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_updated'], name='professor_last_updated_idx'),
+            # The leaderboard reads the top N straight off this index
+            models.Index(fields=['-bayesian_score', 'id'], name='professor_score_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
+    @classmethod
+    def apply_rating_delta(cls, professor_id, sum_delta, count_delta):
+        # Single UPDATE; every F() on the right-hand side reads the pre-update row,
+        # so the average is derived from the same values the counters end up with.
+        new_sum = F('rating_sum') + sum_delta
+        new_count = F('rating_count') + count_delta
+        cls.objects.filter(pk=professor_id).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            average_rating=Case(
+                When(rating_count__lte=-count_delta, then=Value(0.0)),
+                default=Cast(new_sum, FloatField()) / new_count,
+                output_field=FloatField(),
+            ),
+            bayesian_score=bayesian_score_expression(new_sum, new_count),
+            last_updated=timezone.now(),
+        )
+
+    @classmethod
+    def recompute_aggregates(cls, professor_ids=None):
+        # One GROUP BY pass over Rating plus the frozen archive totals;
+        # professors without ratings are reset to zero.
+        ratings = Rating.objects.all()
+        professors = cls.objects.all()
+        if professor_ids is not None:
+            ratings = ratings.filter(professor_id__in=professor_ids)
+            professors = professors.filter(pk__in=professor_ids)
+        totals = {
+            row['professor_id']: (row['total'], row['count'])
+            for row in ratings.values('professor_id').annotate(total=Sum('rating'), count=Count('id'))
+        }
+        for professor_id, (total, count) in ArchivedAggregate.professor_totals(professor_ids).items():
+            hot_total, hot_count = totals.get(professor_id, (0, 0))
+            totals[professor_id] = (hot_total + total, hot_count + count)
+        now = timezone.now()
+        changed = []
+        for professor in professors.only('id', 'rating_sum', 'rating_count', 'average_rating', 'bayesian_score'):
+            total, count = totals.get(professor.pk, (0, 0))
+            average = total / count if count else 0.0
+            score = bayesian_score(total, count)
+            current = (professor.rating_sum, professor.rating_count, professor.average_rating, professor.bayesian_score)
+            if current != (total, count, average, score):
+                professor.rating_sum = total
+                professor.rating_count = count
+                professor.average_rating = average
+                professor.bayesian_score = score
+                professor.last_updated = now
+                changed.append(professor)
+        cls.objects.bulk_update(
+            changed, ['rating_sum', 'rating_count', 'average_rating', 'bayesian_score', 'last_updated'], batch_size=500
+        )
+        return len(changed)
+
 class Module(models.Model):
     code = models.CharField(max_length=10, primary_key=True)
     name = models.CharField(max_length=100)
     last_updated = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['last_updated'], name='module_last_updated_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -29,35 +141,284 @@ class ModuleInstance(models.Model):
 
     class Meta:
         unique_together = (('module', 'year', 'semester'),)  
+        indexes = [
+            # RateProfessorView looks instances up without the year
+            models.Index(fields=['module', 'semester'], name='instance_module_semester_idx'),
+            models.Index(fields=['last_updated'], name='instance_last_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.module.name} ({self.year}, Semester {self.semester})"
 
+class ProfessorModuleRating(models.Model):
+    # Running totals per (professor, module); the primary key is derived from both so
+    # lookups by the pair are a single primary-key hit.
+    key = models.CharField(max_length=24, primary_key=True)
+    professor = models.ForeignKey(Professor, on_delete=models.CASCADE)
+    module = models.ForeignKey(Module, on_delete=models.CASCADE)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_min = models.IntegerField(null=True)
+    rating_max = models.IntegerField(null=True)
+    bayesian_score = models.FloatField(default=default_score)
+    last_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Per-module leaderboard, already in rank order
+            models.Index(fields=['module', '-bayesian_score', 'professor'], name='pmr_module_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.professor_id} / {self.module_id}: {self.average_rating}"
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.rating_count if self.rating_count else None
+
+    @staticmethod
+    def make_key(professor_id, module_code):
+        # Both ids may contain ':', so the professor id carries its length:
+        # ('A:B', 'C') -> '3:A:B:C' and ('A', 'B:C') -> '1:A:B:C'
+        professor_id = str(professor_id)
+        return f"{len(professor_id)}:{professor_id}:{module_code}"
+
+    @classmethod
+    def add_rating(cls, professor_id, module_code, value):
+        key = cls.make_key(professor_id, module_code)
+        updates = {
+            'rating_sum': F('rating_sum') + value,
+            'rating_count': F('rating_count') + 1,
+            'rating_min': Least(Coalesce(F('rating_min'), Value(value)), Value(value)),
+            'rating_max': Greatest(Coalesce(F('rating_max'), Value(value)), Value(value)),
+            'bayesian_score': bayesian_score_expression(F('rating_sum') + value, F('rating_count') + 1),
+            'last_updated': timezone.now(),
+        }
+        if cls.objects.filter(pk=key).update(**updates):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    key=key, professor_id=professor_id, module_id=module_code,
+                    rating_sum=value, rating_count=1, rating_min=value, rating_max=value,
+                    bayesian_score=bayesian_score(value, 1),
+                )
+        except IntegrityError:
+            # Another writer created the row first
+            cls.objects.filter(pk=key).update(**updates)
+
+    @classmethod
+    def refresh(cls, professor_id, module_code):
+        # min/max cannot be decremented, so removals re-read the single affected pair
+        key = cls.make_key(professor_id, module_code)
+        hot = Rating.objects.filter(
+            professor_id=professor_id, module_instance__module_id=module_code
+        ).aggregate(total=Sum('rating'), count=Count('id'), low=Min('rating'), high=Max('rating'))
+        archived = ArchivedAggregate.objects.filter(pk=key).values_list(
+            'rating_sum', 'rating_count', 'rating_min', 'rating_max'
+        ).first() or (0, 0, None, None)
+        total, count, low, high = combine_totals((hot['total'] or 0, hot['count'], hot['low'], hot['high']), archived)
+        cls.objects.update_or_create(
+            key=key,
+            defaults={
+                'professor_id': professor_id,
+                'module_id': module_code,
+                'rating_sum': total,
+                'rating_count': count,
+                'rating_min': low,
+                'rating_max': high,
+                'bayesian_score': bayesian_score(total, count),
+            },
+        )
+
+    @classmethod
+    def recompute(cls, professor_ids=None):
+        # Rebuild rows from one GROUP BY over Rating plus the frozen archive
+        # totals, optionally limited to some professors
+        ratings = Rating.objects.all()
+        archived = ArchivedAggregate.objects.all()
+        stale = cls.objects.all()
+        if professor_ids is not None:
+            ratings = ratings.filter(professor_id__in=professor_ids)
+            archived = archived.filter(professor_id__in=professor_ids)
+            stale = stale.filter(professor_id__in=professor_ids)
+        totals = {
+            (professor_id, module_code): (total, count, low, high)
+            for professor_id, module_code, total, count, low, high in ratings.values_list(
+                'professor_id', 'module_instance__module_id'
+            ).annotate(total=Sum('rating'), count=Count('id'), low=Min('rating'), high=Max('rating'))
+        }
+        for professor_id, module_code, *frozen in archived.values_list(
+            'professor_id', 'module_id', 'rating_sum', 'rating_count', 'rating_min', 'rating_max'
+        ):
+            pair = (professor_id, module_code)
+            totals[pair] = combine_totals(totals[pair], frozen) if pair in totals else tuple(frozen)
+        aggregates = [
+            cls(
+                key=cls.make_key(professor_id, module_code),
+                professor_id=professor_id,
+                module_id=module_code,
+                rating_sum=total,
+                rating_count=count,
+                rating_min=low,
+                rating_max=high,
+                bayesian_score=bayesian_score(total, count),
+            )
+            for (professor_id, module_code), (total, count, low, high) in totals.items()
+        ]
+        stale.delete()
+        cls.objects.bulk_create(aggregates, batch_size=500)
+        return len(aggregates)
+
+
 class Rating(models.Model):
     module_instance = models.ForeignKey(ModuleInstance, on_delete=models.CASCADE)
-    professor = models.ForeignKey(Professor, on_delete=models.CASCADE)
+    # Covered by rating_professor_instance_idx
+    professor = models.ForeignKey(Professor, on_delete=models.CASCADE, db_index=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     rating = models.IntegerField()
     last_updated = models.DateTimeField(auto_now=True)
     
     class Meta:
         unique_together = (('module_instance', 'professor', 'user'),)  
+        indexes = [
+            models.Index(fields=['professor', 'module_instance'], name='rating_professor_instance_idx'),
+            models.Index(fields=['last_updated'], name='rating_last_updated_idx'),
+        ]
 
     def __str__(self):
         return f"{self.professor.name}: {self.rating} stars"
 
-    def save(self, *args, **kwargs):
-        if not self.module_instance.professors.filter(id=self.professor.id).exists():
-            raise ValidationError("Professor is not teaching this module instance")
-        super().save(*args, **kwargs)
-        self.update_professor_average_rating()
+    def save(self, *args, check_membership=True, **kwargs):
+        # The setting is checked first so the default costs no instance fetch
+        if settings.RATING_ARCHIVE_BEFORE_YEAR is not None and archived_year(self.module_instance.year):
+            raise ValidationError("Ratings for archived years are closed")
+        if check_membership:
+            from .snapshot import professor_teaches
+            if not professor_teaches(self.professor_id, self.module_instance_id):
+                raise ValidationError("Professor is not teaching this module instance")
+        # No savepoint of its own: a failure must abort the caller's transaction anyway
+        with transaction.atomic(savepoint=False):
+            previous = None
+            if not self._state.adding:
+                previous = Rating.objects.filter(pk=self.pk).values_list(
+                    'professor_id', 'module_instance__module_id', 'rating'
+                ).first()
+            # An edit may move the rating to another professor, whose cached
+            # averages rating_changed has to drop as well
+            self._previous_professor_id = previous[0] if previous else None
+            super().save(*args, **kwargs)
+            if aggregates_deferred():
+                PendingAggregate.enqueue([self.professor_id] + ([previous[0]] if previous else []))
+                return
+            module_code = self.module_instance.module_id
+            Professor.apply_rating_delta(self.professor_id, int(self.rating), 1)
+            if previous is None:
+                ProfessorModuleRating.add_rating(self.professor_id, module_code, int(self.rating))
+            else:
+                Professor.apply_rating_delta(previous[0], -previous[2], -1)
+                ProfessorModuleRating.refresh(previous[0], previous[1])
+                if (previous[0], previous[1]) != (self.professor_id, module_code):
+                    ProfessorModuleRating.refresh(self.professor_id, module_code)
 
     def delete(self, *args, **kwargs):
-        super().delete(*args, **kwargs)
-        self.update_professor_average_rating()
-
-    def update_professor_average_rating(self):
-        ratings = Rating.objects.filter(professor=self.professor)
-        average_rating = ratings.aggregate(Avg('rating'))['rating__avg']
-        self.professor.average_rating = average_rating
-        self.professor.save()
+        with transaction.atomic(savepoint=False):
+            result = super().delete(*args, **kwargs)
+            if aggregates_deferred():
+                PendingAggregate.enqueue([self.professor_id])
+                return result
+            Professor.apply_rating_delta(self.professor_id, -int(self.rating), -1)
+            ProfessorModuleRating.refresh(self.professor_id, self.module_instance.module_id)
+        return result
+
+
+class PendingAggregate(models.Model):
+    # Durable queue of professors whose aggregates need recomputing, drained by
+    # run_aggregator. One row per professor, so a burst of ratings coalesces
+    # into a single recompute; enqueued_at keeps the oldest request.
+    professor = models.OneToOneField(Professor, on_delete=models.CASCADE, primary_key=True)
+    enqueued_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.professor_id} pending since {self.enqueued_at}"
+
+    @classmethod
+    def enqueue(cls, professor_ids):
+        cls.objects.bulk_create([cls(professor_id=pk) for pk in set(professor_ids)], ignore_conflicts=True)
+
+
+class ArchivedRating(models.Model):
+    # Ratings moved out of Rating by archive_ratings (see archive.py), keeping
+    # their primary keys. Nothing writes to them afterwards.
+    id = models.BigIntegerField(primary_key=True)
+    module_instance = models.ForeignKey(ModuleInstance, on_delete=models.CASCADE)
+    # Covered by archive_professor_instance_idx
+    professor = models.ForeignKey(Professor, on_delete=models.CASCADE, db_index=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    rating = models.IntegerField()
+    last_updated = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = (('module_instance', 'professor', 'user'),)
+        indexes = [
+            models.Index(fields=['professor', 'module_instance'], name='archive_professor_instance_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.professor_id}: {self.rating} stars (archived)"
+
+
+class ArchivedAggregate(models.Model):
+    # Frozen totals of the archived ratings per (professor, module), keyed like
+    # ProfessorModuleRating. Every aggregate recompute adds them back in, so
+    # all-time figures never need to read ArchivedRating.
+    key = models.CharField(max_length=24, primary_key=True)
+    professor = models.ForeignKey(Professor, on_delete=models.CASCADE)
+    module = models.ForeignKey(Module, on_delete=models.CASCADE)
+    rating_sum = models.IntegerField(default=0)
+    rating_count = models.IntegerField(default=0)
+    rating_min = models.IntegerField(null=True)
+    rating_max = models.IntegerField(null=True)
+
+    def __str__(self):
+        return f"{self.professor_id} / {self.module_id}: {self.rating_count} archived"
+
+    @classmethod
+    def professor_totals(cls, professor_ids=None):
+        rows = cls.objects.all()
+        if professor_ids is not None:
+            rows = rows.filter(professor_id__in=professor_ids)
+        return {
+            professor_id: (total, count)
+            for professor_id, total, count in rows.values_list('professor_id').annotate(
+                total=Sum('rating_sum'), count=Sum('rating_count')
+            )
+        }
+
+    @classmethod
+    def add_ratings(cls, ratings):
+        # Folds (professor_id, module_code, rating) triples into the totals
+        totals = {}
+        for professor_id, module_code, value in ratings:
+            pair = (professor_id, module_code)
+            totals[pair] = combine_totals(totals.get(pair, (0, 0, None, None)), (value, 1, value, value))
+        keys = {ProfessorModuleRating.make_key(*pair): pair for pair in totals}
+        existing = cls.objects.in_bulk(list(keys))
+        created = []
+        for key, pair in keys.items():
+            total, count, low, high = totals[pair]
+            row = existing.get(key)
+            if row is None:
+                created.append(cls(
+                    key=key, professor_id=pair[0], module_id=pair[1],
+                    rating_sum=total, rating_count=count, rating_min=low, rating_max=high,
+                ))
+                continue
+            row.rating_sum, row.rating_count, row.rating_min, row.rating_max = combine_totals(
+                (row.rating_sum, row.rating_count, row.rating_min, row.rating_max), (total, count, low, high)
+            )
+        cls.objects.bulk_create(created, batch_size=500)
+        cls.objects.bulk_update(
+            existing.values(), ['rating_sum', 'rating_count', 'rating_min', 'rating_max'], batch_size=500
+        )
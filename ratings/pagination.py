@@ -0,0 +1,20 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    # Keyset pagination on the primary key: every page is an indexed range
+    # scan, so deep pages cost the same as the first one.
+    ordering = 'pk'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.pk_name = queryset.model._meta.pk.attname
+        return super().paginate_queryset(queryset, request, view)
+
+    def _get_position_from_instance(self, instance, ordering):
+        # values() rows carry the primary key under its own name, not 'pk'
+        if isinstance(instance, dict) and ordering[0].lstrip('-') == 'pk' and 'pk' not in instance:
+            return str(instance[self.pk_name])
+        return super()._get_position_from_instance(instance, ordering)
@@ -0,0 +1,126 @@
+import hashlib
+import uuid
+
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+
+from .conditional import conditional_response, queryset_state
+from .metrics import REGISTRY
+
+# Response cache for the read endpoints, backed by the 'responses' cache alias.
+# Every entry key embeds the current generation of each scope it depends on
+# ('professor', 'rating:JE1', ...). Signal handlers (see signals.py) replace
+# those generations, so a stale entry is never looked up again and simply ages
+# out of the backend through its TTL or culling.
+CACHE_ALIAS = 'responses'
+
+
+def response_cache():
+    return caches[CACHE_ALIAS]
+
+
+# Management commands write this when their invalidations cannot reach the
+# web workers
+LOCAL_CACHE_WARNING = (
+    'The response cache uses the local-memory backend, which is private to each process: web workers keep '
+    'serving responses cached before this change until they expire. Set DJANGO_RESPONSE_CACHE_DIR to share '
+    'the cache between processes.'
+)
+
+
+def response_cache_is_local():
+    return isinstance(response_cache(), LocMemCache)
+
+
+def generation_key(scope):
+    return f'generation:{scope}'
+
+
+def generations(scopes):
+    cache = response_cache()
+    keys = [generation_key(scope) for scope in scopes]
+    current = cache.get_many(keys)
+    missing = [key for key in keys if key not in current]
+    if missing:
+        # A generation that was never set or has been culled restarts from a
+        # fresh token; add() so a concurrent invalidation is never overwritten.
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, timeout=None)
+        current.update(cache.get_many(missing))
+    return [current.get(key, '') for key in keys]
+
+
+def bump(scopes):
+    response_cache().set_many({generation_key(scope): uuid.uuid4().hex for scope in scopes}, timeout=None)
+
+
+def invalidate_responses(*scopes):
+    # Bumped straight away for readers on this connection and again on commit,
+    # so an entry another connection filled from pre-commit rows is dropped too.
+    bump(scopes)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump(scopes))
+
+
+def entry_key(name, params, scopes):
+    parts = [name, repr(params), *generations(scopes)]
+    return 'response:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+
+def record(name, hit):
+    REGISTRY.increment(
+        'ratings_response_cache_requests_total', 'Response cache lookups by endpoint and result.',
+        endpoint=name, result='hit' if hit else 'miss'
+    )
+
+
+def get_or_build(name, params, scopes, build):
+    # Returns the cached value for (name, params) or stores what build() returns.
+    # A None result is not cached.
+    cache = response_cache()
+    key = entry_key(name, params, scopes)
+    value = cache.get(key)
+    record(name, value is not None)
+    if value is None:
+        value = build()
+        if value is not None:
+            cache.set(key, value)
+    return value
+
+
+def request_params(request):
+    # Paginated payloads carry absolute links, so the host is part of the key
+    return (request.get_host(), request.path, sorted(request.GET.lists()))
+
+
+def cached_queryset_response(request, name, scopes, queryset, build):
+    # Caches the response data together with its validators, so a hit answers
+    # both the conditional check and the body without touching the database.
+    cache = response_cache()
+    key = entry_key(name, request_params(request), scopes)
+    entry = cache.get(key)
+    record(name, entry is not None)
+    if entry is not None:
+        last_modified, version, data = entry
+        return conditional_response(request, last_modified, version, lambda: Response(data))
+
+    last_modified, count = queryset_state(queryset)
+    response = conditional_response(request, last_modified, (last_modified, count), build)
+    if response.status_code == 200 and isinstance(response, Response):
+        cache.set(key, (last_modified, (last_modified, count), response.data))
+    return response
+
+
+class CachedResponseMixin:
+    # Goes ahead of ConditionalGetMixin. Views that leave cache_scopes empty
+    # are not cached.
+    cache_scopes = ()
+
+    def conditional_queryset_response(self, request, queryset, build):
+        if not self.cache_scopes or request.method not in ('GET', 'HEAD'):
+            return super().conditional_queryset_response(request, queryset, build)
+        match = request.resolver_match
+        name = match.url_name if match else type(self).__name__
+        return cached_queryset_response(request, name, self.cache_scopes, queryset, build)
@@ -0,0 +1,217 @@
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from itertools import count
+
+from .metrics import REGISTRY
+from .models import Module, Professor
+
+# In-process search index over professor ids and names and module codes and
+# names, built on first use and rebuilt after a catalogue change. Signals mark
+# it stale in this process (see signals.py); other processes pick changes up
+# within SEARCH_INDEX_MAX_AGE seconds.
+#
+# Every entry is split into normalised words. Prefix matches come from a
+# sorted word list with bisect, typo-tolerant matches from a trigram index
+# over the distinct words, verified with a bounded edit distance. Query time
+# therefore follows the number of matching words, not the catalogue size.
+SEARCH_INDEX_MAX_AGE = 300
+
+EXACT_SCORE = 3.0
+PREFIX_SCORE = 2.0
+FUZZY_SCORE = 1.0
+# Typo-tolerant matching only kicks in for words of letters at least this long
+FUZZY_MIN_LENGTH = 3
+
+WORD = re.compile(r'[^\W_]+')
+
+
+def normalise(text):
+    # Lower case, accents dropped: 'Müller' and 'muller' index the same
+    decomposed = unicodedata.normalize('NFKD', str(text))
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def words(text):
+    return WORD.findall(normalise(text))
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[index:index + 3] for index in range(len(padded) - 2)}
+
+
+def within_distance(first, second, limit):
+    # Edit distance, counting a swap of neighbouring letters as one edit, if it
+    # is at most limit, else None. Only the band of the table that can stay
+    # within the limit is filled.
+    if abs(len(first) - len(second)) > limit:
+        return None
+    before = None
+    previous = list(range(len(second) + 1))
+    for row, char in enumerate(first, 1):
+        current = [row] + [limit + 1] * len(second)
+        for column in range(max(1, row - limit), min(len(second), row + limit) + 1):
+            value = min(
+                previous[column] + 1,
+                current[column - 1] + 1,
+                previous[column - 1] + (char != second[column - 1]),
+            )
+            if before is not None and column > 1 and char == second[column - 2] and first[row - 2] == second[column - 1]:
+                value = min(value, before[column - 2] + 1)
+            current[column] = value
+        # A swap reaches back two rows, so both have to be out of reach
+        if min(current) > limit and min(previous) > limit:
+            return None
+        before, previous = previous, current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def allowed_typos(term):
+    return 1 if len(term) < 7 else 2
+
+
+class SearchIndex:
+    def __init__(self, entries):
+        # entries: (kind, key, label) tuples; an entry's position is its id
+        self.entries = entries
+        self.labels = [normalise(label) for _, _, label in entries]
+        postings = {}
+        for entry_id, (_, key, label) in enumerate(entries):
+            for word in set(words(key)) | set(words(label)):
+                postings.setdefault(word, []).append(entry_id)
+        # Distinct words in sorted order, for prefix ranges
+        self.words = sorted(postings)
+        self.postings = [postings[word] for word in self.words]
+        self.grams = {}
+        for word_id, word in enumerate(self.words):
+            # Ids and codes are matched by prefix only
+            if len(word) >= FUZZY_MIN_LENGTH and word.isalpha():
+                for gram in trigrams(word):
+                    self.grams.setdefault(gram, []).append(word_id)
+        self.built_at = time.monotonic()
+
+    @classmethod
+    def build(cls):
+        entries = [('professor', pk, name) for pk, name in Professor.objects.values_list('pk', 'name').iterator()]
+        entries += [('module', code, name) for code, name in Module.objects.values_list('code', 'name').iterator()]
+        REGISTRY.increment('ratings_search_index_builds_total', 'Search index rebuilds.')
+        return cls(entries)
+
+    def prefix_matches(self, term):
+        # word id -> score, for the words starting with term
+        matches = {}
+        index = bisect_left(self.words, term)
+        while index < len(self.words) and self.words[index].startswith(term):
+            word = self.words[index]
+            # Shorter completions rank first
+            matches[index] = EXACT_SCORE if word == term else PREFIX_SCORE - 0.5 * (len(word) - len(term)) / len(word)
+            index += 1
+        return matches
+
+    def fuzzy_matches(self, term):
+        # word id -> score, for words within allowed_typos() edits of term or
+        # of one of its prefixes, found through shared trigrams
+        if len(term) < FUZZY_MIN_LENGTH or not term.isalpha():
+            return {}
+        limit = allowed_typos(term)
+        term_grams = trigrams(term)
+        shared = {}
+        for gram in term_grams:
+            for word_id in self.grams.get(gram, ()):
+                shared[word_id] = shared.get(word_id, 0) + 1
+        # An edit spoils at most three trigrams, a swap four
+        needed = max(1, len(term_grams) - 4 * limit)
+        matches = {}
+        for word_id, hits in shared.items():
+            if hits < needed:
+                continue
+            word = self.words[word_id]
+            distance = within_distance(term, word, limit)
+            if distance is not None:
+                matches[word_id] = FUZZY_SCORE - 0.25 * distance
+            elif len(word) > len(term):
+                # The term may be a mistyped prefix of a longer word
+                distance = within_distance(term, word[:len(term)], limit)
+                if distance is not None:
+                    matches[word_id] = FUZZY_SCORE - 0.25 * distance - 0.25
+        return matches
+
+    def term_scores(self, term):
+        # entry id -> best score of this term over the entry's words
+        word_scores = self.fuzzy_matches(term)
+        word_scores.update(self.prefix_matches(term))
+        scores = {}
+        for word_id, score in word_scores.items():
+            for entry_id in self.postings[word_id]:
+                if score > scores.get(entry_id, 0.0):
+                    scores[entry_id] = score
+        return scores
+
+    def search(self, query, limit=10, kind=None):
+        terms = words(query)
+        if not terms:
+            return []
+        # Every term has to match; the rarest one narrows the candidates first
+        per_term = sorted((self.term_scores(term) for term in terms), key=len)
+        scores = per_term[0]
+        for other in per_term[1:]:
+            scores = {entry_id: score + other[entry_id] for entry_id, score in scores.items() if entry_id in other}
+
+        phrase = normalise(query).strip()
+        candidates = (
+            (score + (1.0 if self.labels[entry_id].startswith(phrase) else 0.0), entry_id)
+            for entry_id, score in scores.items()
+            if kind is None or self.entries[entry_id][0] == kind
+        )
+        best = heapq.nsmallest(
+            limit, candidates, key=lambda item: (-item[0], self.entries[item[1]][2], self.entries[item[1]][1])
+        )
+        return [
+            {'type': self.entries[entry_id][0], 'id': self.entries[entry_id][1], 'name': self.entries[entry_id][2],
+             'score': round(score, 3)}
+            for score, entry_id in best
+        ]
+
+
+_lock = threading.Lock()
+_versions = count(1)
+_version = 0
+# (index, version it was built at)
+_current = (None, None)
+
+
+def invalidate_search_index():
+    # Not under _lock, so a signal never waits for a rebuild in progress
+    global _version
+    _version = next(_versions)
+
+
+def fresh(current):
+    index, version = current
+    return index is not None and version == _version and time.monotonic() - index.built_at < SEARCH_INDEX_MAX_AGE
+
+
+def get_search_index():
+    global _current
+    current = _current
+    if not fresh(current):
+        with _lock:
+            current = _current
+            if not fresh(current):
+                version = _version
+                current = _current = (SearchIndex.build(), version)
+    return current[0]
+
+
+def clear_search_index():
+    global _current
+    with _lock:
+        _current = (None, None)
+
+
+def search_catalogue(query, limit=10, kind=None):
+    return get_search_index().search(query, limit, kind)
@@ -1,31 +1,144 @@
 from rest_framework import serializers
-from .models import Professor, Module, ModuleInstance, Rating
+from .models import Professor, Module, ModuleInstance, Rating, archived_year
+from .snapshot import professor_teaches
 
-class ProfessorSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin:
+    # Drops every field not named in ``?fields=a,b`` on read requests
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return
+        requested = request.query_params.get('fields')
+        if not requested:
+            return
+        wanted = {name.strip() for name in requested.split(',')}
+        for name in set(self.fields) - wanted:
+            self.fields.pop(name)
+
+class ProfessorSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Professor
         fields = '__all__'
+        # Maintained by rating writes, as in ProfessorAdmin
+        read_only_fields = ('rating_sum', 'rating_count', 'average_rating', 'bayesian_score', 'last_updated')
+
+    def update(self, instance, validated_data):
+        # Only the edited columns are written, so a PUT cannot overwrite
+        # counters that a rating changed since the instance was read. The
+        # primary key stays put; saving it would copy the row.
+        validated_data.pop('id', None)
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(update_fields=[*validated_data, 'last_updated'])
+        return instance
 
-class ModuleSerializer(serializers.ModelSerializer):
+class ModuleSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Module
         fields = '__all__'
 
-class ModuleInstanceSerializer(serializers.ModelSerializer):
+class ModuleInstanceSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = ModuleInstance
         fields = '__all__'
 
-class RatingSerializer(serializers.ModelSerializer):
+class RatingSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Rating
         fields = '__all__'
     def validate(self, data):
-        module_instance = data.get('module_instance')
-        professor = data.get('professor')
+        # Partial updates fall back to the stored values
+        module_instance = data.get('module_instance') or self.instance.module_instance
+        professor = data.get('professor') or self.instance.professor
 
         # Check if the professor is associated with the module instance
-        if not module_instance.professors.filter(id=professor.id).exists():
+        if not professor_teaches(professor.id, module_instance.id):
             raise serializers.ValidationError("Professor is not teaching this module instance")
-        
-        return data
\ No newline at end of file
+        if archived_year(module_instance.year):
+            raise serializers.ValidationError("Ratings for archived years are closed")
+
+        return data
+
+    # validate() has checked membership, so Rating.save() need not repeat it
+    def create(self, validated_data):
+        rating = Rating(**validated_data)
+        rating.save(check_membership=False)
+        return rating
+
+    def update(self, instance, validated_data):
+        for name, value in validated_data.items():
+            setattr(instance, name, value)
+        instance.save(check_membership=False)
+        return instance
+
+
+class ValuesSerializer:
+    # Read-only fast path for list responses: takes a ModelSerializer (with its
+    # sparse fieldset already applied) and produces the same output from
+    # values() rows, without model instances or per-row field machinery.
+    # Many-to-many fields are filled with one query per page.
+    PLAIN_FIELDS = (
+        serializers.CharField, serializers.IntegerField, serializers.FloatField,
+        serializers.BooleanField, serializers.ReadOnlyField,
+    )
+    CONVERTED_FIELDS = (serializers.DateTimeField, serializers.DateField, serializers.DecimalField)
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.pk_name = self.model._meta.pk.attname
+        # (output name, values() lookup or m2m field, converter), in serializer order
+        self.fields = []
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.ManyRelatedField):
+                self.fields.append((name, self.model._meta.get_field(field.source), None))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField):
+                self.fields.append((name, self.model._meta.get_field(field.source).attname, None))
+            elif '.' in field.source or field.source == '*':
+                raise TypeError(f'{name!r} reads {field.source!r}, which has no values() fast path')
+            elif isinstance(field, self.CONVERTED_FIELDS):
+                self.fields.append((name, field.source, field.to_representation))
+            elif isinstance(field, self.PLAIN_FIELDS):
+                self.fields.append((name, field.source, None))
+            else:
+                raise TypeError(f'{type(field).__name__} {name!r} has no values() fast path')
+
+    @classmethod
+    def for_serializer(cls, serializer):
+        # None when some field needs the full serializer
+        try:
+            return cls(serializer)
+        except TypeError:
+            return None
+
+    def values(self, queryset):
+        lookups = {self.pk_name} | {lookup for _, lookup, _ in self.fields if isinstance(lookup, str)}
+        return queryset.prefetch_related(None).values(*lookups)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        pks = [row[self.pk_name] for row in rows]
+        related = {name: self.related_ids(field, pks) for name, field, _ in self.fields if not isinstance(field, str)}
+        result = []
+        for row in rows:
+            item = {}
+            for name, lookup, convert in self.fields:
+                if name in related:
+                    item[name] = related[name].get(row[self.pk_name], [])
+                    continue
+                value = row[lookup]
+                item[name] = convert(value) if convert is not None and value is not None else value
+            result.append(item)
+        return result
+
+    @staticmethod
+    def related_ids(field, pks):
+        through = field.remote_field.through
+        source, target = f'{field.m2m_field_name()}_id', f'{field.m2m_reverse_field_name()}_id'
+        related = {}
+        for chunk_start in range(0, len(pks), 500):
+            for pk, related_pk in through.objects.filter(
+                **{f'{source}__in': pks[chunk_start:chunk_start + 500]}
+            ).order_by(source, target).values_list(source, target):
+                related.setdefault(pk, []).append(related_pk)
+        return related
\ No newline at end of file
@@ -0,0 +1,84 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .authentication import forget_token, forget_user
+from .catalogue import invalidate_module_listing
+from .models import Module, ModuleInstance, Professor, Rating
+from .response_cache import invalidate_responses
+from .search import invalidate_search_index
+from .snapshot import invalidate_snapshot
+
+
+@receiver(post_save, sender=Professor)
+@receiver(post_delete, sender=Professor)
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+@receiver(post_save, sender=ModuleInstance)
+@receiver(post_delete, sender=ModuleInstance)
+def catalogue_changed(sender, **kwargs):
+    invalidate_module_listing()
+    invalidate_snapshot()
+
+
+@receiver(post_save, sender=Professor)
+@receiver(post_delete, sender=Professor)
+def professor_changed(sender, instance, **kwargs):
+    invalidate_responses('professor', f'professor:{instance.pk}')
+    invalidate_search_index()
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+def module_changed(sender, **kwargs):
+    invalidate_responses('module')
+    invalidate_search_index()
+
+
+@receiver(post_save, sender=ModuleInstance)
+@receiver(post_delete, sender=ModuleInstance)
+def module_instance_changed(sender, **kwargs):
+    invalidate_responses('moduleinstance')
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def rating_changed(sender, instance, **kwargs):
+    professor_ids = {instance.professor_id, getattr(instance, '_previous_professor_id', None)} - {None}
+    invalidate_responses('rating', *[f'rating:{professor_id}' for professor_id in professor_ids])
+
+
+@receiver(m2m_changed, sender=ModuleInstance.professors.through)
+def module_professors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # professor.moduleinstance_set.clear() sends no pk_set, so note which
+        # instances lose the professor while the rows are still there
+        instance._cleared_module_instance_ids = list(instance.moduleinstance_set.values_list('pk', flat=True))
+    if not action.startswith('post_'):
+        return
+    # Assignment changes do not touch ModuleInstance rows, so bump last_updated
+    # by hand to keep Last-Modified honest.
+    if not reverse:
+        ModuleInstance.objects.filter(pk=instance.pk).update(last_updated=timezone.now())
+    else:
+        if action == 'post_clear':
+            pk_set = instance.__dict__.pop('_cleared_module_instance_ids', None)
+        if pk_set:
+            ModuleInstance.objects.filter(pk__in=pk_set).update(last_updated=timezone.now())
+    invalidate_module_listing()
+    invalidate_snapshot()
+    invalidate_responses('moduleinstance')
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Password changes and deactivation must not outlive the credential cache
+    forget_user(instance.pk)
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .metrics import REGISTRY
+from .models import ModuleInstance, Professor
+
+# Per-process, immutable copy of the parts of the catalogue the rating write
+# path validates against. It is built on first use and replaced wholesale, so
+# readers never lock. Local catalogue writes mark it stale through signals;
+# writes from other processes are noticed by a version check that runs at most
+# once per RATING_SNAPSHOT_CHECK_INTERVAL seconds.
+
+InstanceRecord = namedtuple('InstanceRecord', ['pk', 'module_code', 'year', 'semester'])
+
+
+class NotTeaching(Exception):
+    pass
+
+
+class ProfessorRecord:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class CatalogueSnapshot:
+    __slots__ = ('version', 'professors', 'instances', 'instances_by_semester', 'members')
+
+    def __init__(self, version, professors, instances, members):
+        self.version = version
+        # professor id -> ProfessorRecord
+        self.professors = professors
+        # (module code, year, semester) -> InstanceRecord
+        self.instances = instances
+        # (module code, semester) -> tuple of InstanceRecord, for lookups without a year
+        by_semester = {}
+        for record in instances.values():
+            by_semester.setdefault((record.module_code, record.semester), []).append(record)
+        self.instances_by_semester = {key: tuple(records) for key, records in by_semester.items()}
+        # instance id -> frozenset of professor ids
+        self.members = members
+
+    @classmethod
+    def build(cls):
+        version = catalogue_version()
+        professors = {pk: ProfessorRecord(pk, name) for pk, name in Professor.objects.values_list('pk', 'name')}
+        instances = {
+            (code, year, semester): InstanceRecord(pk, code, year, semester)
+            for pk, code, year, semester in ModuleInstance.objects.values_list('pk', 'module_id', 'year', 'semester')
+        }
+        members = {}
+        for instance_id, professor_id in ModuleInstance.professors.through.objects.values_list(
+            'moduleinstance_id', 'professor_id'
+        ):
+            members.setdefault(instance_id, set()).add(professor_id)
+        REGISTRY.increment('ratings_catalogue_snapshot_builds_total', 'Catalogue snapshot rebuilds.')
+        return cls(version, professors, instances, {pk: frozenset(ids) for pk, ids in members.items()})
+
+    def teaches(self, professor_id, instance_id):
+        return professor_id in self.members.get(instance_id, ())
+
+    def resolve(self, professor_id, module_code, semester, year=None):
+        # The instance a rating for these request values goes to, raising the
+        # same exceptions RateProfessorView reports
+        professor_id, module_code = str(professor_id), str(module_code)
+        try:
+            semester = int(semester)
+            year = int(year) if year is not None else None
+        except (TypeError, ValueError):
+            semester = None
+        if year is not None:
+            record = self.instances.get((module_code, year, semester))
+            matches = (record,) if record else ()
+        else:
+            matches = self.instances_by_semester.get((module_code, semester), ())
+
+        if len(matches) > 1:
+            raise ModuleInstance.MultipleObjectsReturned
+        if not matches or not self.teaches(professor_id, matches[0].pk):
+            if professor_id not in self.professors:
+                raise Professor.DoesNotExist
+            if not matches:
+                raise ModuleInstance.DoesNotExist
+            raise NotTeaching
+        return matches[0]
+
+
+def catalogue_version():
+    # Moves whenever an instance is saved or removed, an assignment changes
+    # (see signals.py) or a professor is added or removed. Professor.last_updated is left out on
+    # purpose: it changes with every rating.
+    instances = ModuleInstance.objects.aggregate(latest=Max('last_updated'), count=Count('pk'))
+    return (
+        instances['latest'],
+        instances['count'],
+        Professor.objects.count(),
+        ModuleInstance.professors.through.objects.count(),
+    )
+
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+
+
+def expire_check():
+    global _checked_at
+    with _lock:
+        _checked_at = 0.0
+
+
+def invalidate_snapshot():
+    # Forces a version check on next use, now and again once the change commits
+    expire_check()
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(expire_check)
+
+
+def clear_snapshot():
+    global _snapshot, _checked_at
+    with _lock:
+        _snapshot = None
+        _checked_at = 0.0
+
+
+def get_snapshot(force_check=False):
+    global _snapshot, _checked_at
+    snapshot = _snapshot
+    if snapshot is not None and not force_check and time.monotonic() - _checked_at < settings.RATING_SNAPSHOT_CHECK_INTERVAL:
+        return snapshot
+    with _lock:
+        if _snapshot is None or catalogue_version() != _snapshot.version:
+            _snapshot = CatalogueSnapshot.build()
+        _checked_at = time.monotonic()
+        return _snapshot
+
+
+def resolve_module_instance(professor_id, module_code, semester, year=None):
+    # A miss may only mean this process has not seen a new catalogue row yet,
+    # so failures are retried once against a freshly checked snapshot
+    try:
+        return get_snapshot().resolve(professor_id, module_code, semester, year)
+    except (Professor.DoesNotExist, ModuleInstance.DoesNotExist, NotTeaching):
+        return get_snapshot(force_check=True).resolve(professor_id, module_code, semester, year)
+
+
+def professor_teaches(professor_id, instance_id):
+    if get_snapshot().teaches(professor_id, instance_id):
+        return True
+    return get_snapshot(force_check=True).teaches(professor_id, instance_id)
@@ -1,3 +1,1251 @@
-from django.test import TestCase
+import asyncio
+import base64
+import json
+import sqlite3
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import AsyncClient, LiveServerTestCase, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.utils.encoders import JSONEncoder
 
+from . import admin as ratings_admin
+from .authentication import clear_credential_caches
+from .benchmarks import seed_dataset
+from .db_routers import REPLICA_DB_ALIAS, PrimaryReplicaRouter
+from .ingest import RatingImport
+from .loadtest import HTTPConnection, Recorder, parse_mix, run_load
+from .metrics import REGISTRY
+from .renderers import FastJSONRenderer, orjson
+from .models import ArchivedAggregate, ArchivedRating, PendingAggregate, Professor, Module, ModuleInstance, ProfessorModuleRating, Rating
+from .response_cache import CACHE_ALIAS
+from .search import clear_search_index
+from .snapshot import clear_snapshot, get_snapshot, professor_teaches, resolve_module_instance
+from .serializers import ModuleInstanceSerializer, ModuleSerializer, ProfessorSerializer, RatingSerializer
+
+
+class CatalogueMixin:
+    def create_catalogue(self):
+        # Cached responses outlive each test's rolled-back transaction
+        caches[CACHE_ALIAS].clear()
+        clear_credential_caches()
+        clear_snapshot()
+        clear_search_index()
+        self.user = User.objects.create_user(username='alice', password='pass12345')
+        self.other_user = User.objects.create_user(username='bob', password='pass12345')
+        self.professor = Professor.objects.create(id='JE1', name='J. Excellent')
+        self.module = Module.objects.create(code='CD1', name='Computing for Dummies')
+        self.instance = ModuleInstance.objects.create(module=self.module, year=2017, semester=1)
+        self.instance.professors.add(self.professor)
+
+
+class ProfessorAggregateTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+
+    def test_save_and_delete_maintain_running_totals(self):
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=5)
+        second = Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=2)
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count), (7, 2))
+        self.assertEqual(self.professor.average_rating, 3.5)
+
+        second.rating = 4
+        second.save()
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count), (9, 2))
+
+        for rating in Rating.objects.all():
+            rating.delete()
+        self.professor.refresh_from_db()
+        self.assertEqual(self.professor.average_rating, 0.0)
+
+    def test_reconcile_averages_repairs_drift(self):
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+        Professor.objects.filter(pk=self.professor.pk).update(rating_sum=40, rating_count=3, average_rating=1.0)
+        call_command('reconcile_averages', stdout=StringIO(), stderr=StringIO())
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count), (4, 1))
+        self.assertEqual(self.professor.average_rating, 4.0)
+
+
+class ModuleRatingAggregateTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+
+    def average(self, professor_id='JE1', module_code='CD1'):
+        return self.client.post('/api/average-rating/', {'professor_id': professor_id, 'module_code': module_code}, format='json')
+
+    def test_aggregate_tracks_writes(self):
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=5)
+        rating = Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=2)
+        aggregate = ProfessorModuleRating.objects.get(pk='3:JE1:CD1')
+        self.assertEqual((aggregate.rating_count, aggregate.rating_min, aggregate.rating_max), (2, 2, 5))
+
+        rating.delete()
+        aggregate.refresh_from_db()
+        self.assertEqual((aggregate.rating_sum, aggregate.rating_count, aggregate.rating_min), (5, 1, 5))
+
+    def test_average_rating_view(self):
+        self.assertIsNone(self.average().data['average_rating'])
+        self.assertEqual(self.average(professor_id='XX9').status_code, 404)
+        self.assertEqual(self.average(module_code='XX9').status_code, 404)
+
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=3)
+        with self.assertNumQueries(1):
+            response = self.average()
+        self.assertEqual(response.data['average_rating'], 3.5)
+        self.assertEqual(response.data['module_name'], 'Computing for Dummies')
+
+    def test_backfill_command(self):
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+        ProfessorModuleRating.objects.all().delete()
+        call_command('backfill_module_ratings', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(ProfessorModuleRating.objects.get(pk='3:JE1:CD1').rating_sum, 4)
+
+    def test_keys_do_not_collide_on_colons(self):
+        # ('A:B', 'C') and ('A', 'B:C') would both be 'A:B:C' without the prefix
+        pairs = [('A:B', 'C', 5), ('A', 'B:C', 1)]
+        for professor_id, module_code, value in pairs:
+            professor = Professor.objects.create(id=professor_id, name=f'Professor {professor_id}')
+            module = Module.objects.create(code=module_code, name=f'Module {module_code}')
+            instance = ModuleInstance.objects.create(module=module, year=2017, semester=1)
+            instance.professors.add(professor)
+            Rating.objects.create(module_instance=instance, professor=professor, user=self.user, rating=value)
+
+        self.assertEqual(ProfessorModuleRating.objects.filter(professor__in=['A:B', 'A']).count(), 2)
+        for professor_id, module_code, value in pairs:
+            response = self.average(professor_id=professor_id, module_code=module_code)
+            self.assertEqual(response.data['average_rating'], value)
+            self.assertEqual(response.data['module_name'], f'Module {module_code}')
+
+
+class ListModulesViewTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+
+    def test_listing_is_cached_until_catalogue_changes(self):
+        # Four version queries, then the listing itself
+        with self.assertNumQueries(6):
+            response = self.client.get('/api/list-modules/')
+        self.assertEqual(response.data[0]['taught_by'], 'Professor J. Excellent (JE1)')
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            self.client.get('/api/list-modules/')
+
+        second = Professor.objects.create(id='VS1', name='V. Smart')
+        self.instance.professors.add(second)
+        response = self.client.get('/api/list-modules/')
+        self.assertEqual(response.data[0]['taught_by'], 'Professor J. Excellent (JE1), Professor V. Smart (VS1)')
+
+    def test_changes_from_other_processes(self):
+        first = self.client.get('/api/list-modules/')
+        with mock.patch('ratings.catalogue.LISTING_CHECK_INTERVAL', 0):
+            with self.assertNumQueries(4):
+                self.client.get('/api/list-modules/')
+            # Queryset updates send no signals, like a write in another worker
+            Module.objects.filter(pk='CD1').update(name='Computing for Experts', last_updated=timezone.now())
+            response = self.client.get('/api/list-modules/')
+        self.assertEqual(response.data[0]['name'], 'Computing for Experts')
+
+        # Renames are invisible to the version check but not to the maximum age
+        renamed_at = timezone.now() + timedelta(seconds=2)
+        Professor.objects.filter(pk='JE1').update(name='J. Renamed', last_updated=renamed_at)
+        with mock.patch('ratings.catalogue.LISTING_MAX_AGE', 0):
+            response = self.client.get('/api/list-modules/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['taught_by'], 'Professor J. Renamed (JE1)')
+
+
+class ConditionalGetTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+
+    def test_etag_round_trip_returns_304(self):
+        for url in ['/api/professors/', '/api/professors/JE1/', '/api/ratings/', '/api/ratings-list/', '/api/list-modules/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn('ETag', response)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304, url)
+            self.assertEqual(response.content, b'')
+
+    def test_rating_write_changes_validators(self):
+        etag = self.client.get('/api/ratings/')['ETag']
+        rating = Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=3)
+        self.assertEqual(self.client.get('/api/ratings/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get('/api/ratings/')['ETag']
+        rating.delete()
+        self.assertEqual(self.client.get('/api/ratings/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_modified_since(self):
+        response = self.client.get('/api/module-instances/')
+        response = self.client.get('/api/module-instances/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_reverse_clear_changes_validators(self):
+        etag = self.client.get('/api/module-instances/')['ETag']
+        self.professor.moduleinstance_set.clear()
+        response = self.client.get('/api/module-instances/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'][0]['professors'], [])
+
+
+class PaginationTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        for index in range(5):
+            Professor.objects.create(id=f'P{index}', name=f'Professor {index}')
+
+    def test_cursor_pages_cover_table_in_key_order(self):
+        seen = []
+        url = '/api/professors/?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, sorted(Professor.objects.values_list('id', flat=True)))
+
+    def test_sparse_fieldsets(self):
+        response = self.client.get('/api/professors/?fields=id,name')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        # Two validator queries plus the page itself; no per-row professors query
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/module-instances/?fields=id,year')
+        self.assertEqual(response.data['results'], [{'id': self.instance.pk, 'year': 2017}])
+
+
+class BulkRateTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_json_reports_each_row(self):
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=1)
+        rows = [
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'year': 2017, 'semester': 1, 'rating': 5},
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 4},
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 3, 'user_name': 'bob'},
+            {'professor_id': 'XX9', 'module_code': 'CD1', 'semester': 1, 'rating': 3},
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 2, 'rating': 3},
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1},
+        ]
+        response = self.client.post('/api/rate/bulk/', rows, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['status'] for row in response.data['rows']],
+                         ['created', 'duplicate', 'error', 'error', 'error', 'error'])
+        self.assertEqual(response.data['rows'][2]['message'], 'Only staff can rate on behalf of another user')
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count), (6, 2))
+        self.assertEqual(ProfessorModuleRating.objects.get(pk='3:JE1:CD1').rating_max, 5)
+
+    def test_staff_can_rate_on_behalf_of_others(self):
+        self.user.is_staff = True
+        self.user.save()
+        row = {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 3, 'user_name': 'bob'}
+        response = self.client.post('/api/rate/bulk/', [row], format='json')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(Rating.objects.get().user, self.other_user)
+
+    def test_rows_that_lose_an_insert_race_are_duplicates(self):
+        rows = [
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 5},
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 2, 'user_name': 'bob'},
+        ]
+        self.user.is_staff = True
+        self.user.save()
+        load_lookups = RatingImport.load_lookups
+
+        def racing_load_lookups(importer, parsed):
+            load_lookups(importer, parsed)
+            # Another writer stores bob's rating after the lookups were read
+            Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=1)
+
+        with mock.patch.object(RatingImport, 'load_lookups', racing_load_lookups):
+            report = RatingImport(rows, self.user).run()
+        self.assertEqual([row['status'] for row in report], ['created', 'duplicate'])
+        self.assertEqual(Rating.objects.get(user=self.other_user).rating, 1)
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count), (6, 2))
+
+    def test_bulk_ndjson(self):
+        body = '{"professor_id": "JE1", "module_code": "CD1", "semester": 1, "rating": 4}\n\n'
+        response = self.client.post('/api/rate/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.data['created'], 1)
+        response = self.client.post('/api/rate/bulk/', '{"broken"\n', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+
+
+class RateProfessorViewTests(CatalogueMixin, TestCase):
+    # SAVEPOINT/RELEASE pairs are counted because TestCase wraps every test in a
+    # transaction; outside tests the outer atomic block is a plain BEGIN/COMMIT.
+    # The catalogue lookups are answered by the snapshot, warmed before counting.
+    FIRST_RATING_QUERY_BUDGET = 8
+    RATING_QUERY_BUDGET = 5
+
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rate(self, **overrides):
+        payload = {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 4}
+        payload.update(overrides)
+        return self.client.post('/api/rate/', payload, format='json')
+
+    def test_query_budget(self):
+        get_snapshot()
+        with self.assertNumQueries(self.FIRST_RATING_QUERY_BUDGET):
+            response = self.rate()
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('Last-Modified', response)
+
+        self.client.force_authenticate(self.other_user)
+        with self.assertNumQueries(self.RATING_QUERY_BUDGET):
+            response = self.rate(rating=2)
+        self.assertEqual(response.status_code, 201)
+
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count), (6, 2))
+        self.assertEqual(Rating.objects.get(pk=response.data['rating_id']).user, self.other_user)
+
+    def test_catalogue_lookup_runs_before_the_write_transaction(self):
+        depths = []
+
+        def resolve(*args):
+            depths.append(len(connection.savepoint_ids))
+            return resolve_module_instance(*args)
+
+        outside = len(connection.savepoint_ids)
+        with mock.patch('ratings.views.resolve_module_instance', resolve):
+            self.assertEqual(self.rate().status_code, 201)
+        self.assertEqual(depths, [outside])
+
+    def test_errors(self):
+        self.rate()
+        response = self.rate()
+        self.assertEqual((response.status_code, response.data['message']), (400, 'Rating already exists and cannot be updated'))
+        self.assertEqual(Rating.objects.count(), 1)
+        self.professor.refresh_from_db()
+        self.assertEqual(self.professor.rating_count, 1)
+
+        self.assertEqual(self.rate(professor_id='XX9').data['message'], 'Professor not found')
+        self.assertEqual(self.rate(module_code='XX9').data['message'], 'Module instance not found')
+        self.assertEqual(self.rate(rating='five').status_code, 400)
+
+        Professor.objects.create(id='VS1', name='V. Smart')
+        self.assertEqual(self.rate(professor_id='VS1').data['message'], 'Professor is not teaching this module instance')
+
+        ModuleInstance.objects.create(module=self.module, year=2018, semester=1)
+        self.assertEqual(self.rate().status_code, 400)
+        self.assertEqual(self.rate(year=2018).data['message'], 'Professor is not teaching this module instance')
+
+
+class AsyncViewTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+
+    async def test_async_read_endpoints(self):
+        client = AsyncClient()
+        response = await client.get('/api/async/list-modules/')
+        self.assertEqual(response.json()[0]['taught_by'], 'Professor J. Excellent (JE1)')
+        response = await client.get('/api/async/list-modules/', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+        response = await client.get('/api/async/ratings-list/')
+        self.assertEqual(response.json()['ratings'], ['The rating of Professor J. Excellent (JE1) is ★★★★'])
+
+        response = await client.post('/api/async/average-rating/', {'professor_id': 'JE1', 'module_code': 'CD1'},
+                                     content_type='application/json')
+        self.assertEqual(response.json()['average_rating'], 4.0)
+        response = await client.post('/api/async/average-rating/', {'professor_id': 'XX9', 'module_code': 'CD1'})
+        self.assertEqual(response.status_code, 404)
+        for body in ['[1]', '"x"', '{']:
+            response = await client.post('/api/async/average-rating/', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertEqual(response.json()['message'], 'Malformed JSON body')
+
+        response = await client.get('/api/async/module-instances/')
+        self.assertEqual(response.json()['results'][0]['professors'], ['JE1'])
+        response = await client.get(f'/api/async/module-instances/{self.instance.pk}/?fields=year')
+        self.assertEqual(response.json(), {'year': 2017})
+        response = await client.get('/api/async/professors/XX9/')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_async_list_pagination(self):
+        await Professor.objects.abulk_create([Professor(id=f'P{index}', name=f'P {index}') for index in range(3)])
+        client = AsyncClient()
+        seen = []
+        url = '/api/async/professors/?page_size=2'
+        while url:
+            body = (await client.get(url)).json()
+            seen += [row['id'] for row in body['results']]
+            url = body['next']
+        self.assertEqual(seen, ['JE1', 'P0', 'P1', 'P2'])
+        for page_size in ('0', '-5'):
+            response = await client.get(f'/api/async/professors/?page_size={page_size}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([row['id'] for row in response.json()['results']], ['JE1'])
+
+
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def test_routing(self):
+        router = PrimaryReplicaRouter()
+        with mock.patch.dict(settings.DATABASES, {'default': settings.DATABASES['default']}, clear=True):
+            self.assertIsNone(router.db_for_read(Rating))
+        with mock.patch.dict(settings.DATABASES, replica={}):
+            self.assertEqual(router.db_for_read(Rating), 'replica')
+            self.assertEqual(router.db_for_write(Rating), 'default')
+            self.assertFalse(router.allow_migrate('replica', 'ratings'))
+
+
+@skipUnless(REPLICA_DB_ALIAS in settings.DATABASES, 'Run with DJANGO_DATABASE_PROFILE=production')
+class ProductionProfileTests(CatalogueMixin, TransactionTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.create_catalogue()
+
+    def pragma(self, alias, name):
+        with connections[alias].cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas(self):
+        self.assertEqual(self.pragma('default', 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma('default', 'busy_timeout'), 20000)
+        self.assertEqual(self.pragma('default', 'query_only'), 0)
+        self.assertEqual(self.pragma(REPLICA_DB_ALIAS, 'query_only'), 1)
+
+    def test_replica_refuses_writes(self):
+        self.assertEqual(Professor.objects.using(REPLICA_DB_ALIAS).get(pk='JE1').name, 'J. Excellent')
+        with self.assertRaises(OperationalError):
+            Professor.objects.using(REPLICA_DB_ALIAS).filter(pk='JE1').update(name='Renamed')
+        # Reads route to the replica except inside a transaction on the primary
+        self.assertEqual(Professor.objects.all().db, REPLICA_DB_ALIAS)
+        with transaction.atomic():
+            self.assertEqual(Professor.objects.all().db, 'default')
+
+    def test_transactions_take_the_write_lock_at_begin(self):
+        other = sqlite3.connect(connections['default'].settings_dict['NAME'], timeout=0, isolation_level=None)
+        try:
+            with transaction.atomic():
+                # Nothing written yet, but BEGIN IMMEDIATE already holds the lock
+                Professor.objects.get(pk='JE1')
+                with self.assertRaises(sqlite3.OperationalError):
+                    other.execute('BEGIN IMMEDIATE')
+            other.execute('BEGIN IMMEDIATE')
+            other.execute('ROLLBACK')
+        finally:
+            other.close()
+
+
+class QueryPlanTests(CatalogueMixin, TestCase):
+    # Runs EXPLAIN QUERY PLAN over every statement an endpoint issues and fails
+    # on full table scans. A scan is tolerated when it walks an index, when a
+    # LIMIT bounds it without a temporary sort, or when the endpoint lists the
+    # whole table by design.
+
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rating = Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=3)
+
+    def assertIndexed(self, method, url, full_listing=(), **kwargs):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, **kwargs)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            bounded = ' LIMIT ' in sql and not any('TEMP B-TREE' in step for step in plan)
+            for step in plan:
+                if not step.startswith('SCAN ') or ' INDEX ' in step or bounded:
+                    continue
+                if step.split()[1] in full_listing:
+                    continue
+                self.fail(f'{method.upper()} {url} scans a table ({step}):\n{sql}\n{plan}')
+        return response
+
+    def test_no_index_duplicates_a_composite_prefix(self):
+        # The professor/instance indexes already serve professor_id lookups
+        for model in [Rating, ArchivedRating]:
+            with connection.cursor() as cursor:
+                constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+            indexed = [entry['columns'] for entry in constraints.values() if entry['index']]
+            self.assertIn(['professor_id', 'module_instance_id'], indexed)
+            self.assertNotIn(['professor_id'], indexed)
+
+    def test_router_endpoints(self):
+        for prefix in ['professors', 'modules', 'module-instances', 'ratings']:
+            self.assertIndexed('get', f'/api/{prefix}/')
+        self.assertIndexed('get', '/api/professors/JE1/')
+        self.assertIndexed('get', '/api/modules/CD1/')
+        self.assertIndexed('get', f'/api/module-instances/{self.instance.pk}/')
+        self.assertIndexed('get', f'/api/ratings/{self.rating.pk}/')
+        rating = {'module_instance': self.instance.pk, 'professor': 'JE1', 'user': self.other_user.pk, 'rating': 5}
+        self.assertIndexed('put', f'/api/ratings/{self.rating.pk}/', data=rating, format='json')
+        self.assertIndexed('delete', f'/api/ratings/{self.rating.pk}/')
+
+    def test_rating_endpoints(self):
+        rating = {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 4}
+        self.assertIndexed('post', '/api/rate/', data=rating, format='json')
+        self.assertIndexed('post', '/api/average-rating/', data=rating, format='json')
+        self.assertIndexed('post', '/api/average-rating/', data={'professor_id': 'JE1', 'module_code': 'XX9'}, format='json')
+        self.assertIndexed('post', '/api/rate/bulk/', data=[rating], format='json')
+
+    def test_listing_endpoints(self):
+        self.assertIndexed('get', '/api/ratings-list/', full_listing={'ratings_professor'})
+        self.assertIndexed('get', '/api/ratings-list/?compact=1')
+        self.assertIndexed('get', '/api/leaderboard/')
+        self.assertIndexed('get', '/api/leaderboard/?module_code=CD1&min_ratings=0')
+        self.assertIndexed('get', '/api/list-modules/', full_listing={'ratings_moduleinstance'})
+
+
+class RequestMetricsTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        REGISTRY.reset()
+
+    def test_metrics_exposition(self):
+        self.client.get('/api/professors/')
+        self.client.get('/api/professors/')
+        self.client.get('/api/nowhere/')
+        body = self.client.get('/api/metrics/').content.decode()
+
+        labels = 'view="professor-list",method="GET"'
+        self.assertIn(f'ratings_http_request_duration_seconds_count{{{labels}}} 2', body)
+        self.assertIn(f'ratings_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 2', body)
+        self.assertIn(f'ratings_http_requests_total{{{labels},status="2xx"}} 2', body)
+        # The second request is answered from the response cache
+        self.assertIn(f'ratings_db_queries_total{{{labels}}} 3', body)
+        self.assertIn('ratings_http_requests_total{view="unmatched",method="GET",status="4xx"} 1', body)
+        self.assertRegex(body, r'ratings_http_response_bytes_total\{view="professor-list",method="GET"\} [1-9]')
+
+    async def test_async_views_are_recorded(self):
+        await self.async_client.get('/api/async/professors/')
+        body = REGISTRY.render()
+        self.assertIn('ratings_db_queries_total{view="async_professor_list",method="GET"} 3', body)
+
+
+class ResponseCacheTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        REGISTRY.reset()
+
+    def average(self, professor_id='JE1'):
+        return self.client.post('/api/average-rating/', {'professor_id': professor_id, 'module_code': 'CD1'}, format='json')
+
+    def test_hits_skip_the_database(self):
+        for url in ['/api/professors/', '/api/modules/', '/api/ratings-list/']:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(second.content, first.content, url)
+            self.assertEqual(second['ETag'], first['ETag'], url)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304, url)
+        self.average()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.average().data['professor_name'], 'J. Excellent')
+
+        body = REGISTRY.render()
+        self.assertIn('ratings_response_cache_requests_total{endpoint="professor-list",result="hit"} 2', body)
+        self.assertIn('ratings_response_cache_requests_total{endpoint="average_rating",result="miss"} 1', body)
+
+    def test_commands_warn_about_a_process_local_cache(self):
+        stderr = StringIO()
+        call_command('reconcile_averages', stdout=StringIO(), stderr=stderr)
+        self.assertIn('private to each process', stderr.getvalue())
+
+        with tempfile.TemporaryDirectory() as location:
+            shared = dict(settings.CACHES, responses={
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+            })
+            with override_settings(CACHES=shared):
+                stderr = StringIO()
+                call_command('reconcile_averages', stdout=StringIO(), stderr=stderr)
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_parameters_are_part_of_the_key(self):
+        self.client.get('/api/professors/')
+        self.assertEqual(self.client.get('/api/professors/?fields=id').data['results'], [{'id': 'JE1'}])
+        self.assertEqual(self.average(professor_id='XX9').status_code, 404)
+
+    def test_signals_invalidate_dependent_entries(self):
+        self.client.get('/api/modules/')
+        self.average()
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+        self.assertEqual(self.average().data['average_rating'], 4.0)
+        self.assertEqual(self.client.get('/api/professors/').data['results'][0]['average_rating'], 4.0)
+        # A rating leaves the module listing cached
+        with self.assertNumQueries(0):
+            self.client.get('/api/modules/')
+
+        self.module.name = 'Renamed'
+        self.module.save()
+        self.assertEqual(self.client.get('/api/modules/').data['results'][0]['name'], 'Renamed')
+        self.assertEqual(self.average().data['module_name'], 'Renamed')
+
+    def test_moving_a_rating_invalidates_both_professors(self):
+        other = Professor.objects.create(id='VS1', name='V. Smart')
+        self.instance.professors.add(other)
+        rating = Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+        self.assertEqual(self.average().data['average_rating'], 4.0)
+        self.assertIsNone(self.average('VS1').data['average_rating'])
+
+        rating.professor = other
+        with CaptureQueriesContext(connection) as context:
+            rating.save()
+        # The row's previous values are read once, by save() itself
+        lookups = [
+            sql for sql in (query['sql'] for query in context.captured_queries)
+            if sql.startswith('SELECT') and 'WHERE "ratings_rating"."id" =' in sql
+        ]
+        self.assertEqual(len(lookups), 1)
+        self.assertIsNone(self.average().data['average_rating'])
+        self.assertEqual(self.average('VS1').data['average_rating'], 4.0)
+
+    def test_bulk_import_invalidates(self):
+        self.average()
+        self.client.force_authenticate(self.user)
+        self.client.post('/api/rate/bulk/', [
+            {'professor_id': 'JE1', 'module_code': 'CD1', 'year': 2017, 'semester': 1, 'rating': 2},
+        ], format='json')
+        self.assertEqual(self.average().data['average_rating'], 2.0)
+
+
+class CredentialCacheTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        self.rating = {'professor_id': 'JE1', 'module_code': 'CD1', 'semester': 1, 'rating': 4}
+
+    def test_token_is_looked_up_once(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        with CaptureQueriesContext(connection) as first:
+            self.client.get('/api/ratings/')
+        with CaptureQueriesContext(connection) as second:
+            self.client.get('/api/ratings/')
+        self.assertEqual(len(first.captured_queries) - len(second.captured_queries), 1)
+
+        self.assertEqual(self.client.post('/api/logout/').status_code, 200)
+        # SessionAuthentication comes first, so DRF answers failed credentials with 403
+        self.assertEqual(self.client.post('/api/rate/', self.rating, format='json').status_code, 403)
+
+    def test_basic_credentials_are_hashed_once(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'alice:pass12345').decode())
+        with mock.patch('django.contrib.auth.hashers.PBKDF2PasswordHasher.verify', return_value=True) as verify:
+            self.client.get('/api/ratings/')
+            self.client.get('/api/ratings/')
+        self.assertEqual(verify.call_count, 1)
+
+        self.user.set_password('changed-password')
+        self.user.save()
+        self.assertEqual(self.client.post('/api/rate/', self.rating, format='json').status_code, 403)
+
+
+class RatingExportTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        other = Professor.objects.create(id='VS1', name='V. Smart')
+        self.instance.professors.add(other)
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=5)
+        Rating.objects.create(module_instance=self.instance, professor=other, user=self.user, rating=2)
+
+    def export(self, query='', **headers):
+        response = self.client.get(f'/api/export/ratings/{query}', **headers)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_is_the_default(self):
+        with self.assertNumQueries(1):
+            response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual([(row['professor_id'], row['module_code'], row['year'], row['rating']) for row in rows],
+                         [('JE1', 'CD1', 2017, 5), ('VS1', 'CD1', 2017, 2)])
+
+    def test_csv_and_filters(self):
+        response, body = self.export('?professor_id=VS1', HTTP_ACCEPT='text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="ratings.csv"')
+        lines = body.splitlines()
+        self.assertEqual(lines[0], 'id,professor_id,module_code,year,semester,rating,last_updated')
+        self.assertEqual(len(lines), 2)
+        self.assertIn(',VS1,CD1,2017,1,2,', lines[1])
+
+        self.assertEqual(self.export('?format=csv&module_code=XX9')[1].splitlines(), [lines[0]])
+        self.assertEqual(self.export('?since=2999-01-01')[1], '')
+        self.assertEqual(len(self.export('?since=2000-01-01T00:00:00Z')[1].splitlines()), 2)
+        self.assertEqual(self.client.get('/api/export/ratings/?since=yesterday').status_code, 400)
+
+
+class ImportCatalogueTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, content):
+        path = Path(self.directory.name) / name
+        path.write_text(content if isinstance(content, str) else json.dumps(content))
+        return str(path)
+
+    def import_catalogue(self, *args):
+        output = StringIO()
+        call_command('import_catalogue', *args, stdout=output, stderr=StringIO())
+        return output.getvalue()
+
+    def test_upserts_and_replaces_assignments(self):
+        professors = self.write('professors.csv', 'id,name\nJE1,J. Excellent\nVS1,V. Smart\nTT1,T. Tiny\n')
+        modules = self.write('modules.json', [{'code': 'CD1', 'name': 'Computing for Experts'}])
+        instances = self.write('instances.csv', 'module_code,year,semester,professors\nCD1,2017,1,VS1;TT1\nCD1,2018,2,JE1\n')
+        args = ['--professors', professors, '--modules', modules, '--instances', instances]
+
+        with self.assertNumQueries(4):
+            diff = self.import_catalogue(*args, '--dry-run')
+        self.assertIn("+ professor VS1 'V. Smart'", diff)
+        self.assertIn("~ module CD1 'Computing for Dummies' -> 'Computing for Experts'", diff)
+        self.assertIn('+ instance CD1 2018/2', diff)
+        self.assertIn('- assignment JE1 -> CD1 2017/1', diff)
+        self.assertFalse(Professor.objects.filter(pk='VS1').exists())
+
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+        self.import_catalogue(*args)
+        self.assertEqual(Module.objects.get().name, 'Computing for Experts')
+        self.assertEqual(set(self.instance.professors.values_list('pk', flat=True)), {'VS1', 'TT1'})
+        second = ModuleInstance.objects.get(year=2018)
+        self.assertEqual(list(second.professors.values_list('pk', flat=True)), ['JE1'])
+        # Aggregates survive the upsert
+        self.assertEqual(Professor.objects.get(pk='JE1').rating_count, 1)
+        self.assertIn('Computing for Experts', self.client.get('/api/list-modules/').content.decode())
+
+        self.assertIn('0 professors, 0 modules, 0 instances', self.import_catalogue(*args))
+
+    def test_blank_professors_cell_keeps_assignments(self):
+        ModuleInstance.objects.create(module=self.module, year=2018, semester=1).professors.add(self.professor)
+        instances = self.write('instances.csv', 'module_code,year,semester,professors\nCD1,2017,1, \nCD1,2018,1,-\n')
+        self.import_catalogue('--instances', instances)
+        self.assertEqual(list(self.instance.professors.values_list('pk', flat=True)), ['JE1'])
+        self.assertFalse(ModuleInstance.objects.get(year=2018).professors.exists())
+
+    def test_unknown_references_are_rejected(self):
+        instances = self.write('instances.json', [{'module_code': 'CD1', 'year': 2019, 'semester': 1, 'professors': ['XX9']}])
+        with self.assertRaisesMessage(CommandError, 'Unknown professor(s): XX9'):
+            self.import_catalogue('--instances', instances)
+        self.assertFalse(ModuleInstance.objects.filter(year=2019).exists())
+
+
+class LeaderboardTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        self.second = Professor.objects.create(id='VS1', name='V. Smart')
+        self.other_module = Module.objects.create(code='PG1', name='Programming')
+        self.later = ModuleInstance.objects.create(module=self.other_module, year=2018, semester=2)
+        self.instance.professors.add(self.second)
+        self.later.professors.add(self.second)
+        users = [User.objects.create(username=f'rater-{index}') for index in range(4)]
+        # JE1: a single 5. VS1: four 4s in CD1 and a 1 in PG1.
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=5)
+        for user in users:
+            Rating.objects.create(module_instance=self.instance, professor=self.second, user=user, rating=4)
+        Rating.objects.create(module_instance=self.later, professor=self.second, user=self.user, rating=1)
+
+    def ranking(self, query=''):
+        response = self.client.get(f'/api/leaderboard/{query}')
+        self.assertEqual(response.status_code, 200)
+        return [(row['professor_id'], row['score'], row['rating_count']) for row in response.data['leaderboard']]
+
+    def test_scores_follow_writes(self):
+        # (sum + 5 * 3.0) / (count + 5)
+        self.assertAlmostEqual(Professor.objects.get(pk='JE1').bayesian_score, 20 / 6)
+        self.assertAlmostEqual(ProfessorModuleRating.objects.get(pk='3:VS1:CD1').bayesian_score, 31 / 9)
+        Professor.objects.update(bayesian_score=0)
+        call_command('reconcile_averages', stdout=StringIO(), stderr=StringIO())
+        self.assertAlmostEqual(Professor.objects.get(pk='VS1').bayesian_score, 32 / 10)
+
+    def test_ranking_and_filters(self):
+        self.assertEqual(self.ranking(), [('JE1', 3.333, 1), ('VS1', 3.2, 5)])
+        self.assertEqual(self.ranking('?module_code=CD1'), [('VS1', 3.444, 4), ('JE1', 3.333, 1)])
+        self.assertEqual(self.ranking('?min_ratings=2&limit=1'), [('VS1', 3.2, 5)])
+        self.assertEqual(self.ranking('?year=2018'), [('VS1', 2.667, 1)])
+        self.assertEqual(self.ranking('?semester=1&module_code=CD1&min_ratings=4'), [('VS1', 3.444, 4)])
+        self.assertEqual(self.client.get('/api/leaderboard/?limit=top').status_code, 400)
+
+    def test_professor_writes_leave_aggregates_alone(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.patch('/api/professors/VS1/', {
+            'rating_sum': 500, 'rating_count': 100, 'average_rating': 5.0, 'bayesian_score': 5.0,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        # A PUT built from a stale read does not roll back a newer rating
+        stale = self.client.get('/api/professors/JE1/').data
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=1)
+        self.assertEqual(self.client.put('/api/professors/JE1/', dict(stale, name='J. Renamed'), format='json').status_code, 200)
+        self.assertEqual(self.ranking(), [('VS1', 3.2, 5), ('JE1', 3.0, 2)])
+        self.assertEqual(Professor.objects.get(pk='JE1').name, 'J. Renamed')
+
+    def test_compact_ratings_list(self):
+        response = self.client.get('/api/ratings-list/?compact=1&page_size=1')
+        self.assertEqual(response.data['results'], [
+            {'id': 'JE1', 'name': 'J. Excellent', 'average_rating': 5.0, 'rating_count': 1}
+        ])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], ['VS1'])
+        self.assertIn('ratings', self.client.get('/api/ratings-list/').data)
+
+
+class AnalyticsTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        later = ModuleInstance.objects.create(module=self.module, year=2018, semester=2)
+        later.professors.add(self.professor)
+        for user, instance, value in [(self.user, self.instance, 5), (self.other_user, self.instance, 2),
+                                      (self.user, later, 4), (self.other_user, later, 4)]:
+            Rating.objects.create(module_instance=instance, professor=self.professor, user=user, rating=value)
+
+    def test_distribution_and_trend(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/analytics/')
+        professor = response.data['professors']['JE1']
+        self.assertEqual(professor['histogram'], {'1': 0, '2': 1, '3': 0, '4': 2, '5': 1})
+        self.assertEqual((professor['count'], professor['mean'], professor['median'], professor['stddev']), (4, 3.75, 4.0, 1.090))
+        self.assertEqual([(term['year'], term['semester'], term['mean']) for term in professor['trend']],
+                         [(2017, 1, 3.5), (2018, 2, 4.0)])
+        self.assertEqual(response.data['modules']['CD1']['count'], 4)
+
+        # Cached until a rating changes
+        with self.assertNumQueries(2):
+            self.client.get('/api/analytics/')
+        Rating.objects.filter(rating=2).get().delete()
+        professor = self.client.get('/api/analytics/').data['professors']['JE1']
+        self.assertEqual((professor['count'], professor['mean']), (3, 4.333))
+        self.assertEqual(self.client.get('/api/analytics/?module_code=XX9').data['professors'], {})
+
+
+@override_settings(RATING_AGGREGATES='deferred')
+class DeferredAggregateTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.second = Professor.objects.create(id='VS1', name='V. Smart')
+        self.instance.professors.add(self.second)
+
+    def drain(self):
+        call_command('run_aggregator', '--once', stdout=StringIO(), stderr=StringIO())
+
+    def test_writes_are_queued_and_coalesced(self):
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=5)
+        rating = Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=2)
+        self.assertEqual(Professor.objects.get(pk='JE1').rating_count, 0)
+        self.assertEqual(list(PendingAggregate.objects.values_list('professor_id', flat=True)), ['JE1'])
+
+        self.drain()
+        professor = Professor.objects.get(pk='JE1')
+        self.assertEqual((professor.rating_count, professor.average_rating), (2, 3.5))
+        self.assertEqual(ProfessorModuleRating.objects.get(pk='3:JE1:CD1').rating_min, 2)
+        self.assertFalse(PendingAggregate.objects.exists())
+
+        # Moving a rating queues both professors
+        rating.professor = self.second
+        rating.save()
+        self.assertEqual(set(PendingAggregate.objects.values_list('professor_id', flat=True)), {'JE1', 'VS1'})
+        self.drain()
+        self.assertEqual(Professor.objects.get(pk='VS1').rating_count, 1)
+        self.assertEqual(Professor.objects.get(pk='JE1').rating_count, 1)
+
+    def test_drain_invalidates_cached_averages(self):
+        client = APIClient()
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+        average = lambda: client.post('/api/average-rating/', {'professor_id': 'JE1', 'module_code': 'CD1'}, format='json')
+        self.assertIsNone(average().data['average_rating'])
+        self.drain()
+        self.assertEqual(average().data['average_rating'], 4.0)
+
+
+class ValuesSerializerTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        second = ModuleInstance.objects.create(module=self.module, year=2018, semester=2)
+        second.professors.add(self.professor, Professor.objects.create(id='VS1', name='V. Smart'))
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=4)
+
+    def test_matches_model_serializer(self):
+        for url, model, serializer_class in [
+            ('/api/professors/', Professor, ProfessorSerializer),
+            ('/api/modules/', Module, ModuleSerializer),
+            ('/api/module-instances/', ModuleInstance, ModuleInstanceSerializer),
+            ('/api/ratings/', Rating, RatingSerializer),
+        ]:
+            expected = serializer_class(model.objects.order_by('pk'), many=True).data
+            self.assertEqual(self.client.get(url).json()['results'], json.loads(json.dumps(expected, cls=JSONEncoder)), url)
+
+    def test_page_query_count(self):
+        # Conditional state (2) plus the page and one for every professor link on it
+        with self.assertNumQueries(4):
+            self.client.get('/api/module-instances/?page_size=1')
+
+    def test_partial_rating_update(self):
+        rating = Rating.objects.get()
+        response = self.client.patch(f'/api/ratings/{rating.pk}/', {'rating': 2}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Professor.objects.get(pk='JE1').average_rating, 2.0)
+
+
+@skipUnless(orjson, 'orjson is not installed')
+class FastJSONRendererTests(SimpleTestCase):
+    def test_matches_stock_renderer(self):
+        data = {
+            'last_updated': timezone.now(),
+            'local': timezone.localtime().replace(tzinfo=None),
+            'day': timezone.now().date(),
+            'name': 'line\u2028paragraph\u2029é',
+            'scores': [1, 2.5, None, True],
+            1: 'non-string key',
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class CatalogueSnapshotTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.other = Professor.objects.create(id='VS1', name='V. Smart')
+
+    def test_warm_lookups_skip_the_database(self):
+        get_snapshot()
+        with self.assertNumQueries(0):
+            self.assertTrue(professor_teaches('JE1', self.instance.pk))
+            self.assertEqual(get_snapshot().resolve('JE1', 'CD1', '1').pk, self.instance.pk)
+
+    def test_unsignalled_assignment_is_found_on_recheck(self):
+        # As if another process had added the assignment
+        get_snapshot()
+        ModuleInstance.professors.through.objects.bulk_create([
+            ModuleInstance.professors.through(moduleinstance=self.instance, professor=self.other)
+        ])
+        self.assertFalse(get_snapshot().teaches('VS1', self.instance.pk))
+        self.assertTrue(professor_teaches('VS1', self.instance.pk))
+
+    @override_settings(RATING_SNAPSHOT_CHECK_INTERVAL=0)
+    def test_rebuilt_only_when_version_moves(self):
+        first = get_snapshot()
+        self.assertIs(get_snapshot(), first)
+        # Bulk writers bump last_updated themselves, as the catalogue import does
+        ModuleInstance.objects.filter(pk=self.instance.pk).update(semester=2, last_updated=timezone.now())
+        rebuilt = get_snapshot()
+        self.assertIsNot(rebuilt, first)
+        self.assertEqual(rebuilt.resolve('JE1', 'CD1', 2).pk, self.instance.pk)
+
+    def test_rating_for_unassigned_professor(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        payload = {'professor_id': 'VS1', 'module_code': 'CD1', 'semester': 1, 'rating': 4}
+        self.assertEqual(client.post('/api/rate/', payload, format='json').status_code, 404)
+        self.instance.professors.add(self.other)
+        self.assertEqual(client.post('/api/rate/', payload, format='json').status_code, 201)
+
+
+class ArchiveTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        self.later = ModuleInstance.objects.create(module=self.module, year=2018, semester=2)
+        self.later.professors.add(self.professor)
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=5)
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=2)
+        Rating.objects.create(module_instance=self.later, professor=self.professor, user=self.user, rating=4)
+
+    def totals(self):
+        professor = Professor.objects.get(pk='JE1')
+        aggregate = ProfessorModuleRating.objects.get(pk='3:JE1:CD1')
+        return (professor.rating_sum, professor.rating_count,
+                aggregate.rating_sum, aggregate.rating_count, aggregate.rating_min, aggregate.rating_max)
+
+    def test_requires_the_setting(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_ratings', stdout=StringIO(), stderr=StringIO())
+
+    @override_settings(RATING_ARCHIVE_BEFORE_YEAR=2018)
+    def test_all_time_figures_survive(self):
+        before = self.totals()
+        call_command('archive_ratings', batch_size=1, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(list(Rating.objects.values_list('module_instance__year', flat=True)), [2018])
+        self.assertEqual(ArchivedRating.objects.count(), 2)
+        self.assertEqual(ArchivedAggregate.objects.get(pk='3:JE1:CD1').rating_count, 2)
+        self.assertEqual(self.totals(), before)
+
+        # Recomputes add the frozen totals back in
+        Professor.recompute_aggregates()
+        ProfessorModuleRating.recompute()
+        self.assertEqual(self.totals(), before)
+        rating = Rating.objects.get()
+        rating.delete()
+        self.assertEqual(self.totals(), (7, 2, 7, 2, 2, 5))
+
+    @override_settings(RATING_ARCHIVE_BEFORE_YEAR=2018)
+    def test_invalidates_once_per_batch(self):
+        with mock.patch('ratings.signals.invalidate_responses') as per_row, \
+                mock.patch('ratings.archive.invalidate_responses') as per_batch:
+            call_command('archive_ratings', batch_size=1, stdout=StringIO(), stderr=StringIO())
+        per_row.assert_not_called()
+        self.assertEqual(per_batch.call_args_list, [mock.call('rating', 'rating:JE1')] * 2)
+
+    @override_settings(RATING_ARCHIVE_BEFORE_YEAR=2018)
+    def test_reads_merge_the_archive(self):
+        call_command('archive_ratings', stdout=StringIO(), stderr=StringIO())
+        leaderboard = self.client.get('/api/leaderboard/?year=2017').data['leaderboard']
+        self.assertEqual([(row['professor_id'], row['rating_count']) for row in leaderboard], [('JE1', 2)])
+        analytics = self.client.get('/api/analytics/').data
+        self.assertEqual(analytics['professors']['JE1']['count'], 3)
+        body = b''.join(self.client.get('/api/export/ratings/').streaming_content).decode()
+        self.assertEqual(len(body.splitlines()), 3)
+
+        # The rating resource serves the editable, open-year rows only
+        archived_id = ArchivedRating.objects.values_list('pk', flat=True).first()
+        self.assertEqual(self.client.get(f'/api/ratings/{archived_id}/').status_code, 404)
+        listed = [row['id'] for row in self.client.get('/api/ratings/').data['results']]
+        self.assertEqual(listed, list(Rating.objects.values_list('pk', flat=True)))
+
+        # Only the open years take new ratings
+        self.client.force_authenticate(self.user)
+        payload = {'professor_id': 'JE1', 'module_code': 'CD1', 'year': 2017, 'semester': 1, 'rating': 3}
+        response = self.client.post('/api/rate/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], 'Ratings for archived years are closed')
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        caches[CACHE_ALIAS].clear()
+        clear_snapshot()
+        clear_search_index()
+
+    def test_seed_dataset(self):
+        dataset = seed_dataset(professors=12, modules=4, ratings=150, instances_per_module=3, professors_per_instance=2)
+        self.assertEqual(dataset, {
+            'professors': 12, 'modules': 4, 'module_instances': 12, 'assignments': 24, 'users': 7, 'ratings': 150,
+        })
+        self.assertEqual(Professor.objects.count(), 12)
+        self.assertEqual(Module.objects.count(), 4)
+        self.assertEqual(ModuleInstance.objects.count(), 12)
+        self.assertEqual(ModuleInstance.professors.through.objects.count(), 24)
+        self.assertEqual(User.objects.count(), 7)
+        self.assertEqual(Rating.objects.count(), 150)
+
+        # The seeded aggregates are exactly what a recompute produces
+        def module_totals():
+            return list(ProfessorModuleRating.objects.order_by('pk').values_list(
+                'pk', 'rating_sum', 'rating_count', 'rating_min', 'rating_max', 'bayesian_score'
+            ))
+
+        seeded = module_totals()
+        self.assertEqual(Professor.recompute_aggregates(), 0)
+        ProfessorModuleRating.recompute()
+        self.assertEqual(module_totals(), seeded)
+        self.assertEqual(sum(Professor.objects.values_list('rating_count', flat=True)), 150)
+
+    def test_bench_command(self):
+        # The suite already runs on a test database, so bench must not set up its own
+        command = 'ratings.management.commands.bench'
+        with mock.patch(f'{command}.setup_test_environment'), mock.patch(f'{command}.teardown_test_environment'), \
+                mock.patch(f'{command}.setup_databases'), mock.patch(f'{command}.teardown_databases'), \
+                tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'bench.json'
+            call_command(
+                'bench', professors=10, modules=3, ratings=60, iterations=2, json_path=str(path),
+                stdout=StringIO(), stderr=StringIO(),
+            )
+            report = json.loads(path.read_text())
+        self.assertEqual(report['dataset']['ratings'], 60)
+        endpoints = report['endpoints']
+        self.assertIn('list_modules:warm', endpoints)
+        for name, stats in endpoints.items():
+            self.assertEqual(stats['iterations'], 2, name)
+            self.assertFalse([code for code in stats['statuses'] if code.startswith('5')], name)
+        # Cold rows pay for the listing, warm rows are served from the cache
+        self.assertGreater(endpoints['list_modules']['queries_median'], 0)
+        self.assertEqual(endpoints['list_modules:warm']['queries_median'], 0)
+
+
+class LoadTestHarnessTests(CatalogueMixin, LiveServerTestCase):
+    # The server reads through the replica alias under the production profile
+    databases = '__all__'
+
+    def setUp(self):
+        self.create_catalogue()
+
+    def test_replays_every_scenario(self):
+        report = asyncio.run(run_load(
+            self.live_server_url, parse_mix('rate=1,list_modules=1,average_rating=1'), concurrency=2, scenarios=12
+        ))
+        self.assertEqual(sum(report['scenarios'].values()), 12)
+        self.assertEqual(report['error_rate'], 0.0)
+        endpoints = report['endpoints']
+        # Every rating goes to the one assignment, under a fresh user each time
+        self.assertEqual(set(endpoints['rate']['statuses']), {'201'})
+        self.assertEqual(Rating.objects.count(), endpoints['rate']['requests'])
+        self.assertEqual(endpoints['register']['requests'], report['scenarios']['rate'])
+        # Repeated polls on a connection are answered 304
+        self.assertIn('304', endpoints['list_modules']['statuses'])
+
+    def test_stalled_responses_time_out(self):
+        async def stall():
+            async def accept(reader, writer):
+                await reader.read()
+
+            server = await asyncio.start_server(accept, '127.0.0.1', 0)
+            async with server:
+                connection = HTTPConnection('127.0.0.1', server.sockets[0].getsockname()[1], timeout=0.2)
+                recorder = Recorder()
+                status, _, _ = await recorder.call(connection, 'stalled', 'GET', '/')
+                await connection.close()
+            return status, recorder.report(1.0)
+
+        status, report = asyncio.run(stall())
+        self.assertEqual(status, 0)
+        self.assertEqual((report['endpoints']['stalled']['timeouts'], report['error_rate']), (1, 1.0))
+
+    def test_mix_validation(self):
+        with self.assertRaises(ValueError):
+            parse_mix('rate=1,unknown=2')
+        self.assertEqual(parse_mix('rate,average_rating=3'), {'rate': 1.0, 'average_rating': 3.0})
+
+
+class AdminTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.admin = User.objects.create_superuser(username='admin', password='pass12345')
+        self.client.force_login(self.admin)
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.user, rating=5)
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(context.captured_queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        baseline = {url: self.changelist_queries(url) for url in ['/admin/ratings/rating/', '/admin/ratings/moduleinstance/']}
+        later = ModuleInstance.objects.create(module=Module.objects.create(code='PG1', name='Programming'), year=2018, semester=2)
+        later.professors.add(self.professor)
+        for user in [self.other_user, self.admin]:
+            Rating.objects.create(module_instance=later, professor=self.professor, user=user, rating=3)
+        for url, queries in baseline.items():
+            self.assertEqual(self.changelist_queries(url), queries, url)
+
+        # Professor and module instance are left out of the sidebar filters,
+        # but the changelist still narrows by them from the URL
+        response = self.client.get(f'/admin/ratings/rating/?professor=JE1&module_instance={later.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_bulk_delete_recomputes_aggregates(self):
+        Rating.objects.create(module_instance=self.instance, professor=self.professor, user=self.other_user, rating=1)
+        first = Rating.objects.order_by('pk').first()
+        self.client.post('/admin/ratings/rating/', {
+            'action': 'delete_selected', '_selected_action': [first.pk], 'post': 'yes'
+        })
+        self.assertEqual(Rating.objects.count(), 1)
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count), (1, 1))
+        self.assertEqual(ProfessorModuleRating.objects.get(pk='3:JE1:CD1').rating_max, 1)
+
+    def test_cascade_delete_recomputes_aggregates(self):
+        self.client.post(f'/admin/ratings/moduleinstance/{self.instance.pk}/delete/', {'post': 'yes'})
+        self.professor.refresh_from_db()
+        self.assertEqual((self.professor.rating_sum, self.professor.rating_count, self.professor.average_rating), (0, 0, 0.0))
+
+    def test_estimated_count(self):
+        # No statistics until ANALYZE has run
+        self.assertIsNone(ratings_admin.estimated_count(Rating, 'default'))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.assertEqual(ratings_admin.estimated_count(Rating, 'default'), 1)
+
+        def count(queryset):
+            return ratings_admin.EstimatedCountPaginator(queryset, 100).count
+
+        with mock.patch.object(ratings_admin, 'estimated_count', return_value=250000):
+            self.assertEqual(count(Rating.objects.order_by('pk')), 250000)
+            # Filtered pages are counted exactly
+            self.assertEqual(count(Rating.objects.filter(rating=5).order_by('pk')), 1)
+        with mock.patch.object(ratings_admin, 'estimated_count', return_value=50):
+            self.assertEqual(count(Rating.objects.order_by('pk')), 1)
+
+
+class SearchTests(CatalogueMixin, TestCase):
+    def setUp(self):
+        self.create_catalogue()
+        self.client = APIClient()
+        Professor.objects.create(id='EX2', name='Ex Ample')
+        Professor.objects.create(id='VS1', name='Valerie Smart')
+        Module.objects.create(code='PG1', name='Programming for Experts')
+
+    def search(self, query):
+        response = self.client.get(f'/api/search/{query}')
+        self.assertEqual(response.status_code, 200)
+        return [(row['type'], row['id']) for row in response.data['results']]
+
+    def test_prefix_matches_ids_and_names(self):
+        self.assertEqual(self.search('?q=val'), [('professor', 'VS1')])
+        self.assertEqual(self.search('?q=pg'), [('module', 'PG1')])
+        self.assertEqual(self.search('?q=Comp dumm'), [('module', 'CD1')])
+        # Whole words outrank completions, and shorter completions longer ones
+        self.assertEqual(self.search('?q=ex'), [('professor', 'EX2'), ('module', 'PG1'), ('professor', 'JE1')])
+        self.assertEqual(self.search('?q=ex&type=module'), [('module', 'PG1')])
+        self.assertEqual(self.search('?q=ex&limit=1'), [('professor', 'EX2')])
+
+    def test_typos(self):
+        self.assertEqual(self.search('?q=excelent'), [('professor', 'JE1')])
+        self.assertEqual(self.search('?q=vlaerie smrt'), [('professor', 'VS1')])
+        self.assertEqual(self.search('?q=progarm'), [('module', 'PG1')])
+        self.assertEqual(self.search('?q=zzzz'), [])
+
+    def test_index_follows_catalogue_changes(self):
+        self.search('?q=val')
+        with self.assertNumQueries(0):
+            self.search('?q=val')
+        Professor.objects.filter(pk='VS1').delete()
+        self.assertEqual(self.search('?q=val'), [])
+        call_command('import_catalogue', professors=self.write_csv('id,name\nVS2,Valentina Bright\n'), stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(self.search('?q=valentina'), [('professor', 'VS2')])
+
+    def write_csv(self, content):
+        directory = tempfile.mkdtemp()
+        path = Path(directory) / 'professors.csv'
+        path.write_text(content)
+        return str(path)
+
+    def test_validation(self):
+        self.assertEqual(self.client.get('/api/search/').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?q=ex&type=room').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?q=ex&limit=many').status_code, 400)
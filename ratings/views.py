@@ -3,18 +3,51 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.parsers import JSONParser
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import Professor, Module, ModuleInstance, Rating
-from .serializers import ProfessorSerializer, ModuleSerializer, ModuleInstanceSerializer, RatingSerializer
+from .models import Professor, Module, ModuleInstance, ProfessorModuleRating, Rating, bayesian_score, bayesian_score_expression
+from .pagination import KeysetPagination
+from .analytics import rating_analytics
+from .archive import rating_sources
+from .catalogue import get_module_listing
+from .conditional import ConditionalGetMixin, ConditionalModelViewSetMixin, queryset_state
+from .ingest import RatingImport
+from .parsers import NDJSONParser
+from .renderers import CSVRenderer, NDJSONRenderer
+from .response_cache import CachedResponseMixin, get_or_build
+from .search import search_catalogue
+from .snapshot import NotTeaching, resolve_module_instance
+from .serializers import ProfessorSerializer, ModuleSerializer, ModuleInstanceSerializer, RatingSerializer, ValuesSerializer
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from django.db import IntegrityError
-from django.db.models import Avg
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from datetime import datetime
+from itertools import chain
 import json
 
-class ProfessorViewSet(viewsets.ModelViewSet):
+class ValuesListMixin:
+    # list() straight from values() rows through ValuesSerializer, unless a
+    # field needs the full serializer
+    def list(self, request, *args, **kwargs):
+        fast = ValuesSerializer.for_serializer(self.get_serializer())
+        if fast is None:
+            return super().list(request, *args, **kwargs)
+        queryset = fast.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(fast.serialize(page))
+        return Response(fast.serialize(queryset))
+
+class ProfessorViewSet(CachedResponseMixin, ConditionalModelViewSetMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Professor.objects.all()
     serializer_class = ProfessorSerializer
+    # The serialized averages move with every rating
+    cache_scopes = ('professor', 'rating', 'aggregates')
 
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
@@ -22,9 +55,10 @@ class ProfessorViewSet(viewsets.ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
-class ModuleViewSet(viewsets.ModelViewSet):
+class ModuleViewSet(CachedResponseMixin, ConditionalModelViewSetMixin, ValuesListMixin, viewsets.ModelViewSet):
     queryset = Module.objects.all()
     serializer_class = ModuleSerializer
+    cache_scopes = ('module',)
 
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
@@ -32,8 +66,8 @@ class ModuleViewSet(viewsets.ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
-class ModuleInstanceViewSet(viewsets.ModelViewSet):
-    queryset = ModuleInstance.objects.all()
+class ModuleInstanceViewSet(ConditionalModelViewSetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = ModuleInstance.objects.prefetch_related('professors')
     serializer_class = ModuleInstanceSerializer
 
     def list(self, request, *args, **kwargs):
@@ -42,7 +76,10 @@ class ModuleInstanceViewSet(viewsets.ModelViewSet):
     def retrieve(self, request, *args, **kwargs):
         return super().retrieve(request, *args, **kwargs)
 
-class RatingViewSet(viewsets.ModelViewSet):
+class RatingViewSet(ConditionalModelViewSetMixin, ValuesListMixin, viewsets.ModelViewSet):
+    # The editable, open-year ratings only: archived ratings are read-only and
+    # reach clients through the merged reads in archive.py (leaderboard,
+    # analytics, export), so their ids answer 404 here
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
 
@@ -89,71 +126,87 @@ class RateProfessorView(APIView):
     def post(self, request):
         data = request.data
         professor_id = data.get('professor_id')
-        user_name = data.get('user_name')
         module_code = data.get('module_code')
         rating_value = data.get('rating')
         semester = data.get('semester')
+        year = data.get('year')
 
         try:
-            professor = Professor.objects.get(id=professor_id)
-            user = User.objects.get(username=user_name)
-            module = Module.objects.get(code=module_code)
-            module_instance = ModuleInstance.objects.get(module=module, semester=semester)
-
-            # Check if the professor is associated with the module instance
-            if not module_instance.professors.filter(id=professor_id).exists():
-                return Response({'status': 'error', 'message': 'Professor is not teaching this module instance'}, status=status.HTTP_404_NOT_FOUND)
+            rating_value = int(rating_value)
+        except (TypeError, ValueError):
+            return Response({'status': 'error', 'message': 'Rating must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Check if a rating already exists
-            if Rating.objects.filter(professor=professor, user=user, module_instance=module_instance).exists():
-                return Response({'status': 'error', 'message': 'Rating already exists and cannot be updated'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Create the rating
-            rating = Rating.objects.create(
-                professor=professor,
-                user=user,
+        try:
+            # Resolved before the transaction starts, so a snapshot check or
+            # rebuild never holds the write lock
+            module_instance = self.resolve_module_instance(professor_id, module_code, semester, year)
+
+            # The rating is always recorded against the authenticated user;
+            # the unique constraint rejects repeats, no exists() needed.
+            rating = Rating(
+                professor_id=professor_id,
+                user=request.user,
                 module_instance=module_instance,
                 rating=rating_value
             )
+            with transaction.atomic():
+                rating.save(check_membership=False)
 
             last_modified = rating.last_updated.strftime('%a, %d %b %Y %H:%M:%S GMT')
 
             response = Response({'status': 'success', 'message': 'Rating added', 'rating_id': rating.id}, status=status.HTTP_201_CREATED)
             response['Last-Modified'] = last_modified
             return response
+        except NotTeaching:
+            return Response({'status': 'error', 'message': 'Professor is not teaching this module instance'}, status=status.HTTP_404_NOT_FOUND)
+        except IntegrityError:
+            return Response({'status': 'error', 'message': 'Rating already exists and cannot be updated'}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({'status': 'error', 'message': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
         except Professor.DoesNotExist:
             return Response({'status': 'error', 'message': 'Professor not found'}, status=status.HTTP_404_NOT_FOUND)
-        except User.DoesNotExist:
-            return Response({'status': 'error', 'message': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
         except ModuleInstance.DoesNotExist:
             return Response({'status': 'error', 'message': 'Module instance not found'}, status=status.HTTP_404_NOT_FOUND)
+        except ModuleInstance.MultipleObjectsReturned:
+            return Response({'status': 'error', 'message': 'Module instance is ambiguous, year is required'}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'status': 'error', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class ListModulesView(APIView):
+    def resolve_module_instance(self, professor_id, module_code, semester, year):
+        # Answered from the worker's catalogue snapshot, without a query
+        record = resolve_module_instance(professor_id, module_code, semester, year)
+        return ModuleInstance(pk=record.pk, module_id=record.module_code, year=record.year, semester=record.semester)
+
+class BulkRateProfessorView(APIView):
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'status': 'error', 'message': 'Expected a JSON array or NDJSON body'}, status=status.HTTP_400_BAD_REQUEST)
+
+        report = RatingImport(rows, request.user).run()
+        counts = {'created': 0, 'duplicate': 0, 'error': 0}
+        for entry in report:
+            counts[entry['status']] += 1
+        return Response({
+            'status': 'success',
+            'created': counts['created'],
+            'duplicates': counts['duplicate'],
+            'errors': counts['error'],
+            'rows': report,
+        }, status=status.HTTP_200_OK)
+
+class ListModulesView(ConditionalGetMixin, APIView):
     permission_classes = [AllowAny]
 
     def get(self, request):
         try:
-            module_instances = ModuleInstance.objects.all()
-            result = []
-
-            for instance in module_instances:
-                professors = instance.professors.all()  # Assuming a ManyToManyField relationship
-                professor_names = ', '.join([f"Professor {prof.name} ({prof.id})" for prof in professors])
-                result.append({
-                    'code': instance.module.code,
-                    'name': instance.module.name,
-                    'year': instance.year,
-                    'semester': instance.semester,
-                    'taught_by': professor_names
-                })
-
-            response = Response(result, status=status.HTTP_200_OK)
-            if module_instances.exists():
-                last_modified = module_instances.latest('last_updated').last_updated
-                response['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
-            return response
+            result, last_modified, digest = get_module_listing()
+            return self.conditional_response(
+                request, last_modified, digest, lambda: Response(result, status=status.HTTP_200_OK)
+            )
         except ModuleInstance.DoesNotExist:
             return Response({'status': 'error', 'message': 'Module instance not found'}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
@@ -170,37 +223,278 @@ class AverageRatingView(APIView):
             return Response({'status': 'error', 'message': 'Professor ID and Module ID are required'}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            professor = Professor.objects.get(id=professor_id)
-            module = Module.objects.get(code=module_code)
+            payload = get_or_build(
+                'average_rating', (professor_id, module_code),
+                (f'professor:{professor_id}', f'rating:{professor_id}', 'module', 'aggregates'),
+                lambda: self.lookup(professor_id, module_code)
+            )
         except Professor.DoesNotExist:
             return Response({'status': 'error', 'message': 'Professor not found'}, status=status.HTTP_404_NOT_FOUND)
         except Module.DoesNotExist:
             return Response({'status': 'error', 'message': 'Module not found'}, status=status.HTTP_404_NOT_FOUND)
 
-        # Filter ratings by professor and module
-        ratings = Rating.objects.filter(professor=professor, module_instance__module=module)
-        average_rating = ratings.aggregate(Avg('rating'))['rating__avg']
+        return Response(payload, status=status.HTTP_200_OK)
 
-        return Response({
+    @staticmethod
+    def lookup(professor_id, module_code):
+        try:
+            aggregate = ProfessorModuleRating.objects.select_related('professor', 'module').get(
+                pk=ProfessorModuleRating.make_key(professor_id, module_code)
+            )
+            professor, module, average_rating = aggregate.professor, aggregate.module, aggregate.average_rating
+        except ProfessorModuleRating.DoesNotExist:
+            # No ratings yet for this pair, so only existence needs checking
+            professor = Professor.objects.get(id=professor_id)
+            module = Module.objects.get(code=module_code)
+            average_rating = None
+
+        return {
             'status': 'success',
             'average_rating': average_rating,
             'module_name': module.name,
             'professor_name': professor.name
-        }, status=status.HTTP_200_OK)
+        }
 
 
-class RatingsListView(APIView):
+class RatingsListView(CachedResponseMixin, ConditionalGetMixin, APIView):
     permission_classes = [AllowAny]
+    cache_scopes = ('professor', 'rating', 'aggregates')
     def get(self, request):
         try:
             professors = Professor.objects.all()
-            result = []
+            if request.query_params.get('compact') in ('1', 'true'):
+                build = lambda: self.build_compact_response(request, professors)
+            else:
+                build = lambda: self.build_response(professors)
+            return self.conditional_queryset_response(request, professors, build)
+        except Exception as e:
+            return Response({'status': 'error', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-            for professor in professors:
-                average_rating = professor.average_rating
-                stars = '★' * round(average_rating) if average_rating else 'no ratings'
-                result.append(f"The rating of Professor {professor.name} ({professor.id}) is {stars}")
+    def build_compact_response(self, request, professors):
+        # ?compact=1: plain fields instead of sentences, one keyset page at a time
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(
+            professors.only('id', 'name', 'average_rating', 'rating_count'), request, view=self
+        )
+        return paginator.get_paginated_response([
+            {
+                'id': professor.id,
+                'name': professor.name,
+                'average_rating': professor.average_rating,
+                'rating_count': professor.rating_count,
+            }
+            for professor in page
+        ])
+
+    def build_response(self, professors):
+        result = []
+
+        for professor in professors:
+            result.append(self.describe(professor))
+
+        return Response({'status': 'success', 'ratings': result}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def describe(professor):
+        average_rating = professor.average_rating
+        stars = '★' * round(average_rating) if average_rating else 'no ratings'
+        return f"The rating of Professor {professor.name} ({professor.id}) is {stars}"
+
+
+class LeaderboardView(APIView):
+    # Top professors by Bayesian-adjusted score. Unfiltered and per-module
+    # rankings are read in order from the score indexes on Professor and
+    # ProfessorModuleRating; a year or semester filter aggregates the matching
+    # ratings instead.
+    permission_classes = [AllowAny]
+    DEFAULT_LIMIT = 20
+    MAX_LIMIT = 100
 
-            return Response({'status': 'success', 'ratings': result}, status=status.HTTP_200_OK)
-        except Exception as e:
-            return Response({'status': 'error', 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+    def get(self, request):
+        params = request.query_params
+        try:
+            limit = max(1, min(int(params.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT))
+            min_ratings = int(params.get('min_ratings', 1))
+            year = int(params['year']) if params.get('year') else None
+            semester = int(params['semester']) if params.get('semester') else None
+        except ValueError:
+            return Response({'status': 'error', 'message': 'limit, min_ratings, year and semester must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        module_code = params.get('module_code') or None
+
+        leaderboard = get_or_build(
+            'leaderboard', (module_code, year, semester, min_ratings, limit), ('professor', 'rating', 'aggregates'),
+            lambda: self.rank(module_code, year, semester, min_ratings, limit)
+        )
+        return Response({'status': 'success', 'leaderboard': leaderboard}, status=status.HTTP_200_OK)
+
+    @staticmethod
+    def rank(module_code, year, semester, min_ratings, limit):
+        fields = ['professor_id', 'professor__name', 'bayesian_score', 'rating_sum', 'rating_count']
+        if year is None and semester is None:
+            if module_code:
+                rows = ProfessorModuleRating.objects.filter(module_id=module_code, rating_count__gte=min_ratings).order_by(
+                    '-bayesian_score', 'professor_id'
+                ).values_list(*fields)
+            else:
+                rows = Professor.objects.filter(rating_count__gte=min_ratings).order_by('-bayesian_score', 'id').values_list(
+                    'id', 'name', 'bayesian_score', 'rating_sum', 'rating_count'
+                )
+        else:
+            sources = []
+            for ratings in rating_sources(year):
+                if module_code:
+                    ratings = ratings.filter(module_instance__module_id=module_code)
+                if year is not None:
+                    ratings = ratings.filter(module_instance__year=year)
+                if semester is not None:
+                    ratings = ratings.filter(module_instance__semester=semester)
+                sources.append(ratings.values('professor_id', 'professor__name').annotate(total=Sum('rating'), count=Count('id')))
+            if len(sources) == 1:
+                rows = sources[0].filter(count__gte=max(min_ratings, 1)).annotate(
+                    score=bayesian_score_expression(F('total'), F('count'))
+                ).order_by('-score', 'professor_id').values_list('professor_id', 'professor__name', 'score', 'total', 'count')
+            else:
+                # Archived years: the per-table groups are merged and ranked here
+                totals = {}
+                for source in sources:
+                    for row in source:
+                        name, total, count = totals.get(row['professor_id'], (row['professor__name'], 0, 0))
+                        totals[row['professor_id']] = (name, total + row['total'], count + row['count'])
+                rows = sorted(
+                    (
+                        (professor_id, name, bayesian_score(total, count), total, count)
+                        for professor_id, (name, total, count) in totals.items()
+                        if count >= max(min_ratings, 1)
+                    ),
+                    key=lambda row: (-row[2], row[0])
+                )
+
+        return [
+            {
+                'rank': rank,
+                'professor_id': professor_id,
+                'name': name,
+                'score': round(score, 3),
+                'average_rating': round(total / count, 2) if count else None,
+                'rating_count': count,
+            }
+            for rank, (professor_id, name, score, total, count) in enumerate(rows[:limit], 1)
+        ]
+
+
+class SearchView(APIView):
+    # Ranked professors and modules for ?q=, matched by prefix or with a typo
+    # or two, from the in-process index in search.py. ?type=professor|module
+    # narrows the results.
+    permission_classes = [AllowAny]
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 50
+    TYPES = ('professor', 'module')
+
+    def get(self, request):
+        params = request.query_params
+        query = params.get('q', '').strip()
+        if not query:
+            return Response({'status': 'error', 'message': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        kind = params.get('type') or None
+        if kind is not None and kind not in self.TYPES:
+            return Response({'status': 'error', 'message': 'type must be professor or module'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, min(int(params.get('limit', self.DEFAULT_LIMIT)), self.MAX_LIMIT))
+        except ValueError:
+            return Response({'status': 'error', 'message': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = search_catalogue(query, limit, kind)
+        return Response({'status': 'success', 'query': query, 'results': results}, status=status.HTTP_200_OK)
+
+
+class AnalyticsView(ConditionalGetMixin, APIView):
+    # Histogram, mean, median, standard deviation and per-term trend for every
+    # professor and module. Both the ETag and the cache key follow the newest
+    # Rating.last_updated plus the row count, so any rating write rebuilds it.
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        professor_id = request.query_params.get('professor_id') or None
+        module_code = request.query_params.get('module_code') or None
+        ratings = self.filter(Rating.objects.all(), professor_id, module_code)
+
+        last_modified, count = queryset_state(ratings)
+        version = (last_modified, count)
+
+        def build():
+            # Archived ratings only move, so the hot table's state versions them too
+            sources = [self.filter(source, professor_id, module_code) for source in rating_sources()]
+            analytics = get_or_build(
+                'analytics', (professor_id, module_code, repr(version)), (), lambda: rating_analytics(*sources)
+            )
+            return Response(dict(status='success', **analytics), status=status.HTTP_200_OK)
+
+        return self.conditional_response(request, last_modified, version, build)
+
+    @staticmethod
+    def filter(ratings, professor_id, module_code):
+        if professor_id:
+            ratings = ratings.filter(professor_id=professor_id)
+        if module_code:
+            ratings = ratings.filter(module_instance__module_id=module_code)
+        return ratings
+
+
+class RatingExportView(APIView):
+    # Streams every matching rating as NDJSON (default) or CSV, picked by the
+    # Accept header or ?format=ndjson|csv. Rows are read in chunks from one
+    # pre-joined values_list() query, so memory stays flat however big the
+    # table gets. Archived ratings, if any, come first.
+    permission_classes = [AllowAny]
+    renderer_classes = [NDJSONRenderer, CSVRenderer]
+    CHUNK_SIZE = 2000
+    FIELDS = [
+        ('id', 'id'),
+        ('professor_id', 'professor_id'),
+        ('module_code', 'module_instance__module_id'),
+        ('year', 'module_instance__year'),
+        ('semester', 'module_instance__semester'),
+        ('rating', 'rating'),
+        ('last_updated', 'last_updated'),
+    ]
+
+    def get(self, request):
+        filters = {}
+        since = request.query_params.get('since')
+        if since:
+            moment = self.parse_since(since)
+            if moment is None:
+                return Response({'status': 'error', 'message': 'since must be an ISO 8601 date or datetime'}, status=status.HTTP_400_BAD_REQUEST)
+            filters['last_updated__gte'] = moment
+        if request.query_params.get('professor_id'):
+            filters['professor_id'] = request.query_params['professor_id']
+        if request.query_params.get('module_code'):
+            filters['module_instance__module_id'] = request.query_params['module_code']
+
+        lookups = [lookup for _, lookup in self.FIELDS]
+        rows = chain.from_iterable(
+            ratings.filter(**filters).order_by('pk').values_list(*lookups).iterator(chunk_size=self.CHUNK_SIZE)
+            for ratings in reversed(rating_sources())
+        )
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream([name for name, _ in self.FIELDS], rows),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = f'attachment; filename="ratings.{renderer.format}"'
+        return response
+
+    @staticmethod
+    def parse_since(value):
+        # Dates mean midnight and naive datetimes the current time zone
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                moment = day and datetime.combine(day, datetime.min.time())
+        except ValueError:
+            return None
+        if moment is not None and timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment